@@ -0,0 +1,4 @@
+"""Items api, the import start time is kept to report Lambda cold starts"""
+import time
+
+IMPORT_STARTED = time.perf_counter()
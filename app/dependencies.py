@@ -0,0 +1,43 @@
+"""Dependencies shared by the routers"""
+import math
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from app.models.item_query import ItemQuery
+
+
+def item_query(
+    # pylint: disable=too-many-arguments
+    name_prefix: str | None = None,
+    price: int | None = None,
+    price_gte: int | None = None,
+    price_lte: int | None = None,
+    tax: float | None = None,
+    tax_gte: float | None = None,
+    tax_lte: float | None = None,
+    sort: str | None = None,
+    fields: str | None = None,
+) -> ItemQuery:
+    """Validate the list filters, sort and projection query parameters"""
+    try:
+        return ItemQuery(
+            name_prefix=name_prefix,
+            price=price,
+            price_gte=price_gte,
+            price_lte=price_lte,
+            tax=tax,
+            tax_gte=tax_gte,
+            tax_lte=tax_lte,
+            sort=sort or [],
+            fields=fields,
+        )
+    except ValidationError as exc:
+        errors = []
+        for error in exc.errors(include_url=False):
+            error = {**error, "loc": ("query", *error["loc"])}
+            # nan and inf can not be sent back as JSON, they are sent as text
+            if isinstance(error.get("input"), float) and not math.isfinite(
+                error["input"]
+            ):
+                error["input"] = str(error["input"])
+            errors.append(error)
+        raise RequestValidationError(errors) from exc
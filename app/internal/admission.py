@@ -0,0 +1,282 @@
+"""Admission control, capping the requests in flight and rate limiting each client
+
+  ADMISSION_MAX_IN_FLIGHT     requests handled at once (default 0, no cap)
+  ADMISSION_QUEUE_SIZE        requests left waiting for a slot (default 100)
+  ADMISSION_QUEUE_TIMEOUT_MS  longest a request waits for a slot (default 1000)
+  ADMISSION_ROUTE_LIMITS      caps of their own for some routes, e.g.
+                              "POST /items/bulk=4,PUT /items/bulk=4"
+  RATE_LIMIT_PER_SECOND       requests each client may make a second (default 0, off)
+  RATE_LIMIT_BURST            requests a client may make at once (default the rate)
+  RATE_LIMIT_CLIENT_HEADER    header naming the client, e.g. x-api-key (default
+                              the client address)
+
+Under a burst, letting every request through only moves the queue into the
+MongoDb connection pool, where every request waits and latency grows for all
+of them. Instead each request takes a slot, first from the global gate then
+from its route's gate, if it has one. When the slots are taken it waits in a
+bounded queue, and once the queue is full, or it has waited too long, it gets
+503 with Retry-After straight away.
+
+Each client has a token bucket, refilled at the rate, and a client with an
+empty bucket gets 429 with Retry-After. The buckets are in process, a
+RateLimitStore sharing them between instances (e.g. in Redis) can be swapped
+in.
+
+/metrics, /stats and /items/events (a long lived stream) are let straight
+through.
+"""
+import asyncio
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from starlette.datastructures import Headers
+from starlette.routing import Match
+from app.internal.metrics import Metrics
+
+
+class Overloaded(Exception):
+    """Raised when a request can not be given a slot"""
+
+
+def parse_route_limits(value: str) -> dict[str, int]:
+    """Parse "METHOD /path=limit,..." into a limit for each "METHOD /path" """
+    limits = {}
+    for entry in value.split(","):
+        if entry.strip():
+            route, _, limit = entry.rpartition("=")
+            method, _, path = route.strip().partition(" ")
+            limits[f"{method.upper()} {path.strip()}"] = int(limit)
+    return limits
+
+
+class Gate:
+    # pylint: disable=too-many-instance-attributes
+    """Lets limit requests in at a time, with up to queue_size more waiting"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queue_full = 0
+        self.queue_timeouts = 0
+
+    async def acquire(self) -> float:
+        """Take a slot, waiting for one if need be, returning the seconds waited
+
+        Raises Overloaded if the queue is full, or no slot came up in time
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return 0.0
+        if len(self._waiters) >= self.queue_size:
+            self.queue_full += 1
+            raise Overloaded(f"The {self.name} queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise Overloaded(f"Timed out in the {self.name} queue") from None
+        except asyncio.CancelledError:
+            # The slot was handed over just as the request went away
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+        self.admitted += 1
+        return time.perf_counter() - started
+
+    def release(self) -> None:
+        """Give up a slot, handing it to the request waiting longest"""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """Return the slots in use, the queue length and the counters"""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "queue_full": self.queue_full,
+            "queue_timeouts": self.queue_timeouts,
+        }
+
+
+class RateLimitStore(ABC):
+    # pylint: disable=too-few-public-methods
+    """Where the client token buckets are kept"""
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token from a client's bucket
+
+        Returns 0 if there was one, otherwise the seconds until there will be
+        """
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    # pylint: disable=too-few-public-methods
+    """Token buckets kept in process, forgetting the least recently seen clients"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        # Tokens left, and when they were counted, for each client
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        tokens, counted = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - counted) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class Admission:
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    """The gates and the rate limit, shared by every request to the app"""
+
+    def __init__(
+        self,
+        max_in_flight: int = 0,
+        queue_size: int = 100,
+        queue_timeout: float = 1.0,
+        route_limits: dict[str, int] | None = None,
+        rate: float = 0.0,
+        burst: float = 0.0,
+        client_header: str = "",
+        store: RateLimitStore | None = None,
+    ):
+        self.gate = (
+            Gate("global", max_in_flight, queue_size, queue_timeout)
+            if max_in_flight > 0
+            else None
+        )
+        self.route_gates = {
+            route: Gate(route, limit, queue_size, queue_timeout)
+            for route, limit in (route_limits or {}).items()
+        }
+        self.rate = rate
+        # A bucket has to hold a whole token, or no request would get through
+        self.burst = max(burst or rate, 1.0)
+        self.client_header = client_header.lower()
+        self.store = store or MemoryRateLimitStore()
+        self.rate_limited = 0
+        # Set by app_factory, used to find the gates of the limited routes
+        self.routes: list = []
+
+    def client(self, scope) -> str:
+        """Return the key of the client making a request"""
+        if self.client_header:
+            value = Headers(scope=scope).get(self.client_header)
+            if value:
+                return value
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def rate_limit(self, scope) -> float:
+        """Take a token for the client, returning the seconds to wait if there is none"""
+        if self.rate <= 0:
+            return 0.0
+        wait = await self.store.take(self.client(scope), self.rate, self.burst)
+        if wait:
+            self.rate_limited += 1
+        return wait
+
+    def gates(self, scope) -> list[Gate]:
+        """Return the gates a request has to pass, the global one first"""
+        gates = [self.gate] if self.gate is not None else []
+        if self.route_gates:
+            # The route the router will dispatch to, the first full match
+            for route in self.routes:
+                if route.matches(scope)[0] == Match.FULL:
+                    key = f"{scope['method']} {getattr(route, 'path', '')}"
+                    if key in self.route_gates:
+                        gates.append(self.route_gates[key])
+                    break
+        return gates
+
+    def stats(self) -> dict:
+        """Return the counters of each gate, and of the rate limit"""
+        return {
+            "global": None if self.gate is None else self.gate.stats(),
+            "routes": {route: gate.stats() for route, gate in self.route_gates.items()},
+            "rate_limit": {
+                "rate": self.rate,
+                "burst": self.burst,
+                "rate_limited": self.rate_limited,
+            },
+        }
+
+
+async def _reject(send, status: int, content: bytes, retry_after: float) -> None:
+    """Send a short JSON error, with Retry-After in whole seconds"""
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(content)).encode()),
+        (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+class AdmissionMiddleware:
+    # pylint: disable=too-few-public-methods
+    """ASGI middleware admitting each request, or rejecting it straight away"""
+
+    def __init__(
+        self, app, admission: Admission, metrics: Metrics, exempt: tuple[str, ...] = ()
+    ):
+        self.app = app
+        self.admission = admission
+        self.metrics = metrics
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+
+        wait = await self.admission.rate_limit(scope)
+        if wait:
+            self.metrics.rejected.inc(("rate_limited",))
+            await _reject(send, 429, b'"Too many requests, slow down"', wait)
+            return
+
+        acquired = []
+        try:
+            try:
+                for gate in self.admission.gates(scope):
+                    queued = await gate.acquire()
+                    acquired.append(gate)
+                    self.metrics.queue.observe((gate.name,), queued)
+            except Overloaded:
+                self.metrics.rejected.inc(("overloaded",))
+                await _reject(send, 503, b'"The server is busy, try again"', 1)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            for gate in reversed(acquired):
+                gate.release()
@@ -0,0 +1,233 @@
+"""Read-through cache for items, sitting between the router and the collection
+
+The cache is split in two, a CacheBackend that stores the values (an in-process
+LRU with a TTL here, a shared cache can implement the same interface later) and
+the ItemCache that handles the read-through and write invalidation.
+
+Loads are coalesced, so concurrent misses for one item (or identical listings)
+share a single query. A write stops later reads joining a load that started
+before it, so a client always reads its own writes.
+"""
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+from app.internal.single_flight import SingleFlight
+from app.repositories.item_repository import REVISION_FIELD
+
+
+class CacheBackend(ABC):
+    """Interface for the storage behind the ItemCache"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Any | None:
+        """Return the value for key, or None if it is not cached"""
+
+    @abstractmethod
+    async def peek(self, key: str) -> Any | None:
+        """Return the value for key, without counting a hit or miss"""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any) -> None:
+        """Cache value under key"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Remove key from the cache, if it is there"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Return the cache counters"""
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache, where each entry also expires after ttl seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def peek(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+class VersionedCache:
+    """Cache of query results, which are all dropped at once when items change
+
+    Each key carries the version it was made at. A change bumps the version, so
+    the older entries are never read again, and age out of the backend
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.version = 0
+
+    def key(self, key: str) -> str:
+        """Return the backend key for key, at the current version
+
+        Taken before a load, so a load that raced a change is cached under the
+        old version
+        """
+        return f"{self.version}:{key}"
+
+    async def get(self, key: str) -> Any | None:
+        """Return the value cached under a versioned key, or None"""
+        return await self.backend.get(key)
+
+    async def set(self, key: str, value: Any) -> None:
+        """Cache value under a versioned key"""
+        await self.backend.set(key, value)
+
+    async def apply_change(self, change: dict) -> None:
+        # pylint: disable=unused-argument
+        """Drop every entry, given a change event for any item"""
+        self.version += 1
+
+
+class ItemCache:
+    """Read-through cache of item documents, keyed by item id"""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        # Bumped on every local write, a read that raced a write is not cached
+        self._writes = 0
+        self.flights = SingleFlight()
+
+    async def get(self, item_id) -> dict | None:
+        """Return the cached item, or None on a miss (without loading it)"""
+        return await self.backend.get(str(item_id))
+
+    async def get_or_load(
+        self, item_id, loader: Callable[[], Awaitable[dict | None]]
+    ) -> dict | None:
+        """Return the cached item, calling loader (and caching it) on a miss"""
+        item = await self.backend.get(str(item_id))
+        if item is not None:
+            return item
+
+        writes = self._writes
+        item = await self.flights.run(("item", str(item_id)), loader)
+        if item is not None and writes == self._writes:
+            await self.backend.set(str(item_id), item)
+        return item
+
+    async def get_many_or_load(
+        self, item_ids: list, loader: Callable[[list], Awaitable[list[dict]]]
+    ) -> dict[str, dict]:
+        """Return the items found, keyed by id, loading the misses with one call
+
+        loader is given the ids that were not cached, and returns the items of
+        those that exist
+        """
+        items = {}
+        missing = []
+        for item_id in dict.fromkeys(item_ids):
+            item = await self.backend.get(str(item_id))
+            if item is None:
+                missing.append(item_id)
+            else:
+                items[str(item_id)] = item
+        if not missing:
+            return items
+
+        writes = self._writes
+        for item in await loader(missing):
+            items[str(item["_id"])] = item
+            if writes == self._writes:
+                await self.backend.set(str(item["_id"]), item)
+        return items
+
+    async def coalesce(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        """Return the result of loader, sharing it with identical concurrent loads
+
+        The result is not cached, it is only shared while the load is running
+        """
+        return await self.flights.run(("query", key), loader)
+
+    async def put(self, item_id, item: dict) -> None:
+        """Refresh the cached item after it has been written"""
+        self._writes += 1
+        self.flights.forget()
+        await self.backend.set(str(item_id), item)
+
+    async def invalidate(self, *item_ids) -> None:
+        """Drop the given items from the cache after they have been changed"""
+        self._writes += 1
+        self.flights.forget()
+        for item_id in item_ids:
+            await self.backend.delete(str(item_id))
+
+    async def apply_change(self, change: dict) -> None:
+        """Drop an item changed by any app instance, given its change event
+
+        Changes already in the cache, e.g. this instance's own writes, are skipped
+        """
+        if change["operationType"] == "update":
+            revision = change["updateDescription"]["updatedFields"].get(REVISION_FIELD)
+        elif change["operationType"] == "replace":
+            revision = change["fullDocument"].get(REVISION_FIELD)
+        elif change["operationType"] == "delete":
+            revision = None
+        else:
+            return
+
+        item_id = change["documentKey"]["_id"]
+        cached = await self.backend.peek(str(item_id))
+        if (
+            cached is not None
+            and revision is not None
+            and cached.get(REVISION_FIELD, 0) >= revision
+        ):
+            return
+        await self.invalidate(item_id)
+
+    def stats(self) -> dict:
+        """Return the backend counters"""
+        return self.backend.stats()
@@ -0,0 +1,169 @@
+"""Change feed, the item changes made by every app instance, fanned out in process
+
+  ITEM_CHANGE_STREAM         watch the items for changes (default 1)
+  ITEM_CHANGE_HISTORY        changes kept to replay to resuming clients (default 1000)
+  ITEM_CHANGE_BUFFER         changes queued for each subscriber (default 100)
+
+A background task reads the repository's change stream (a MongoDb change
+stream, which needs a replica set) and hands each change to the listeners, such
+as the cache invalidation, then to each subscriber's queue.
+
+The subscriber queues are bounded. A subscriber that falls so far behind that
+its queue fills up is dropped, rather than letting its queue grow without
+limit, and has to resume from the last change it saw. Resuming from a change
+still in the history replays the changes since; for an older one the caller
+falls back to a change stream of its own.
+"""
+import asyncio
+import sys
+from collections import deque
+from typing import Awaitable, Callable
+from pymongo.errors import ConnectionFailure
+
+# How long to wait before reopening the change stream after losing the connection
+RETRY_SECONDS = 1.0
+
+
+class SubscriptionOverflow(Exception):
+    """Raised to a subscriber that fell behind, and missed changes"""
+
+
+def change_token(change: dict) -> str:
+    """Return the resume token of a change, as a string"""
+    return change["_id"]["_data"]
+
+
+class Subscription:
+    """The changes published since a subscriber joined, read with get"""
+
+    def __init__(self, buffer: int, backlog: list[dict] | None = None):
+        self._backlog = deque(backlog or [])
+        self._queue: asyncio.Queue = asyncio.Queue(buffer)
+        self.overflowed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.get()
+
+    def offer(self, change: dict) -> bool:
+        """Queue a change, returns False (and overflows) if the queue is full"""
+        try:
+            self._queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+        return True
+
+    async def get(self) -> dict:
+        """Return the next change, raising SubscriptionOverflow once behind"""
+        if self._backlog:
+            return self._backlog.popleft()
+        if not self._queue.empty():
+            return self._queue.get_nowait()
+        if self.overflowed:
+            raise SubscriptionOverflow(
+                "Fell behind the change feed, resume to catch up"
+            )
+        return await self._queue.get()
+
+
+class ChangeFeed:
+    # pylint: disable=too-many-instance-attributes
+    """Reads the repository's changes, passing them to listeners and subscribers"""
+
+    def __init__(self, history: int = 1000, buffer: int = 100):
+        self.buffer = buffer
+        self._history: deque[dict] = deque(maxlen=history)
+        self._listeners: list[Callable[[dict], Awaitable[None]]] = []
+        self._subscriptions: set[Subscription] = set()
+        self._task: asyncio.Task | None = None
+        self.running = False
+        self.changes = 0
+        self.overflows = 0
+
+    def add_listener(self, listener: Callable[[dict], Awaitable[None]]) -> None:
+        """Call listener with every change, ahead of the subscribers"""
+        self._listeners.append(listener)
+
+    def subscribe(self, resume_after: str | None = None) -> Subscription | None:
+        """Return a new subscription, starting after the given resume token
+
+        Returns None if the token is no longer in the history
+        """
+        backlog = []
+        if resume_after is not None:
+            tokens = [change_token(change) for change in self._history]
+            if resume_after not in tokens:
+                return None
+            backlog = list(self._history)[tokens.index(resume_after) + 1 :]
+
+        subscription = Subscription(self.buffer + len(backlog), backlog)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop sending changes to a subscription"""
+        self._subscriptions.discard(subscription)
+
+    async def publish(self, change: dict) -> None:
+        """Pass a change to the listeners, then queue it for each subscriber"""
+        self._history.append(change)
+        self.changes += 1
+        for listener in self._listeners:
+            try:
+                await listener(change)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                print(f"Change listener failed: {exc!r}", file=sys.stderr)
+
+        for subscription in list(self._subscriptions):
+            if not subscription.offer(change):
+                self._subscriptions.discard(subscription)
+                self.overflows += 1
+
+    def start(self, repository) -> None:
+        """Start reading the repository's changes in the background"""
+        self.running = True
+        self._task = asyncio.ensure_future(self._run(repository))
+
+    async def _run(self, repository) -> None:
+        """Publish the changes, reopening the stream if the connection drops"""
+        resume_after = None
+        while True:
+            try:
+                async for change in repository.watch(resume_after):
+                    resume_after = change["_id"]
+                    await self.publish(change)
+            except ConnectionFailure as exc:
+                print(
+                    f"Change stream lost its connection, resuming: {exc!r}",
+                    file=sys.stderr,
+                )
+                await asyncio.sleep(RETRY_SECONDS)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                # No replica set, or the history was lost, the cache falls back
+                # to its ttl
+                print(f"Change stream is not available: {exc!r}", file=sys.stderr)
+                self.running = False
+                return
+
+    async def close(self) -> None:
+        """Stop reading the changes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.running = False
+
+    def stats(self) -> dict:
+        """Return the feed counters"""
+        return {
+            "running": self.running,
+            "changes": self.changes,
+            "subscribers": len(self._subscriptions),
+            "overflows": self.overflows,
+        }
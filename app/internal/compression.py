@@ -0,0 +1,194 @@
+"""Response compression, negotiated from the client's Accept-Encoding
+
+  RESPONSE_COMPRESSION           encodings in order of preference (default
+                                 "br,zstd,gzip", empty turns it off)
+  RESPONSE_COMPRESSION_MIN_SIZE  smallest body compressed, in bytes (default 1024)
+
+gzip is always available, br and zstd only when the brotli and zstandard
+packages are installed; encodings whose package is missing are left out. The
+client's Accept-Encoding picks among them, the server's order breaking ties.
+
+A body sent in one piece is only compressed if it is at least the minimum
+size, so single items (a hundred bytes or so) go out as they are. A streamed
+body's size is not known up front, it is always compressed, chunk by chunk,
+without flushing the compressor between chunks. Server-Sent Events are never
+compressed, as the compressor would hold back each event until it had enough
+bytes to emit.
+
+The ETag is left unchanged: it names the item revision (or the listing), the
+Vary header tells caches the encoding depends on Accept-Encoding.
+"""
+import zlib
+from importlib.util import find_spec
+from starlette.datastructures import Headers, MutableHeaders
+
+# Compression levels, chosen for speed over size (see benchmarks/compression.py)
+GZIP_LEVEL = 1
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Bodies of these types are sent as they are
+UNCOMPRESSED_MEDIA_TYPES = ("text/event-stream",)
+
+
+class _Brotli:
+    """Adapts a brotli Compressor to the compress and flush of zlib"""
+
+    def __init__(self, quality: int):
+        import brotli  # pylint: disable=import-outside-toplevel,import-error
+
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk, returning any output ready so far"""
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Finish the stream, returning the rest of the output"""
+        return self._compressor.finish()
+
+
+def _gzip(level: int = GZIP_LEVEL):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _brotli(level: int = BROTLI_QUALITY):
+    return _Brotli(level)
+
+
+def _zstd(level: int = ZSTD_LEVEL):
+    import zstandard  # pylint: disable=import-outside-toplevel,import-error
+
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+# Compressor factories of the encodings that are available, the packages are
+# only imported once a response is compressed, to keep the cold start down
+COMPRESSORS = {"gzip": _gzip}
+if find_spec("brotli") is not None:
+    COMPRESSORS["br"] = _brotli
+if find_spec("zstandard") is not None:
+    COMPRESSORS["zstd"] = _zstd
+
+
+def available_encodings(encodings: list[str]) -> list[str]:
+    """Return the encodings that can be used, in the same order"""
+    return [encoding for encoding in encodings if encoding in COMPRESSORS]
+
+
+def negotiate(accept_encoding: str | None, encodings: list[str]) -> str | None:
+    """Return the encoding to use for an Accept-Encoding, None for no compression
+
+    The client's q values come first, then the order of encodings
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware:
+    # pylint: disable=too-few-public-methods
+    """ASGI middleware compressing the response bodies"""
+
+    def __init__(self, app, encodings: list[str], minimum_size: int = 1024):
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(
+            Headers(scope=scope).get("accept-encoding"), self.encodings
+        )
+        responder = _CompressingResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    # pylint: disable=too-few-public-methods
+    """Holds back the response start until the first body chunk decides it"""
+
+    def __init__(self, send, encoding: str | None, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self._start = None
+        self._compressor = None
+
+    async def send(self, message):
+        """Send a message, compressing the body if it was decided to"""
+        if message["type"] == "http.response.start":
+            self._start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        if self._start is not None:
+            await self._send_start(message)
+            return
+
+        if self._compressor is None:
+            await self._send(message)
+            return
+
+        more_body = message.get("more_body", False)
+        body = self._compressor.compress(message.get("body", b""))
+        if not more_body:
+            body += self._compressor.flush()
+        if body or not more_body:
+            await self._send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+    async def _send_start(self, message):
+        """Send the response start, with the first chunk, compressed or not"""
+        start, self._start = self._start, None
+        headers = MutableHeaders(raw=start.setdefault("headers", []))
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        media_type = headers.get("content-type", "").split(";")[0].strip()
+        if "content-encoding" in headers or media_type in UNCOMPRESSED_MEDIA_TYPES:
+            await self._send(start)
+            await self._send(message)
+            return
+
+        headers.add_vary_header("Accept-Encoding")
+        if self.encoding is None or (not more_body and len(body) < self.minimum_size):
+            await self._send(start)
+            await self._send(message)
+            return
+
+        self._compressor = COMPRESSORS[self.encoding]()
+        body = self._compressor.compress(body)
+        headers["content-encoding"] = self.encoding
+        if more_body:
+            del headers["content-length"]
+        else:
+            body += self._compressor.flush()
+            headers["content-length"] = str(len(body))
+        await self._send(start)
+        await self._send(
+            {"type": "http.response.body", "body": body, "more_body": more_body}
+        )
@@ -0,0 +1,52 @@
+"""ETag helpers, for conditional GETs and optimistic concurrency on the items
+
+Every item carries a revision counter, bumped by each write, and its ETag is
+simply that revision. A listing's ETag is a hash of its body instead, as it
+depends on which items matched as well as on their revisions.
+"""
+import hashlib
+from app.repositories.item_repository import REVISION_FIELD
+
+
+def revision_etag(revision: int) -> str:
+    """Return the strong ETag for an item revision"""
+    return f'"{revision}"'
+
+
+def item_etag(item: dict) -> str:
+    """Return the strong ETag of an item document"""
+    return revision_etag(item.get(REVISION_FIELD, 0))
+
+
+def body_etag(body: bytes) -> str:
+    """Return a strong ETag for a response body"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _etags(header: str) -> list[str]:
+    """Split a list of ETags out of an If-Match or If-None-Match header"""
+    return [etag.strip() for etag in header.split(",") if etag.strip()]
+
+
+def none_match(header: str | None, etag: str) -> bool:
+    """Return True if If-None-Match lists the etag, using the weak comparison"""
+    if not header:
+        return False
+    return any(
+        candidate == "*" or candidate.removeprefix("W/") == etag
+        for candidate in _etags(header)
+    )
+
+
+def match_revisions(header: str | None) -> list[int] | None:
+    """Return the revisions If-Match allows, None when any revision will do
+
+    Weak and malformed ETags never match, so they are left out of the list
+    """
+    if not header or header.strip() == "*":
+        return None
+    revisions = []
+    for etag in _etags(header):
+        if etag.startswith('"') and etag.endswith('"') and etag[1:-1].isdigit():
+            revisions.append(int(etag[1:-1]))
+    return revisions
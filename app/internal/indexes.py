@@ -0,0 +1,127 @@
+"""Create the declared indexes, and compare them with those in MongoDb
+
+Usage: python -m app.internal.indexes [--apply] [--drop-extra]
+
+Without options this prints the differences between the declared indexes
+(app.models.item_indexes, on the field names of ITEM_STORAGE_FORMAT) and the
+live ones, exiting non zero if there are any.
+--apply creates the missing indexes and recreates those that have changed,
+--drop-extra also drops live indexes that are no longer declared.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from dataclasses import dataclass, field
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from app.internal.mongo import COLLECTION_NAME, DATABASE_NAME
+from app.internal.mongo import PoolMonitor, create_client
+from app.models.item_indexes import ITEM_INDEXES
+from app.repositories.item_codec import ItemCodec
+
+# Index options that change what an index holds or how it behaves
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+@dataclass
+class IndexDiff:
+    """Names of the indexes that differ between the declared and live indexes"""
+
+    missing: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    extra: list[str] = field(default_factory=list)
+
+    @property
+    def in_sync(self) -> bool:
+        """True when the live indexes match those declared"""
+        return not (self.missing or self.changed or self.extra)
+
+
+def _spec(index: dict) -> dict:
+    """Return the parts of an index document or index_information entry compared"""
+    key = [
+        (name, int(direction) if isinstance(direction, float) else direction)
+        for name, direction in list(dict(index["key"]).items())
+    ]
+    return {"key": key, **{k: index[k] for k in COMPARED_OPTIONS if k in index}}
+
+
+async def diff_indexes(collection, declared: list[IndexModel]) -> IndexDiff:
+    """Compare the declared indexes with those on the collection"""
+    live = await collection.index_information()
+    live.pop("_id_", None)
+
+    diff = IndexDiff()
+    for index in declared:
+        name = index.document["name"]
+        if name not in live:
+            diff.missing.append(name)
+        elif _spec(index.document) != _spec(live[name]):
+            diff.changed.append(name)
+
+    declared_names = {index.document["name"] for index in declared}
+    diff.extra = sorted(name for name in live if name not in declared_names)
+    return diff
+
+
+async def ensure_indexes(collection, declared: list[IndexModel]) -> None:
+    """Create the declared indexes, this is a no-op for those that already exist"""
+    try:
+        await collection.create_indexes(declared)
+    except OperationFailure as exc:
+        # An index with the same name but different options, leave it to the
+        # command line to recreate it rather than failing the startup
+        print(f"Could not create the declared indexes: {exc}", file=sys.stderr)
+
+
+async def apply_diff(
+    collection, declared: list[IndexModel], diff: IndexDiff, drop_extra: bool
+) -> None:
+    """Bring the live indexes in line with those declared"""
+    for name in diff.changed + (diff.extra if drop_extra else []):
+        await collection.drop_index(name)
+    to_create = set(diff.missing + diff.changed)
+    indexes = [index for index in declared if index.document["name"] in to_create]
+    if indexes:
+        await collection.create_indexes(indexes)
+
+
+async def run(apply: bool, drop_extra: bool) -> bool:
+    """Print (and optionally apply) the index differences, returns True if in sync"""
+    client = create_client(os.getenv("CONNECTION_STRING"), PoolMonitor())
+    collection = client[DATABASE_NAME][COLLECTION_NAME]
+    codec = ItemCodec.from_format(os.getenv("ITEM_STORAGE_FORMAT", "full"))
+    declared = codec.indexes(ITEM_INDEXES)
+    try:
+        diff = await diff_indexes(collection, declared)
+        for label, names in (
+            ("missing", diff.missing),
+            ("changed", diff.changed),
+            ("extra", diff.extra),
+        ):
+            for name in names:
+                print(f"{label}: {name}")
+        if diff.in_sync:
+            print("Indexes are in sync")
+            return True
+        if apply:
+            await apply_diff(collection, declared, diff, drop_extra)
+            print("Indexes updated")
+            return not diff.extra or drop_extra
+        return False
+    finally:
+        client.close()
+
+
+def main() -> None:
+    """Parse the command line and diff (or apply) the indexes"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apply", action="store_true")
+    parser.add_argument("--drop-extra", action="store_true")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.apply, args.drop_extra)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Request timing, broken down into MongoDb and serialization time
+
+  METRICS_SAMPLE_RATE  fraction of requests that are timed (default 1, 0 is off)
+
+TimingMiddleware times each sampled request, and a RequestTiming for it is kept
+in a context variable while the request runs. Motor runs pymongo on a thread
+pool, copying the context across, so the CommandMonitor (a pymongo command
+listener) can charge each command to the request that sent it. The response
+gets a Server-Timing header, and the totals are aggregated into histograms that
+/metrics renders in the Prometheus text format.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pymongo import monitoring
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+@dataclass
+class RequestTiming:
+    # pylint: disable=invalid-name
+    """Time spent by the current request, in seconds, named as in Server-Timing"""
+
+    db: float = 0.0
+    db_commands: int = 0
+    ser: float = 0.0
+
+
+_timing: ContextVar[RequestTiming | None] = ContextVar("request_timing", default=None)
+
+
+def current_timing() -> RequestTiming | None:
+    """Return the timing of the request being handled, None if it is not sampled"""
+    return _timing.get()
+
+
+class Histogram:
+    """Prometheus style histogram, with a set of counts for each label value"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, label_values: tuple, seconds: float) -> None:
+        """Record a duration against the given label values"""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(BUCKETS), 0.0, 0]
+            index = bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def count(self, label_values: tuple) -> int:
+        """Return how many durations have been recorded for the label values"""
+        with self._lock:
+            series = self._series.get(label_values)
+            return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        """Return the histogram in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, (buckets, total, count) in series:
+            labels = ",".join(
+                f'{label}="{_escape(str(value))}"'
+                for label, value in zip(self.labels, label_values)
+            )
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    """Prometheus style counter, with a count for each label value"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._counts: dict[tuple, int] = {}
+
+    def inc(self, label_values: tuple) -> None:
+        """Add one to the count of the given label values"""
+        with self._lock:
+            self._counts[label_values] = self._counts.get(label_values, 0) + 1
+
+    def count(self, label_values: tuple) -> int:
+        """Return the count of the label values"""
+        with self._lock:
+            return self._counts.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        """Return the counter in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            counts = sorted(self._counts.items())
+        for label_values, count in counts:
+            labels = ",".join(
+                f'{label}="{_escape(str(value))}"'
+                for label, value in zip(self.labels, label_values)
+            )
+            lines.append(f"{self.name}{{{labels}}} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    # pylint: disable=too-few-public-methods
+    """The histograms reported on /metrics"""
+
+    def __init__(self):
+        route = ("method", "route", "status")
+        self.requests = Histogram(
+            "http_request_duration_seconds", "Time taken to handle a request", route
+        )
+        self.request_db = Histogram(
+            "http_request_db_seconds", "Time a request spent waiting on MongoDb", route
+        )
+        self.request_ser = Histogram(
+            "http_request_serialization_seconds",
+            "Time a request spent serializing its response",
+            route,
+        )
+        self.commands = Histogram(
+            "mongodb_command_duration_seconds",
+            "Time taken by each MongoDb command",
+            ("command", "outcome"),
+        )
+        self.queue = Histogram(
+            "http_request_queue_seconds",
+            "Time a request waited for a slot, at each admission gate",
+            ("gate",),
+        )
+        self.rejected = Counter(
+            "http_requests_rejected_total",
+            "Requests turned away by the admission control",
+            ("reason",),
+        )
+
+    def render(self) -> str:
+        """Return every histogram in the Prometheus text exposition format"""
+        lines = []
+        for histogram in (self.requests, self.request_db, self.request_ser):
+            lines.extend(histogram.render())
+        lines.extend(self.commands.render())
+        lines.extend(self.queue.render())
+        lines.extend(self.rejected.render())
+        return "\n".join(lines) + "\n"
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Times the MongoDb commands, charging each one to the request that sent it"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def _record(self, event, outcome: str) -> None:
+        seconds = event.duration_micros / 1_000_000
+        self.metrics.commands.observe((event.command_name, outcome), seconds)
+        timing = _timing.get()
+        if timing is not None:
+            timing.db += seconds
+            timing.db_commands += 1
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "succeeded")
+
+    def failed(self, event):
+        self._record(event, "failed")
+
+
+class TimingMiddleware:
+    # pylint: disable=too-few-public-methods
+    """ASGI middleware timing a sample of the requests
+
+    Requests that are not sampled are passed straight through to the app.
+    """
+
+    def __init__(self, app, metrics: Metrics, sample_rate: float = 1.0):
+        self.app = app
+        self.metrics = metrics
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or self.sample_rate <= 0
+            or (self.sample_rate < 1 and random.random() >= self.sample_rate)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _timing.set(timing)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = time.perf_counter() - started
+                header = (
+                    f'db;dur={timing.db * 1000:.3f};desc="{timing.db_commands} '
+                    f'commands", ser;dur={timing.ser * 1000:.3f}, '
+                    f"total;dur={total * 1000:.3f}"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", header.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timing.reset(token)
+            self._observe(scope, status, time.perf_counter() - started, timing)
+
+    def _observe(self, scope, status: int, seconds: float, timing: RequestTiming):
+        """Add the request to the histograms, labelled by its route template"""
+        route = scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        labels = (scope["method"], path, status)
+        self.metrics.requests.observe(labels, seconds)
+        self.metrics.request_db.observe(labels, timing.db)
+        self.metrics.request_ser.observe(labels, timing.ser)
@@ -0,0 +1,79 @@
+"""Rewrite the stored items in another storage format, a batch at a time
+
+Usage: python -m app.internal.migrate_items [--format compact] [--batch-size 1000]
+                                            [--dry-run]
+
+The format defaults to ITEM_STORAGE_FORMAT. Switch the app to the new format
+first, so nothing writes the old one while this runs (reads and writes upgrade
+the items they touch in the meantime), and create its indexes with
+python -m app.internal.indexes --apply.
+
+Each batch is read, and written back with one unordered bulk_write. Each
+replace matches the item's revision, so an item changed by the app between the
+read and the write is left as the app wrote it. Run it again to pick up any
+stragglers; it exits non zero while there are items left in the old format.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pymongo import ReplaceOne
+from app.internal.mongo import COLLECTION_NAME, DATABASE_NAME
+from app.internal.mongo import PoolMonitor, create_client
+from app.repositories.item_codec import ItemCodec
+
+
+async def migrate(collection, codec: ItemCodec, batch_size: int = 1000) -> int:
+    """Rewrite the items stored in the other format, returns how many were"""
+    rewritten = 0
+    last_id = None
+    while True:
+        # Walk the _id index, so each batch starts where the last one ended
+        filters = codec.outdated()
+        if last_id is not None:
+            filters = {**filters, "_id": {"$gt": last_id}}
+        cursor = collection.find(filters).sort("_id", 1).limit(batch_size)
+        documents = await cursor.to_list(length=None)
+        if not documents:
+            return rewritten
+
+        result = await collection.bulk_write(
+            [ReplaceOne(*codec.upgrade(document)) for document in documents],
+            ordered=False,
+        )
+        rewritten += result.modified_count
+        last_id = documents[-1]["_id"]
+        print(f"Rewrote {rewritten} items, up to {last_id}")
+
+
+async def run(codec: ItemCodec, batch_size: int, dry_run: bool) -> bool:
+    """Migrate (or count) the items in the other format, True when none are left"""
+    client = create_client(os.getenv("CONNECTION_STRING"), PoolMonitor())
+    collection = client[DATABASE_NAME][COLLECTION_NAME]
+    try:
+        if not dry_run:
+            await migrate(collection, codec, batch_size)
+        remaining = await collection.count_documents(codec.outdated())
+        print(f"{remaining} items left to rewrite")
+        return remaining == 0
+    finally:
+        client.close()
+
+
+def main() -> None:
+    """Parse the command line and rewrite the items"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--format",
+        choices=["full", "compact"],
+        default=os.getenv("ITEM_STORAGE_FORMAT", "full"),
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    codec = ItemCodec.from_format(args.format)
+    sys.exit(0 if asyncio.run(run(codec, args.batch_size, args.dry_run)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""MongoDb client setup, with the connection pool configured from the environment
+
+  MONGO_MAX_POOL_SIZE          maxPoolSize, connections per server (default 100)
+  MONGO_MIN_POOL_SIZE          minPoolSize, connections kept open (default 0)
+  MONGO_MAX_IDLE_TIME_MS       maxIdleTimeMS, close connections idle this long
+  MONGO_WAIT_QUEUE_TIMEOUT_MS  waitQueueTimeoutMS, how long to wait for a connection
+  MONGO_COMPRESSORS            wire compression, e.g. "zstd,snappy,zlib"
+  MONGO_WARMUP_CONNECTIONS     connections to open at startup (default 0)
+  ITEM_COLLECTION              collection the items are kept in
+"""
+import asyncio
+import os
+import threading
+import time
+from pymongo import monitoring
+
+DATABASE_NAME = "test-database"
+COLLECTION_NAME = os.getenv("ITEM_COLLECTION", "test-collection")
+
+# Environment variable, MongoClient option and type of each pool setting
+POOL_SETTINGS = (
+    ("MONGO_MAX_POOL_SIZE", "maxPoolSize", int),
+    ("MONGO_MIN_POOL_SIZE", "minPoolSize", int),
+    ("MONGO_MAX_IDLE_TIME_MS", "maxIdleTimeMS", int),
+    ("MONGO_WAIT_QUEUE_TIMEOUT_MS", "waitQueueTimeoutMS", int),
+    ("MONGO_COMPRESSORS", "compressors", str),
+)
+
+
+def pool_options() -> dict:
+    """Return the MongoClient pool options set in the environment"""
+    options = {}
+    for env, option, cast in POOL_SETTINGS:
+        value = os.getenv(env)
+        if value:
+            options[option] = cast(value)
+    return options
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    # pylint: disable=too-many-instance-attributes
+    """Keeps count of the pool connections, and how long checkouts wait for one
+
+    Motor runs pymongo on a thread pool, so the events arrive on those threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open_connections = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _waited(self) -> float:
+        """Return how long the checkout on this thread has been waiting"""
+        now = time.perf_counter()
+        return now - getattr(self._local, "started", now)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checkout_failures += 1
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        """Return the pool counters, with the wait times in milliseconds"""
+        with self._lock:
+            average = self.wait_seconds_total / self.checkouts if self.checkouts else 0
+            return {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_wait_ms_avg": round(average * 1000, 3),
+                "checkout_wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+            }
+
+
+def create_client(connection_string: str | None, *listeners):
+    """Create the asyncio Motor client, with the pool options and event listeners"""
+    # Imported here so that routes which never touch MongoDb, and Lambda cold
+    # starts, do not pay for importing motor
+    import motor.motor_asyncio  # pylint: disable=import-outside-toplevel
+
+    return motor.motor_asyncio.AsyncIOMotorClient(
+        connection_string, event_listeners=list(listeners), **pool_options()
+    )
+
+
+async def warm_up(client, connections: int | None = None) -> None:
+    """Open connections up front, so the first requests do not pay for them"""
+    if connections is None:
+        connections = int(os.getenv("MONGO_WARMUP_CONNECTIONS", "0"))
+    if connections > 0:
+        await asyncio.gather(
+            *(client.admin.command("ping") for _ in range(connections))
+        )
@@ -0,0 +1,104 @@
+"""Keyset (cursor based) pagination helpers for the item listings
+
+Rather than skipping over documents, each page remembers the sort key and _id
+of the last item it returned, and the next page starts from there. Every page
+then costs a single index seek, no matter how deep into the collection it is.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from typing import Any
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Fields a listing can be ordered by, _id is always used as the tie breaker
+SORTABLE_FIELDS = ("_id", "name", "price", "tax")
+
+# The values a cursor may hold for each field, so a tampered token can not slip
+# a query operator (e.g. {"$ne": null}) into the filter
+CURSOR_VALUE_TYPES = {
+    "_id": (type(None),),
+    "name": (str, type(None)),
+    "price": (int, float, type(None)),
+    "tax": (int, float, type(None)),
+}
+
+
+class InvalidCursor(ValueError):
+    """Raised when an order_by value or cursor token can not be used"""
+
+
+@dataclass(frozen=True)
+class Cursor:
+    """Position of the last item returned, along with the ordering in use"""
+
+    field: str
+    direction: int
+    value: Any = None
+    last_id: ObjectId | None = None
+
+    def query(self) -> dict:
+        """Return the Mongo filter selecting the items after this position"""
+        if self.last_id is None:
+            return {}
+
+        operator = "$gt" if self.direction == 1 else "$lt"
+        if self.field == "_id":
+            return {"_id": {operator: self.last_id}}
+
+        return {
+            "$or": [
+                {self.field: {operator: self.value}},
+                {self.field: self.value, "_id": {operator: self.last_id}},
+            ]
+        }
+
+    def sort(self) -> list[tuple[str, int]]:
+        """Return the Mongo sort specification for this ordering"""
+        if self.field == "_id":
+            return [("_id", self.direction)]
+        return [(self.field, self.direction), ("_id", self.direction)]
+
+    def advance(self, item: dict) -> "Cursor":
+        """Return the cursor positioned just after the given item"""
+        value = None if self.field == "_id" else item.get(self.field)
+        return Cursor(self.field, self.direction, value, item["_id"])
+
+    def encode(self) -> str:
+        """Encode the cursor as an opaque, url safe token"""
+        payload = {
+            "f": self.field,
+            "d": self.direction,
+            "v": self.value,
+            "i": str(self.last_id),
+        }
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def parse_order_by(order_by: str) -> Cursor:
+    """Build a starting cursor from an order_by value, e.g. 'price' or '-price'"""
+    direction = -1 if order_by.startswith("-") else 1
+    field = order_by.lstrip("-+")
+    if field not in SORTABLE_FIELDS:
+        raise InvalidCursor(f"Can not order items by: {order_by}")
+    return Cursor(field, direction)
+
+
+def decode_cursor(token: str) -> Cursor:
+    """Decode a token produced by Cursor.encode"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        cursor = parse_order_by(payload["f"])
+        if payload["d"] not in (1, -1):
+            raise ValueError("direction must be 1 or -1")
+        value = payload["v"]
+        if isinstance(value, bool) or not isinstance(
+            value, CURSOR_VALUE_TYPES[cursor.field]
+        ):
+            raise ValueError(f"{cursor.field} can not be {value!r}")
+        return Cursor(cursor.field, payload["d"], value, ObjectId(payload["i"]))
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId) as exc:
+        raise InvalidCursor(f"Invalid cursor: {token}") from exc
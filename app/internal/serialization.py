@@ -0,0 +1,59 @@
+"""Fast JSON serialization for the item endpoints
+
+JSONResponse(jsonable_encoder(...)) walks every document twice, once to turn
+it into plain python types and again to dump it. Here the documents are handed
+straight to the C json encoder, with a single default hook registered for the
+types it does not know (ObjectId), producing exactly the same bytes.
+
+orjson and pydantic-core's to_json would be faster still, but they format
+floats differently (1e16 rather than 1e+16), so the output would change.
+"""
+import json
+import time
+from typing import Any
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.internal.metrics import current_timing
+from app.models.item_response import ItemResponse
+
+
+def _default(value: Any) -> Any:
+    """Encode the values the json module does not know how to"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    return jsonable_encoder(value)
+
+
+# Same settings as starlette's JSONResponse.render
+_encoder = json.JSONEncoder(
+    ensure_ascii=False,
+    allow_nan=False,
+    indent=None,
+    separators=(",", ":"),
+    default=_default,
+)
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize content to JSON bytes in a single pass"""
+    return _encoder.encode(content).encode("utf-8")
+
+
+def item_response(item: dict) -> dict:
+    """Validate a document as an ItemResponse, returning it ready to be dumped"""
+    return ItemResponse(**item).model_dump(by_alias=True)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that can be given Mongo documents without jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        timing = current_timing()
+        if timing is None:
+            return dumps(content)
+
+        started = time.perf_counter()
+        body = dumps(content)
+        timing.ser += time.perf_counter() - started
+        return body
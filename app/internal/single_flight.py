@@ -0,0 +1,46 @@
+"""Request coalescing, concurrent identical reads share a single query
+
+The first caller for a key starts the load as a task, and any caller asking for
+the same key while it is running waits on that task rather than starting its
+own. Every caller gets the same result, or the same exception.
+
+Callers wait through asyncio.shield, so a cancelled caller (say the client went
+away) does not cancel the load the others are waiting on.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Runs at most one load per key at a time, sharing its result"""
+
+    def __init__(self):
+        self._flights: dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the result of loader, joining the load for key if one is running"""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._landed(key, done))
+        return await asyncio.shield(task)
+
+    def _landed(self, key: Hashable, task: asyncio.Task) -> None:
+        """Forget a finished load, so the next caller starts a new one"""
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Mark the exception as retrieved, in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self) -> None:
+        """Stop new callers joining the running loads, e.g. after a write
+
+        The loads carry on for the callers already waiting on them
+        """
+        self._flights.clear()
+
+    def in_flight(self) -> int:
+        """Return how many loads are running"""
+        return len(self._flights)
@@ -0,0 +1,91 @@
+"""Streaming encoders for large item listings, and the item change events
+
+Each document is encoded and handed to the StreamingResponse as soon as it
+comes off the Motor cursor, so memory use is bounded by the cursor batch size
+rather than by the number of items returned.
+"""
+import asyncio
+from typing import AsyncIterator
+from pymongo.errors import PyMongoError
+from app.internal.change_feed import SubscriptionOverflow, change_token
+from app.internal.serialization import dumps
+from app.repositories.item_repository import REVISION_FIELD
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# Send a comment this often when there are no changes, so proxies keep the
+# connection open
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+async def ndjson_lines(cursor) -> AsyncIterator[bytes]:
+    """Yield one JSON document per line"""
+    async for item in cursor:
+        yield dumps(item) + b"\n"
+
+
+async def json_array_chunks(cursor) -> AsyncIterator[bytes]:
+    """Yield a JSON array one element at a time"""
+    separator = b"["
+    async for item in cursor:
+        yield separator + dumps(item)
+        separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
+def change_event(change: dict) -> bytes:
+    """Encode a MongoDb change event as a Server-Sent Event
+
+    The event id is the change's resume token, and the event name its operation
+    """
+    data = {"_id": change["documentKey"]["_id"]}
+    if change.get("fullDocument") is not None:
+        data["item"] = {
+            name: value
+            for name, value in change["fullDocument"].items()
+            if name != REVISION_FIELD
+        }
+    if "updateDescription" in change:
+        description = change["updateDescription"]
+        data["updated"] = {
+            name: value
+            for name, value in description["updatedFields"].items()
+            if name != REVISION_FIELD
+        }
+        data["removed"] = description["removedFields"]
+    return (
+        f"id: {change_token(change)}\nevent: {change['operationType']}\n".encode()
+        + b"data: "
+        + dumps(data)
+        + b"\n\n"
+    )
+
+
+async def server_sent_events(
+    changes: AsyncIterator[dict], keepalive: float = SSE_KEEPALIVE_SECONDS
+) -> AsyncIterator[bytes]:
+    """Yield each change as a Server-Sent Event, with keepalives in between
+
+    A subscriber that fell behind is sent an overflow event, and the stream
+    ends; the client resumes from the last event id it saw
+    """
+    iterator = aiter(changes)
+    pending = None
+    try:
+        while True:
+            # The pending read is kept across keepalives, rather than cancelled
+            pending = pending or asyncio.ensure_future(anext(iterator))
+            done, _ = await asyncio.wait({pending}, timeout=keepalive)
+            if not done:
+                yield b": keepalive\n\n"
+                continue
+            change, pending = pending.result(), None
+            yield change_event(change)
+    except SubscriptionOverflow as exc:
+        yield b"event: overflow\ndata: " + dumps(str(exc)) + b"\n\n"
+    except (PyMongoError, ValueError) as exc:
+        yield b"event: error\ndata: " + dumps(str(exc)) + b"\n\n"
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,134 @@
+"""Write-behind batching, individual item inserts sent to MongoDb with insert_many
+
+  ITEM_WRITE_BATCH_SIZE      most items in one insert_many (default 0, batching off)
+  ITEM_WRITE_BATCH_DELAY_MS  longest an item waits for a batch to fill (default 5)
+
+Each insert is queued along with a future. A single background task takes the
+first item off the queue, collects more until the batch is full or the delay
+has passed, and inserts them all with one unordered insert_many. The futures
+are then resolved one by one, so each caller still gets its own _id, or its own
+error if only its item failed.
+"""
+import asyncio
+import time
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+
+class WriteBatcher:
+    # pylint: disable=too-many-instance-attributes
+    """Queues item inserts, flushing them to the repository in batches"""
+
+    def __init__(self, repository, max_batch: int = 100, max_delay: float = 0.005):
+        self.repository = repository
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.batches = 0
+        self.documents = 0
+        self.batch_size_max = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    def start(self) -> None:
+        """Start the background task that flushes the queue"""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def insert(self, document: dict) -> ObjectId:
+        """Queue an insert, returning the _id once its batch has been written"""
+        if self._closing or self._task is None:
+            raise RuntimeError("The write batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((document, future))
+        return await future
+
+    async def close(self) -> None:
+        """Stop taking inserts, and wait for the ones queued to be written"""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        """Collect batches off the queue and flush them, until closed"""
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return
+
+            batch = [entry]
+            deadline = time.monotonic() + self.max_delay
+            closed = False
+            while len(batch) < self.max_batch:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    closed = True
+                    break
+                batch.append(entry)
+
+            await self._flush(batch)
+            if closed:
+                return
+
+    async def _flush(self, batch: list) -> None:
+        """Insert a batch, resolving the future of each item in it"""
+        documents = [document for document, _ in batch]
+        started = time.perf_counter()
+        errors: dict[int, Exception] = {}
+        try:
+            await self.repository.insert_many(documents, ordered=False)
+        except BulkWriteError as exc:
+            for write_error in exc.details.get("writeErrors", []):
+                error_class = (
+                    DuplicateKeyError if write_error["code"] == 11000 else WriteError
+                )
+                errors[write_error["index"]] = error_class(
+                    write_error["errmsg"], write_error["code"], write_error
+                )
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # Nothing is known to have been written, every caller gets the error
+            errors = dict.fromkeys(range(len(batch)), exc)
+
+        elapsed = time.perf_counter() - started
+        self.batches += 1
+        self.documents += len(batch)
+        self.batch_size_max = max(self.batch_size_max, len(batch))
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+        for index, (document, future) in enumerate(batch):
+            if future.done():
+                # The caller was cancelled, the item is written all the same
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(document["_id"])
+
+    def stats(self) -> dict:
+        """Return the queue depth and batch counters, with the times in milliseconds"""
+        batches = self.batches or 1
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "documents": self.documents,
+            "batch_size_avg": round(self.documents / batches, 1),
+            "batch_size_max": self.batch_size_max,
+            "flush_ms_avg": round(self.flush_seconds_total / batches * 1000, 3),
+            "flush_ms_max": round(self.flush_seconds_max * 1000, 3),
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000,
+        }
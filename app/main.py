@@ -1,15 +1,90 @@
 """This module is used to setup the FastAPI app and its routers"""
+import asyncio
+import base64
 import os
+import sys
+import time
 from fastapi import FastAPI
-import motor.motor_tornado
 from mangum import Mangum
-from app.routers import item
+import app as app_package
+from app.routers import item, metrics, stats
+from app.internal.admission import Admission, AdmissionMiddleware, parse_route_limits
+from app.internal.cache import ItemCache, LRUCache, VersionedCache
+from app.internal.change_feed import ChangeFeed
+from app.internal.compression import CompressionMiddleware
+from app.internal.indexes import ensure_indexes
+from app.internal.metrics import CommandMonitor, Metrics, TimingMiddleware
+from app.internal.mongo import COLLECTION_NAME, DATABASE_NAME
+from app.internal.mongo import PoolMonitor, create_client, warm_up
+from app.internal.write_batcher import WriteBatcher
+from app.models.item_indexes import ITEM_INDEXES
+from app.repositories.item_codec import ItemCodec
+from app.repositories.memory_item_repository import MemoryItemRepository
+from app.repositories.mongo_item_repository import MongoItemRepository
 
 
 # AWS api gateway stage name
 stage = os.getenv("ENVIRONMENT")
 mongo_connection_string = os.getenv("CONNECTION_STRING")
 
+# Where the items are stored, "mongo" or "memory" (an in-process store, which
+# does not survive a restart, for tests and benchmarks)
+item_backend = os.getenv("ITEM_BACKEND", "mongo")
+
+# How the items are stored in MongoDb, "full" or "compact" (short field names),
+# see app/repositories/item_codec.py
+item_codec = ItemCodec.from_format(os.getenv("ITEM_STORAGE_FORMAT", "full"))
+
+# Read-through item cache, setting the size to 0 disables it
+item_cache_size = int(os.getenv("ITEM_CACHE_SIZE", "1024"))
+item_cache_ttl = float(os.getenv("ITEM_CACHE_TTL", "30"))
+
+# Item counts are cached for a few seconds, keyed by their filters
+item_count_cache_ttl = float(os.getenv("ITEM_COUNT_CACHE_TTL", "5"))
+
+# Item stats (/items/stats) are cached for longer, keyed by their filters, and
+# can also be dropped whenever an item changes (needs the change stream)
+item_stats_cache_ttl = float(os.getenv("ITEM_STATS_CACHE_TTL", "30"))
+item_stats_follow_changes = os.getenv("ITEM_STATS_FOLLOW_CHANGES", "0") == "1"
+
+# Watch the items for changes made by any app instance, to invalidate the cache
+# and feed /items/events (MongoDb needs to be a replica set)
+watch_changes = os.getenv("ITEM_CHANGE_STREAM", "1") == "1"
+change_history = int(os.getenv("ITEM_CHANGE_HISTORY", "1000"))
+change_buffer = int(os.getenv("ITEM_CHANGE_BUFFER", "100"))
+
+# Batch single item creates into insert_many calls, a batch size of 0 turns it off
+write_batch_size = int(os.getenv("ITEM_WRITE_BATCH_SIZE", "0"))
+write_batch_delay = float(os.getenv("ITEM_WRITE_BATCH_DELAY_MS", "5")) / 1000
+
+# Fraction of the requests timed for /metrics and the Server-Timing header
+metrics_sample_rate = float(os.getenv("METRICS_SAMPLE_RATE", "1"))
+
+# Response compression, the encodings in order of preference (an empty list turns
+# it off), and the smallest body worth compressing
+response_compression = [
+    encoding.strip()
+    for encoding in os.getenv("RESPONSE_COMPRESSION", "br,zstd,gzip").split(",")
+    if encoding.strip()
+]
+response_compression_min_size = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+
+# Admission control, the requests handled at once (0, the default, is no cap), how
+# many more may wait and for how long, and the caps of their own for some routes
+admission_max_in_flight = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "0"))
+admission_queue_size = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+admission_queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000")) / 1000
+admission_route_limits = parse_route_limits(os.getenv("ADMISSION_ROUTE_LIMITS", ""))
+
+# Per client rate limit, requests a second (0 turns it off) and the burst allowed,
+# the client is named by a header, or is its address
+rate_limit = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))
+rate_limit_burst = float(os.getenv("RATE_LIMIT_BURST", "0"))
+rate_limit_client_header = os.getenv("RATE_LIMIT_CLIENT_HEADER", "")
+
+# Create the indexes declared in app/models/item_indexes.py at startup
+ensure_indexes_at_startup = os.getenv("MONGO_ENSURE_INDEXES", "1") == "1"
+
 # Fix up the doc url, and openapi.json path to work with the stage name (if supplied)
 root_path = f"/{stage}" if stage else "/"
 doc_url = f"/{stage}/docs" if stage else "/docs"
@@ -17,35 +92,181 @@ openapi_url = f"/{stage}/openapi.json" if stage else "/openapi.json"
 
 
 # This code block is my refactored main.py
-def app_factory():
+def app_factory(backend: str | None = None):
     """Helper factory method to create the FAstAPI App object"""
+    backend = backend or item_backend
+    if backend not in ("mongo", "memory"):
+        raise ValueError(f"Unknown item backend: {backend}")
+
     myapp = FastAPI(openapi_url=openapi_url, docs_url=doc_url)
+    myapp.state.backend = backend
     if stage:
         myapp.include_router(item.router, prefix=root_path)
+        myapp.include_router(stats.router, prefix=root_path)
+        myapp.include_router(metrics.router, prefix=root_path)
     else:
         myapp.include_router(item.router)
+        myapp.include_router(stats.router)
+        myapp.include_router(metrics.router)
 
+    myapp.state.item_cache = ItemCache(LRUCache(item_cache_size, item_cache_ttl))
+    myapp.state.count_cache = LRUCache(256, item_count_cache_ttl)
+    myapp.state.change_feed = ChangeFeed(change_history, change_buffer)
+    myapp.state.change_feed.add_listener(myapp.state.item_cache.apply_change)
+    myapp.state.stats_cache = VersionedCache(LRUCache(256, item_stats_cache_ttl))
+    if item_stats_follow_changes:
+        myapp.state.change_feed.add_listener(myapp.state.stats_cache.apply_change)
+    myapp.state.metrics = Metrics()
+    # Added first so it runs inside the timing, which then includes compression
+    myapp.add_middleware(
+        CompressionMiddleware,
+        encodings=response_compression,
+        minimum_size=response_compression_min_size,
+    )
+    myapp.add_middleware(
+        TimingMiddleware,
+        metrics=myapp.state.metrics,
+        sample_rate=metrics_sample_rate,
+    )
+
+    myapp.state.admission = Admission(
+        max_in_flight=admission_max_in_flight,
+        queue_size=admission_queue_size,
+        queue_timeout=admission_queue_timeout,
+        route_limits=admission_route_limits,
+        rate=rate_limit,
+        burst=rate_limit_burst,
+        client_header=rate_limit_client_header,
+    )
+    myapp.state.admission.routes = myapp.routes
+    # Added last so it runs first, rejected requests cost next to nothing.
+    # The metrics, stats and change events are let straight through
+    prefix = root_path if stage else ""
+    myapp.add_middleware(
+        AdmissionMiddleware,
+        admission=myapp.state.admission,
+        metrics=myapp.state.metrics,
+        exempt=(f"{prefix}/metrics", f"{prefix}/stats/", f"{prefix}/items/events"),
+    )
     return myapp
 
 
 async def app_startup(my_app):
     """Startup event, connect to MongoDb"""
-    # "mongodb://localhost:27017"#
-    my_app.state.mongodb_client = motor.motor_tornado.MotorClient(
-        mongo_connection_string
-    )
-    my_app.state.database = my_app.state.mongodb_client["test-database"]
-    my_app.state.collection = my_app.state.database["test-collection"]
-    print("Connected to the MongoDB database!")
+    if my_app.state.backend == "memory":
+        my_app.state.item_repository = MemoryItemRepository()
+        print("Using the in-memory item store!", file=sys.stderr)
+    else:
+        # "mongodb://localhost:27017"#
+        my_app.state.pool_monitor = PoolMonitor()
+        my_app.state.mongodb_client = create_client(
+            mongo_connection_string,
+            my_app.state.pool_monitor,
+            CommandMonitor(my_app.state.metrics),
+        )
+        my_app.state.database = my_app.state.mongodb_client[DATABASE_NAME]
+        my_app.state.collection = my_app.state.database[COLLECTION_NAME]
+        my_app.state.item_repository = MongoItemRepository(
+            my_app.state.collection, item_codec
+        )
+        await warm_up(my_app.state.mongodb_client)
+        if ensure_indexes_at_startup:
+            await ensure_indexes(
+                my_app.state.collection, item_codec.indexes(ITEM_INDEXES)
+            )
+        print("Connected to the MongoDB database!", file=sys.stderr)
+
+    if watch_changes:
+        my_app.state.change_feed.start(my_app.state.item_repository)
+
+    my_app.state.write_batcher = None
+    if write_batch_size > 0:
+        my_app.state.write_batcher = WriteBatcher(
+            my_app.state.item_repository, write_batch_size, write_batch_delay
+        )
+        my_app.state.write_batcher.start()
 
 
 async def app_shutdown(my_app):
-    """Shutdown event, disconnect from MongoDb"""
-    my_app.state.mongodb_client.close()
+    """Shutdown event, write any queued items and disconnect from MongoDb"""
+    if getattr(my_app.state, "write_batcher", None) is not None:
+        await my_app.state.write_batcher.close()
+    await my_app.state.change_feed.close()
+    if my_app.state.backend == "mongo":
+        my_app.state.mongodb_client.close()
+
+
+class LambdaStartup:
+    """ASGI wrapper that connects to MongoDb on the first request
+
+    Mangum runs with the lifespan off (turned on it would connect and disconnect
+    on every invocation), so the startup event never fires under Lambda. Instead
+    the client is created on the first invocation and then reused by the warm
+    invocations that follow, for as long as the container lives.
+    """
+
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+        self.started = False
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if not self.started and scope["type"] == "http":
+            async with self._lock:
+                if not self.started:
+                    await self.startup()
+        await self.app(scope, receive, send)
+
+    async def startup(self):
+        """Connect to MongoDb, logging the cold start timings"""
+        import_ms = (time.perf_counter() - app_package.IMPORT_STARTED) * 1000
+
+        started = time.perf_counter()
+        await app_startup(self.app)
+        init_ms = (time.perf_counter() - started) * 1000
+
+        # The first round trip pays for server selection and the connection
+        started = time.perf_counter()
+        try:
+            if self.app.state.backend == "mongo":
+                await self.app.state.mongodb_client.admin.command("ping")
+        except Exception:
+            # Do not leak the client, the next invocation will try again
+            await app_shutdown(self.app)
+            raise
+        first_query_ms = (time.perf_counter() - started) * 1000
+
+        self.started = True
+        print(
+            f"Cold start: import {import_ms:.0f}ms, init {init_ms:.0f}ms, "
+            f"first query {first_query_ms:.0f}ms",
+            file=sys.stderr,
+        )
+
+
+class LambdaHandler(Mangum):
+    """Mangum handler that always base64 encodes a compressed body
+
+    Mangum sends a text body (application/json included) as a string if it
+    decodes as utf-8, which a short compressed body can do by chance. API
+    Gateway would then send it on with its bytes changed.
+    """
+
+    def __call__(self, event, context):
+        response = super().__call__(event, context)
+        headers = {
+            name.lower(): value for name, value in response.get("headers", {}).items()
+        }
+        for name, values in response.get("multiValueHeaders", {}).items():
+            headers.setdefault(name.lower(), values[0])
+        if "content-encoding" in headers and not response.get("isBase64Encoded"):
+            response["body"] = base64.b64encode(response["body"].encode()).decode()
+            response["isBase64Encoded"] = True
+        return response
 
 
 app = app_factory()
-handler = Mangum(app, lifespan="off")
+handler = LambdaHandler(LambdaStartup(app), lifespan="off")
 
 
 @app.on_event("startup")
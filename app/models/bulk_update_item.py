@@ -0,0 +1,10 @@
+"""Bulk Update Item model, used for HTTP Put on /items/bulk"""
+from pydantic import Field
+from pydantic_mongo import ObjectIdField
+from app.models.update_item import UpdateItem
+
+
+class BulkUpdateItem(UpdateItem):
+    """BulkUpdateItem Model, an UpdateItem along with the id of the item to update"""
+
+    id: ObjectIdField = Field(alias="_id")
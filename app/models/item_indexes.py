@@ -0,0 +1,15 @@
+"""Indexes on the items collection, declared alongside the item models
+
+Each index is a pymongo IndexModel, so compound, unique, partial
+(partialFilterExpression) and TTL (expireAfterSeconds) indexes can all be
+declared here. They are created at startup, see app.internal.indexes.
+"""
+from pymongo import ASCENDING, IndexModel
+
+# _id is the tie breaker for keyset paging, so each sortable field is indexed
+# along with it. The same indexes serve equality, range and prefix filters.
+ITEM_INDEXES = [
+    IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+    IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price_id"),
+    IndexModel([("tax", ASCENDING), ("_id", ASCENDING)], name="tax_id"),
+]
@@ -0,0 +1,70 @@
+"""Item Query model, the filters, sort order and projection used to list items"""
+import re
+from pydantic import BaseModel, Field, field_validator
+from app.internal.pagination import SORTABLE_FIELDS
+
+# Fields that can be asked for in a projection, _id is always returned
+PROJECTABLE_FIELDS = ("name", "description", "price", "tax")
+
+
+class ItemQuery(BaseModel):
+    """ItemQuery Model, sort and fields are given as comma separated lists"""
+
+    name_prefix: str | None = None
+    price: int | None = Field(None, ge=0, le=10)
+    price_gte: int | None = Field(None, ge=0, le=10)
+    price_lte: int | None = Field(None, ge=0, le=10)
+    # nan and inf would match nothing useful, and can not be written as JSON
+    tax: float | None = Field(None, allow_inf_nan=False)
+    tax_gte: float | None = Field(None, allow_inf_nan=False)
+    tax_lte: float | None = Field(None, allow_inf_nan=False)
+    sort: list[tuple[str, int]] = []
+    fields: list[str] | None = None
+
+    @field_validator("sort", mode="before")
+    @classmethod
+    def parse_sort(cls, value):
+        """Parse 'price,-tax' into [('price', 1), ('tax', -1)]"""
+        if not isinstance(value, str):
+            return value
+        sort = []
+        for key in filter(None, value.split(",")):
+            name = key.strip().lstrip("-+")
+            if name not in SORTABLE_FIELDS:
+                raise ValueError(f"Can not sort items by: {name}")
+            sort.append((name, -1 if key.strip().startswith("-") else 1))
+        return sort
+
+    @field_validator("fields", mode="before")
+    @classmethod
+    def parse_fields(cls, value):
+        """Parse 'name,price' into ['name', 'price']"""
+        if not isinstance(value, str):
+            return value
+        fields = [name.strip() for name in value.split(",") if name.strip()]
+        for name in fields:
+            if name not in PROJECTABLE_FIELDS and name != "_id":
+                raise ValueError(f"Unknown item field: {name}")
+        return fields
+
+    def filter(self) -> dict:
+        """Return the Mongo filter for the query"""
+        query = {}
+        if self.name_prefix:
+            # An anchored, case sensitive regex can use the name index
+            query["name"] = {"$regex": f"^{re.escape(self.name_prefix)}"}
+        for name in ("price", "tax"):
+            conditions = {}
+            for suffix, operator in (("", "$eq"), ("_gte", "$gte"), ("_lte", "$lte")):
+                value = getattr(self, name + suffix)
+                if value is not None:
+                    conditions[operator] = value
+            if conditions:
+                query[name] = conditions
+        return query
+
+    def projection(self, *required: str) -> dict | None:
+        """Return the Mongo projection, always including the required fields"""
+        if self.fields is None:
+            return None
+        return {name: 1 for name in (*self.fields, *required)}
@@ -1,5 +1,6 @@
 """Create Item model response object, used for HTTP Post response"""
-from pydantic import BaseModel, Field, ConfigDict
+from typing import Annotated
+from pydantic import BaseModel, Field, ConfigDict, WithJsonSchema
 from pydantic_mongo import ObjectIdField
 
 
@@ -7,7 +8,10 @@ class ItemResponse(BaseModel):
     """Item Response Model object, used for HTTP Get/Post response"""
 
     # All fields are mandatory for when an item is returned
-    id: ObjectIdField = Field(None, alias="_id")
+    # ObjectIdField has no JSON schema of its own, it is sent as a string
+    id: Annotated[ObjectIdField, WithJsonSchema({"type": "string"})] = Field(
+        None, alias="_id"
+    )
     name: str
     description: str | None
     price: int = Field(ge=0, le=10)
@@ -0,0 +1,19 @@
+"""Partial Item model response object, used when listing items with a projection"""
+from typing import Annotated
+from pydantic import BaseModel, Field, ConfigDict, WithJsonSchema
+from pydantic_mongo import ObjectIdField
+
+
+class PartialItemResponse(BaseModel):
+    """Partial Item Response Model object, only the projected fields are returned"""
+
+    # All fields are optional, as the caller may have asked for only some of them
+    # ObjectIdField has no JSON schema of its own, it is sent as a string
+    id: Annotated[ObjectIdField, WithJsonSchema({"type": "string"})] = Field(
+        None, alias="_id"
+    )
+    name: str | None = None
+    description: str | None = None
+    price: int | None = Field(None, ge=0, le=10)
+    tax: float | None = None
+    model_config = ConfigDict(arbitrary_types_allowed=True)
@@ -0,0 +1,150 @@
+"""Item Repository interface, the storage the items router reads and writes"""
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+from bson import ObjectId
+
+# Revision counter kept on every item, set to 1 on insert and bumped by each
+# update. It is not returned by find, only by the methods returning one item.
+REVISION_FIELD = "_rev"
+
+# Numeric fields summarised by aggregate
+SUMMARY_FIELDS = ("price", "tax")
+
+
+def item_filter(item_id: ObjectId, revisions: list[int] | None = None) -> dict:
+    """Return the filter selecting an item, at one of revisions if they are given"""
+    filters = {"_id": item_id}
+    if revisions is not None:
+        # Items written before revisions were kept have none, which counts as 0
+        filters[REVISION_FIELD] = {
+            "$in": [*revisions, None] if 0 in revisions else revisions
+        }
+    return filters
+
+
+def item_stats(totals: dict, buckets: dict, boundaries: list[int]) -> dict:
+    """Return the result of aggregate, from the totals (count, price_min, ...)
+    and the number of items in each price bucket, keyed by its lower boundary"""
+    stats = {"count": totals.get("count", 0)}
+    for name in SUMMARY_FIELDS:
+        stats[name] = {
+            stat: totals.get(f"{name}_{stat}") for stat in ("min", "max", "avg")
+        }
+    stats["price_buckets"] = [
+        {"min": lower, "max": upper, "count": buckets.get(lower, 0)}
+        for lower, upper in zip(boundaries, boundaries[1:])
+    ]
+    return stats
+
+
+class ItemRepository(ABC):
+    """Storage for item documents, these are dicts with an ObjectId _id
+
+    Filters, projections and sorts are given in MongoDb form, e.g.
+    {"price": {"$gte": 2}}, {"name": 1} and [("price", 1), ("_id", 1)]
+    """
+
+    @abstractmethod
+    async def get(self, item_id: ObjectId) -> dict | None:
+        """Return the item with the given id, or None if it does not exist"""
+
+    @abstractmethod
+    async def get_many(self, item_ids: list[ObjectId]) -> list[dict]:
+        """Return the items with the given ids that exist, in no particular order"""
+
+    @abstractmethod
+    async def get_revision(self, item_id: ObjectId) -> int | None:
+        """Return the revision of an item, without loading the rest of it"""
+
+    @abstractmethod
+    def find(
+        self,
+        filters: dict,
+        projection: dict | None = None,
+        sort: list[tuple[str, int]] | None = None,
+        skip: int = 0,
+        limit: int = 0,
+        batch_size: int = 0,
+    ) -> AsyncIterator[dict]:
+        # pylint: disable=too-many-arguments
+        """Return the matching items, a limit of 0 means no limit"""
+
+    @abstractmethod
+    async def count(self, filters: dict) -> tuple[int, bool]:
+        """Return how many items match, and whether that count is exact
+
+        Without filters the count may be estimated, from the collection metadata
+        """
+
+    @abstractmethod
+    async def aggregate(self, filters: dict, boundaries: list[int]) -> dict:
+        """Summarise the matching items, without reading them out
+
+        Returns the count, the min, max and average of each SUMMARY_FIELDS
+        (None when no items match) and the count of each price bucket, from
+        one boundary (inclusive) to the next (exclusive)
+        """
+
+    @abstractmethod
+    async def existing_ids(self, item_ids: list[ObjectId]) -> set[ObjectId]:
+        """Return which of the given ids exist"""
+
+    @abstractmethod
+    async def insert(self, document: dict) -> ObjectId:
+        """Insert an item, filling in its _id, and return the _id"""
+
+    @abstractmethod
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> None:
+        """Insert many items, filling in their _ids
+
+        Raises a pymongo BulkWriteError listing the items that failed
+        """
+
+    @abstractmethod
+    async def update(
+        self, item_id: ObjectId, fields: dict, revisions: list[int] | None = None
+    ) -> int | None:
+        """Set the given fields on an item, returns its new revision, or None if
+        it does not exist
+
+        Given revisions, the item is only updated if it is at one of them
+        """
+
+    @abstractmethod
+    async def update_and_get(
+        self, item_id: ObjectId, fields: dict, revisions: list[int] | None = None
+    ) -> dict | None:
+        """Set the given fields on an item and return the updated item"""
+
+    @abstractmethod
+    async def bulk_update(
+        self,
+        updates: list[tuple[ObjectId, dict]],
+        upsert: bool = False,
+        ordered: bool = True,
+    ) -> None:
+        """Set the given fields on many items, creating them if upsert is set
+
+        Raises a pymongo BulkWriteError listing the updates that failed
+        """
+
+    @abstractmethod
+    async def delete(
+        self, item_id: ObjectId, revisions: list[int] | None = None
+    ) -> bool:
+        """Delete an item, returns False if it does not exist (at one of revisions)"""
+
+    @abstractmethod
+    async def delete_many(self, item_ids: list[ObjectId]) -> int:
+        """Delete many items, returning how many were deleted"""
+
+    @abstractmethod
+    async def check_resume_token(self, resume_after: dict) -> None:
+        """Raise OperationFailure if watch can not resume after the token"""
+
+    @abstractmethod
+    async def watch(self, resume_after: dict | None = None) -> AsyncIterator[dict]:
+        """Return the changes made to the items from now, or after resume_after
+
+        The changes are MongoDb change events, with the resume token in _id
+        """
@@ -0,0 +1,340 @@
+"""Memory Item Repository, items held in process, for tests and benchmarks
+
+The items are kept in a dict keyed by _id, so lookups by id do not scan. The
+other queries scan every item, evaluating the subset of the MongoDb query
+language that the routers use. The last CHANGE_HISTORY changes are kept, in the
+same form as MongoDb change events, for watch.
+"""
+import asyncio
+import re
+from bisect import bisect_right
+from collections import Counter, deque
+from typing import Any, AsyncIterator
+from bson import ObjectId
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    WriteError,
+)
+from app.repositories.item_repository import (
+    REVISION_FIELD,
+    SUMMARY_FIELDS,
+    ItemRepository,
+    item_filter,
+    item_stats,
+)
+
+CHANGE_HISTORY = 1000
+
+# MongoDb's error code for a resume token that has dropped out of the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+def _type_order(value: Any) -> int:
+    """Rank values by type the way MongoDb orders them when sorting"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    return 3
+
+
+def _sort_key(value: Any) -> tuple:
+    """Key sorting values of mixed types in MongoDb order"""
+    return (_type_order(value), value)
+
+
+def _compare(operator):
+    """Comparison operators only match values of the same type, as in MongoDb"""
+    return lambda value, operand: (
+        _type_order(value) == _type_order(operand) and operator(value, operand)
+    )
+
+
+OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": _compare(lambda value, operand: value > operand),
+    "$gte": _compare(lambda value, operand: value >= operand),
+    "$lt": _compare(lambda value, operand: value < operand),
+    "$lte": _compare(lambda value, operand: value <= operand),
+    "$in": lambda value, operand: value in operand,
+    "$regex": lambda value, operand: (
+        isinstance(value, str) and re.search(operand, value) is not None
+    ),
+}
+
+
+def matches(document: dict, filters: dict) -> bool:
+    """Return True if the document matches the MongoDb style filters"""
+    for key, condition in filters.items():
+        if key == "$and":
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator not in OPERATORS:
+                    raise ValueError(f"Unsupported query operator: {operator}")
+                if not OPERATORS[operator](document.get(key), operand):
+                    return False
+        elif document.get(key) != condition:
+            return False
+    return True
+
+
+def project(document: dict, projection: dict | None) -> dict:
+    """Return a copy of the document holding only the projected fields"""
+    if projection is None:
+        return dict(document)
+    if not any(projection.values()):
+        return {
+            name: value for name, value in document.items() if name not in projection
+        }
+    included = {name for name, include in projection.items() if include}
+    if projection.get("_id", 1):
+        included.add("_id")
+    return {name: value for name, value in document.items() if name in included}
+
+
+class MemoryItemRepository(ItemRepository):
+    """Items held in a dict, keyed by their _id"""
+
+    def __init__(self):
+        self._items: dict[ObjectId, dict] = {}
+        self._changes: deque[dict] = deque(maxlen=CHANGE_HISTORY)
+        self._change_count = 0
+        self._changed = asyncio.Event()
+
+    def _record(self, operation: str, item_id: ObjectId, **fields) -> None:
+        """Keep a change event for watch, waking up any watchers"""
+        self._change_count += 1
+        self._changes.append(
+            {
+                "_id": {"_data": f"{self._change_count:016x}"},
+                "operationType": operation,
+                "documentKey": {"_id": item_id},
+                **fields,
+            }
+        )
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def get(self, item_id: ObjectId) -> dict | None:
+        item = self._items.get(item_id)
+        return None if item is None else dict(item)
+
+    async def get_many(self, item_ids: list[ObjectId]) -> list[dict]:
+        return [
+            dict(self._items[item_id])
+            for item_id in set(item_ids)
+            if item_id in self._items
+        ]
+
+    async def get_revision(self, item_id: ObjectId) -> int | None:
+        item = self._items.get(item_id)
+        return None if item is None else item.get(REVISION_FIELD, 0)
+
+    def find(
+        self,
+        filters: dict,
+        projection: dict | None = None,
+        sort: list[tuple[str, int]] | None = None,
+        skip: int = 0,
+        limit: int = 0,
+        batch_size: int = 0,
+    ) -> AsyncIterator[dict]:
+        # pylint: disable=too-many-arguments
+        if set(filters) == {"_id"} and not isinstance(filters["_id"], dict):
+            items = (
+                [self._items[filters["_id"]]] if filters["_id"] in self._items else []
+            )
+        else:
+            items = [item for item in self._items.values() if matches(item, filters)]
+
+        # Sort by the last key first, each sort being stable
+        for name, direction in reversed(sort or []):
+            items.sort(
+                key=lambda item, name=name: _sort_key(item.get(name)),
+                reverse=direction == -1,
+            )
+        items = items[skip : skip + limit] if limit else items[skip:]
+        return self._iterate(items, projection or {REVISION_FIELD: 0})
+
+    @staticmethod
+    async def _iterate(
+        items: list[dict], projection: dict | None
+    ) -> AsyncIterator[dict]:
+        for item in items:
+            yield project(item, projection)
+
+    async def count(self, filters: dict) -> tuple[int, bool]:
+        if not filters:
+            return len(self._items), True
+        return sum(1 for item in self._items.values() if matches(item, filters)), True
+
+    async def aggregate(self, filters: dict, boundaries: list[int]) -> dict:
+        items = [item for item in self._items.values() if matches(item, filters)]
+        totals = {"count": len(items)}
+        for name in SUMMARY_FIELDS:
+            # $min, $max and $avg skip the items without a number
+            values = [
+                item[name] for item in items if isinstance(item.get(name), (int, float))
+            ]
+            if values:
+                totals[f"{name}_min"] = min(values)
+                totals[f"{name}_max"] = max(values)
+                totals[f"{name}_avg"] = sum(values) / len(values)
+
+        buckets = Counter()
+        for item in items:
+            price = item.get("price")
+            if (
+                isinstance(price, (int, float))
+                and boundaries[0] <= price < boundaries[-1]
+            ):
+                buckets[boundaries[bisect_right(boundaries, price) - 1]] += 1
+        return item_stats(totals, buckets, boundaries)
+
+    async def existing_ids(self, item_ids: list[ObjectId]) -> set[ObjectId]:
+        return {item_id for item_id in item_ids if item_id in self._items}
+
+    def _insert(self, document: dict) -> ObjectId:
+        item_id = document.setdefault("_id", ObjectId())
+        if item_id in self._items:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error dup key: {{ _id: {item_id} }}", 11000
+            )
+        document[REVISION_FIELD] = 1
+        self._items[item_id] = dict(document)
+        self._record("insert", item_id, fullDocument=dict(document))
+        return item_id
+
+    async def insert(self, document: dict) -> ObjectId:
+        return self._insert(document)
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> None:
+        # Like pymongo, every document gets its _id before any are inserted
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+
+        write_errors = []
+        for index, document in enumerate(documents):
+            try:
+                self._insert(document)
+            except DuplicateKeyError as exc:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(exc)})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors})
+
+    def _matches(self, item_id: ObjectId, revisions: list[int] | None) -> bool:
+        """Return True if the item exists, at one of revisions if they are given"""
+        item = self._items.get(item_id)
+        return item is not None and matches(item, item_filter(item_id, revisions))
+
+    async def update(
+        self, item_id: ObjectId, fields: dict, revisions: list[int] | None = None
+    ) -> int | None:
+        if not self._matches(item_id, revisions):
+            return None
+        item = self._items[item_id]
+        item.update(fields)
+        item[REVISION_FIELD] = item.get(REVISION_FIELD, 0) + 1
+        updated_fields = {**fields, REVISION_FIELD: item[REVISION_FIELD]}
+        self._record(
+            "update",
+            item_id,
+            updateDescription={"updatedFields": updated_fields, "removedFields": []},
+        )
+        return item[REVISION_FIELD]
+
+    async def update_and_get(
+        self, item_id: ObjectId, fields: dict, revisions: list[int] | None = None
+    ) -> dict | None:
+        if await self.update(item_id, fields, revisions) is None:
+            return None
+        return dict(self._items[item_id])
+
+    async def bulk_update(
+        self,
+        updates: list[tuple[ObjectId, dict]],
+        upsert: bool = False,
+        ordered: bool = True,
+    ) -> None:
+        # Like pymongo, an ordered bulk write stops at the first error
+        write_errors = []
+        for index, (item_id, fields) in enumerate(updates):
+            try:
+                if await self.update(item_id, fields) is None and upsert:
+                    self._insert({"_id": item_id, **fields})
+            except WriteError as exc:
+                write_errors.append(
+                    {"index": index, "code": exc.code, "errmsg": str(exc)}
+                )
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors})
+
+    async def delete(
+        self, item_id: ObjectId, revisions: list[int] | None = None
+    ) -> bool:
+        if not self._matches(item_id, revisions):
+            return False
+        del self._items[item_id]
+        self._record("delete", item_id)
+        return True
+
+    async def delete_many(self, item_ids: list[ObjectId]) -> int:
+        deleted = 0
+        for item_id in item_ids:
+            deleted += await self.delete(item_id)
+        return deleted
+
+    def _resume_position(self, resume_after: dict) -> int:
+        """Return the change count a resume token was made at
+
+        Raises OperationFailure, as MongoDb does, for a token that is malformed,
+        from the future, or no longer in the history
+        """
+        try:
+            position = int(resume_after["_data"], 16)
+        except (KeyError, TypeError, ValueError):
+            raise OperationFailure("Invalid resume token") from None
+        if position > self._change_count:
+            raise OperationFailure("Resume token is not from this change history")
+        if position + 1 < self._change_count - len(self._changes) + 1:
+            raise OperationFailure(
+                "Resume token is no longer in the change history",
+                CHANGE_STREAM_HISTORY_LOST,
+            )
+        return position
+
+    async def check_resume_token(self, resume_after: dict) -> None:
+        self._resume_position(resume_after)
+
+    async def watch(self, resume_after: dict | None = None) -> AsyncIterator[dict]:
+        position = self._change_count
+        if resume_after is not None:
+            position = self._resume_position(resume_after)
+
+        while True:
+            changed = self._changed
+            oldest = self._change_count - len(self._changes) + 1
+            if position + 1 < oldest:
+                raise OperationFailure(
+                    "Resume token is no longer in the change history",
+                    CHANGE_STREAM_HISTORY_LOST,
+                )
+            for change in list(self._changes)[position + 1 - oldest :]:
+                position += 1
+                yield change
+            if position == self._change_count:
+                await changed.wait()
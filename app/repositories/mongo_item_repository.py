@@ -0,0 +1,241 @@
+"""Mongo Item Repository, items stored in a MongoDb collection through Motor
+
+Every document goes through an ItemCodec on its way in and out, so the
+collection can hold the items in the full or the compact storage format.
+"""
+from typing import AsyncIterator
+from bson import ObjectId
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from app.repositories.item_codec import ItemCodec
+from app.repositories.item_repository import (
+    REVISION_FIELD,
+    SUMMARY_FIELDS,
+    ItemRepository,
+    item_filter,
+    item_stats,
+)
+
+# Applied alongside every update
+BUMP_REVISION = {"$inc": {REVISION_FIELD: 1}}
+
+
+class MongoItemRepository(ItemRepository):
+    """Items stored in a Motor collection"""
+
+    def __init__(self, collection, codec: ItemCodec | None = None):
+        self.collection = collection
+        self.codec = codec or ItemCodec()
+
+    def _filter(self, item_id: ObjectId, revisions: list[int] | None) -> dict:
+        """Return the filter of a write, which only matches the current format
+
+        The fields written are named for the current format, so a document in
+        the other one is rewritten first, see _rewrite
+        """
+        return {
+            **self.codec.filter(item_filter(item_id, revisions)),
+            **self.codec.current(),
+        }
+
+    def _update(self, fields: dict) -> dict:
+        """Return the update setting fields, and bumping the revision"""
+        return self.codec.update({"$set": fields, **BUMP_REVISION})
+
+    async def _rewrite(self, item_id: ObjectId) -> bool:
+        """Rewrite an item in the current format, returns False if there was none"""
+        document = await self.collection.find_one(
+            {"_id": item_id, **self.codec.outdated()}
+        )
+        if document is None:
+            return False
+        await self._upgrade([document])
+        return True
+
+    async def _upgrade(self, documents: list[dict]) -> None:
+        """Rewrite documents read in the other format in the current one"""
+        outdated = [
+            document for document in documents if not self.codec.is_current(document)
+        ]
+        if outdated:
+            await self.collection.bulk_write(
+                [ReplaceOne(*self.codec.upgrade(document)) for document in outdated],
+                ordered=False,
+            )
+
+    async def _decoded(self, cursor) -> AsyncIterator[dict]:
+        """Yield the items of a cursor"""
+        async for document in cursor:
+            yield self.codec.decode(document)
+
+    async def get(self, item_id: ObjectId) -> dict | None:
+        document = await self.collection.find_one({"_id": item_id})
+        if document is None:
+            return None
+        await self._upgrade([document])
+        return self.codec.decode(document)
+
+    async def get_many(self, item_ids: list[ObjectId]) -> list[dict]:
+        cursor = self.collection.find({"_id": {"$in": item_ids}})
+        documents = await cursor.to_list(length=None)
+        await self._upgrade(documents)
+        return [self.codec.decode(document) for document in documents]
+
+    async def get_revision(self, item_id: ObjectId) -> int | None:
+        item = await self.collection.find_one(
+            {"_id": item_id}, self.codec.projection({REVISION_FIELD: 1})
+        )
+        return None if item is None else self.codec.decode(item).get(REVISION_FIELD, 0)
+
+    def find(
+        self,
+        filters: dict,
+        projection: dict | None = None,
+        sort: list[tuple[str, int]] | None = None,
+        skip: int = 0,
+        limit: int = 0,
+        batch_size: int = 0,
+    ) -> AsyncIterator[dict]:
+        # pylint: disable=too-many-arguments
+        if projection is None:
+            projection = {REVISION_FIELD: 0}
+        cursor = self.collection.find(
+            self.codec.filter(filters), self.codec.projection(projection)
+        )
+        if sort:
+            cursor = cursor.sort(self.codec.sort(sort))
+        cursor = cursor.skip(skip).limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return self._decoded(cursor)
+
+    async def count(self, filters: dict) -> tuple[int, bool]:
+        if not filters:
+            # Read from the collection metadata, rather than scanning it
+            return await self.collection.estimated_document_count(), False
+        # The filters are all on indexed fields, so this counts index keys
+        return await self.collection.count_documents(self.codec.filter(filters)), True
+
+    async def aggregate(self, filters: dict, boundaries: list[int]) -> dict:
+        totals = {"_id": None, "count": {"$sum": 1}}
+        for name in SUMMARY_FIELDS:
+            field = f"${self.codec.field(name)}"
+            for stat in ("min", "max", "avg"):
+                totals[f"{name}_{stat}"] = {f"${stat}": field}
+        bucket = {
+            "groupBy": f"${self.codec.field('price')}",
+            "boundaries": boundaries,
+            # Prices outside the boundaries are counted here, and left out
+            "default": "other",
+        }
+        # One pass over the matching items, only the summary comes back
+        pipeline = [
+            {"$match": self.codec.filter(filters)},
+            {
+                "$facet": {
+                    "totals": [{"$group": totals}],
+                    "buckets": [{"$bucket": bucket}],
+                }
+            },
+        ]
+        facets = (await self.collection.aggregate(pipeline).to_list(length=1))[0]
+        return item_stats(
+            facets["totals"][0] if facets["totals"] else {},
+            {bucket["_id"]: bucket["count"] for bucket in facets["buckets"]},
+            boundaries,
+        )
+
+    async def existing_ids(self, item_ids: list[ObjectId]) -> set[ObjectId]:
+        cursor = self.collection.find({"_id": {"$in": item_ids}}, {"_id": 1})
+        return {item["_id"] async for item in cursor}
+
+    async def insert(self, document: dict) -> ObjectId:
+        document[REVISION_FIELD] = 1
+        document.setdefault("_id", ObjectId())
+        await self.collection.insert_one(self.codec.encode(document))
+        return document["_id"]
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> None:
+        for document in documents:
+            document[REVISION_FIELD] = 1
+            # The caller reads the _id of each document once they are written
+            document.setdefault("_id", ObjectId())
+        await self.collection.insert_many(
+            [self.codec.encode(document) for document in documents], ordered=ordered
+        )
+
+    async def update(
+        self, item_id: ObjectId, fields: dict, revisions: list[int] | None = None
+    ) -> int | None:
+        # Only the new revision is sent back, not the whole item
+        revision = self.codec.field(REVISION_FIELD)
+        for _ in range(2):
+            document = await self.collection.find_one_and_update(
+                self._filter(item_id, revisions),
+                self._update(fields),
+                projection={revision: 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is not None or not await self._rewrite(item_id):
+                break
+        return None if document is None else document[revision]
+
+    async def update_and_get(
+        self, item_id: ObjectId, fields: dict, revisions: list[int] | None = None
+    ) -> dict | None:
+        for _ in range(2):
+            document = await self.collection.find_one_and_update(
+                self._filter(item_id, revisions),
+                self._update(fields),
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is not None or not await self._rewrite(item_id):
+                break
+        return None if document is None else self.codec.decode(document)
+
+    async def bulk_update(
+        self,
+        updates: list[tuple[ObjectId, dict]],
+        upsert: bool = False,
+        ordered: bool = True,
+    ) -> None:
+        # Rewrite the items still in the other format, the updates name the
+        # fields of the current one
+        cursor = self.collection.find(
+            {
+                "_id": {"$in": [item_id for item_id, _ in updates]},
+                **self.codec.outdated(),
+            }
+        )
+        await self._upgrade(await cursor.to_list(length=None))
+
+        operations = [
+            UpdateOne({"_id": item_id}, self._update(fields), upsert=upsert)
+            for item_id, fields in updates
+        ]
+        await self.collection.bulk_write(operations, ordered=ordered)
+
+    async def delete(
+        self, item_id: ObjectId, revisions: list[int] | None = None
+    ) -> bool:
+        if revisions is None:
+            result = await self.collection.delete_one({"_id": item_id})
+            return result.deleted_count == 1
+        for _ in range(2):
+            result = await self.collection.delete_one(self._filter(item_id, revisions))
+            if result.deleted_count or not await self._rewrite(item_id):
+                break
+        return result.deleted_count == 1
+
+    async def delete_many(self, item_ids: list[ObjectId]) -> int:
+        result = await self.collection.delete_many({"_id": {"$in": item_ids}})
+        return result.deleted_count
+
+    async def check_resume_token(self, resume_after: dict) -> None:
+        # Opening the stream is what checks the token, it is closed straight away
+        async with self.collection.watch(resume_after=resume_after):
+            pass
+
+    async def watch(self, resume_after: dict | None = None) -> AsyncIterator[dict]:
+        async with self.collection.watch(resume_after=resume_after) as stream:
+            async for change in stream:
+                yield self.codec.change(change)
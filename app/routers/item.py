@@ -1,12 +1,33 @@
 """Setup the router for the /test route"""
-from fastapi import APIRouter, Body, status, Request
+from fastapi import APIRouter, Body, Depends, Query, status, Request
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import ValidationError
 from pydantic_mongo import ObjectIdField
-from bson import ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
 from app.models.create_item import CreateItem
 from app.models.update_item import UpdateItem
+from app.models.bulk_update_item import BulkUpdateItem
+from app.models.item_query import ItemQuery
 from app.models.item_response import ItemResponse
+from app.models.partial_item_response import PartialItemResponse
+from app.dependencies import item_query
+from app.internal.etags import (
+    body_etag,
+    item_etag,
+    match_revisions,
+    none_match,
+    revision_etag,
+)
+from app.internal.pagination import InvalidCursor, decode_cursor, parse_order_by
+from app.internal.serialization import FastJSONResponse, dumps, item_response
+from app.internal.streaming import (
+    NDJSON_MEDIA_TYPE,
+    SSE_MEDIA_TYPE,
+    json_array_chunks,
+    ndjson_lines,
+    server_sent_events,
+)
 
 # pylint: disable=W0108
 router = APIRouter(
@@ -16,75 +37,547 @@ router = APIRouter(
 )
 
 
+# The bulk, lookup, cache, count, stats and events routes are declared ahead of the
+# /{item_id} routes, otherwise their names would be matched (and rejected) as an id
+
+# Prices run from 0 to 10, the stats buckets cover them all
+PRICE_BOUNDS = (0, 11)
+
+
+def _not_modified(etag: str, headers: dict | None = None) -> Response:
+    """Return 304 Not Modified, with the headers a 200 would have had"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={**(headers or {}), "ETag": etag},
+    )
+
+
+async def _failed_precondition(request: Request, item_id) -> JSONResponse:
+    """Return 412 if the item exists (at another revision), otherwise 404
+
+    Only called once a conditional write has matched nothing, so the usual
+    path does not pay for the extra read
+    """
+    if await request.app.state.item_repository.get_revision(item_id) is not None:
+        return JSONResponse(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            content=f"Item with id: {item_id} has been changed",
+        )
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content=f"Item with id: {item_id} does not exist",
+    )
+
+
+async def _count_items(request: Request, filters: dict) -> tuple[int, bool]:
+    """Count the items matching filters, and whether the count is exact
+
+    Counts are cached for a few seconds, and concurrent identical counts share
+    a single query
+    """
+    key = dumps(filters).decode()
+    counted = await request.app.state.count_cache.get(key)
+    if counted is None:
+        counted = await request.app.state.item_cache.coalesce(
+            ("count", key), lambda: request.app.state.item_repository.count(filters)
+        )
+        await request.app.state.count_cache.set(key, counted)
+    return counted
+
+
+async def _item_stats(request: Request, filters: dict, boundaries: list[int]) -> dict:
+    """Summarise the items matching filters, caching the result
+
+    Concurrent identical requests share a single aggregation
+    """
+    cache = request.app.state.stats_cache
+    key = cache.key(dumps([filters, boundaries]).decode())
+    stats = await cache.get(key)
+    if stats is None:
+        stats = await request.app.state.item_cache.coalesce(
+            ("stats", key),
+            lambda: request.app.state.item_repository.aggregate(filters, boundaries),
+        )
+        await cache.set(key, stats)
+    return stats
+
+
+def _bulk_response(results: list[dict], success: int) -> JSONResponse:
+    """Return the per item results, with 207 if any of the items failed"""
+    failed = any(result["status"] >= 400 for result in results)
+    return FastJSONResponse(
+        status_code=status.HTTP_207_MULTI_STATUS if failed else success,
+        content=results,
+    )
+
+
+def _apply_write_errors(
+    results: list[dict], error: BulkWriteError, positions: list[int], ordered: bool
+) -> None:
+    """Record the write errors of a bulk write against the items they belong to
+
+    positions maps the index of each operation sent to Mongo back to the index
+    of the item in the request
+    """
+    write_errors = {
+        write_error["index"]: write_error
+        for write_error in error.details.get("writeErrors", [])
+    }
+    first_error = min(write_errors, default=len(positions))
+    for index, position in enumerate(positions):
+        if index in write_errors:
+            duplicate = write_errors[index]["code"] == 11000
+            results[position]["status"] = (
+                status.HTTP_409_CONFLICT if duplicate else status.HTTP_400_BAD_REQUEST
+            )
+            results[position]["detail"] = write_errors[index]["errmsg"]
+        elif ordered and index > first_error:
+            # An ordered bulk write stops at the first error
+            results[position]["status"] = status.HTTP_424_FAILED_DEPENDENCY
+            results[position]["detail"] = "Not attempted, an earlier item failed"
+
+
+@router.post("/bulk")
+async def create_items(
+    request: Request, items: list[CreateItem] = Body(...), ordered: bool = True
+) -> JSONResponse:
+    """This method creates many items using a single insert_many"""
+
+    documents = [jsonable_encoder(item) for item in items]
+    results = [{"_id": None, "status": status.HTTP_201_CREATED} for _ in documents]
+
+    if documents:
+        try:
+            await request.app.state.item_repository.insert_many(
+                documents, ordered=ordered
+            )
+        except BulkWriteError as exc:
+            _apply_write_errors(results, exc, list(range(len(documents))), ordered)
+
+    # insert_many fills in the _id of each document it is given
+    for result, document in zip(results, documents):
+        if result["status"] == status.HTTP_201_CREATED:
+            result["_id"] = str(document["_id"])
+
+    return _bulk_response(results, status.HTTP_201_CREATED)
+
+
+@router.put("/bulk")
+async def put_items(
+    request: Request,
+    items: list[BulkUpdateItem] = Body(...),
+    ordered: bool = True,
+    upsert: bool = False,
+) -> JSONResponse:
+    """This method updates (or upserts) many items using a single bulk write
+
+    When upserting, each item must hold all of the fields needed to create it
+    """
+
+    repository = request.app.state.item_repository
+    results = [{"_id": str(item.id), "status": status.HTTP_200_OK} for item in items]
+    existing = await repository.existing_ids([item.id for item in items])
+
+    updates, positions = [], []
+    for position, item in enumerate(items):
+        fields = {
+            k: v for k, v in item.model_dump(exclude={"id"}).items() if v is not None
+        }
+        if upsert:
+            try:
+                fields = jsonable_encoder(
+                    CreateItem.model_validate(
+                        item.model_dump(exclude={"id"}, exclude_unset=True)
+                    )
+                )
+            except ValidationError as exc:
+                results[position]["status"] = status.HTTP_422_UNPROCESSABLE_ENTITY
+                results[position]["detail"] = jsonable_encoder(
+                    exc.errors(include_url=False)
+                )
+                continue
+            if item.id not in existing:
+                results[position]["status"] = status.HTTP_201_CREATED
+        elif item.id not in existing:
+            results[position]["status"] = status.HTTP_404_NOT_FOUND
+            results[position]["detail"] = f"Item with id: {item.id} does not exist"
+            continue
+        elif not fields:
+            continue
+
+        updates.append((item.id, fields))
+        positions.append(position)
+
+    if updates:
+        try:
+            await repository.bulk_update(updates, upsert=upsert, ordered=ordered)
+        except BulkWriteError as exc:
+            _apply_write_errors(results, exc, positions, ordered)
+        await request.app.state.item_cache.invalidate(*(item.id for item in items))
+
+    return _bulk_response(results, status.HTTP_200_OK)
+
+
+@router.delete("/bulk")
+async def delete_items(
+    request: Request, item_ids: list[ObjectIdField] = Body(...)
+) -> JSONResponse:
+    """This method deletes many items using a single delete_many"""
+
+    repository = request.app.state.item_repository
+    existing = await repository.existing_ids(item_ids)
+    if existing:
+        await repository.delete_many(list(existing))
+        await request.app.state.item_cache.invalidate(*existing)
+
+    results = []
+    for item_id in item_ids:
+        if item_id in existing:
+            results.append({"_id": str(item_id), "status": status.HTTP_200_OK})
+        else:
+            results.append(
+                {
+                    "_id": str(item_id),
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "detail": f"Item with id: {item_id} does not exist",
+                }
+            )
+
+    return _bulk_response(results, status.HTTP_200_OK)
+
+
+@router.post("/lookup")
+async def lookup_items(
+    request: Request, item_ids: list[ObjectIdField] = Body(...)
+) -> JSONResponse:
+    """Called to get many Items by id, using a single find for those not cached
+
+    The results are in the order of the ids, each with its status (and the item
+    with its ETag, or why it was not found), with 207 if any were not found
+    """
+
+    repository = request.app.state.item_repository
+    items = await request.app.state.item_cache.get_many_or_load(
+        item_ids, lambda missing: repository.get_many(missing)
+    )
+
+    results = []
+    for item_id in item_ids:
+        item = items.get(str(item_id))
+        if item is None:
+            results.append(
+                {
+                    "_id": str(item_id),
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "detail": f"Item with id: {item_id} does not exist",
+                }
+            )
+        else:
+            results.append(
+                {
+                    "_id": str(item_id),
+                    "status": status.HTTP_200_OK,
+                    "etag": item_etag(item),
+                    "item": item_response(item),
+                }
+            )
+
+    return _bulk_response(results, status.HTTP_200_OK)
+
+
+@router.get("/cache/stats")
+async def read_cache_stats(request: Request) -> JSONResponse:
+    """Called to get the hit/miss/eviction counters of the item cache"""
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK, content=request.app.state.item_cache.stats()
+    )
+
+
+@router.get("/count")
+async def count_items(
+    request: Request, query: ItemQuery = Depends(item_query)
+) -> JSONResponse:
+    """Called to count the items, filtered the same way as the item listing
+
+    Without filters the count is estimated from the collection metadata, which
+    is instant but can drift, and exact is false in the response
+    """
+
+    count, exact = await _count_items(request, query.filter())
+    return JSONResponse(
+        status_code=status.HTTP_200_OK, content={"count": count, "exact": exact}
+    )
+
+
+@router.get("/stats")
+async def read_item_stats(
+    request: Request,
+    bucket_size: int = Query(2, ge=1, le=PRICE_BOUNDS[1]),
+    query: ItemQuery = Depends(item_query),
+) -> JSONResponse:
+    """Called to summarise the items, filtered the same way as the item listing
+
+    Returns the count, the min, max and average price and tax, and the number of
+    items in each price bucket (bucket_size wide), computed by the database in
+    one aggregation, so only the summary is sent. The result is cached for
+    ITEM_STATS_CACHE_TTL seconds
+    """
+
+    lower, upper = PRICE_BOUNDS
+    boundaries = [*range(lower, upper, bucket_size), upper]
+    stats = await _item_stats(request, query.filter(), boundaries)
+    return JSONResponse(status_code=status.HTTP_200_OK, content=stats)
+
+
+@router.get("/events")
+async def read_item_events(request: Request, after: str | None = None) -> Response:
+    """Called to follow the changes to the items, as Server-Sent Events
+
+    Each event is named after the change (insert, update or delete) and its id
+    is a resume token. Reconnecting with it in Last-Event-ID (as EventSource
+    does) or after resumes just after that change, a token that can not be
+    resumed from gets 400.
+    """
+
+    change_feed = request.app.state.change_feed
+    if not change_feed.running:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content="Item changes are not being watched",
+        )
+
+    resume_after = request.headers.get("last-event-id") or after
+    subscription = change_feed.subscribe(resume_after)
+    if subscription is None:
+        # Checked before the stream starts, so a bad token gets a 400 rather
+        # than an error event
+        try:
+            await request.app.state.item_repository.check_resume_token(
+                {"_data": resume_after}
+            )
+        except OperationFailure:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content=f"Can not resume the item changes after: {resume_after}",
+            )
+
+    async def events():
+        if subscription is None:
+            # Too far back for the feed's history, so follow a change stream of
+            # our own from there
+            changes = request.app.state.item_repository.watch({"_data": resume_after})
+        else:
+            changes = subscription
+        try:
+            async for event in server_sent_events(changes):
+                yield event
+        finally:
+            if subscription is not None:
+                change_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/{item_id}")
 async def read_item(item_id: ObjectIdField, request: Request) -> JSONResponse:
-    """Called to get an Item using its id"""
+    """Called to get an Item using its id
+
+    Send the ETag from a previous response in If-None-Match to get 304 Not
+    Modified, without a body, if the item has not changed since
+    """
+
+    cache = request.app.state.item_cache
+    item = None
 
-    item = await request.app.state.collection.find_one({"_id": item_id})
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # A cached item answers straight away, otherwise only its revision is read
+        item = await cache.get(item_id)
+        if item is not None:
+            etag = item_etag(item)
+        else:
+            revision = await request.app.state.item_repository.get_revision(item_id)
+            etag = None if revision is None else revision_etag(revision)
+        if etag is not None and none_match(if_none_match, etag):
+            return _not_modified(etag)
+
+    if item is None:
+        item = await cache.get_or_load(
+            item_id, lambda: request.app.state.item_repository.get(item_id)
+        )
 
     if item is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content=f"Item with id: {item_id} does not exist",
         )
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=status.HTTP_200_OK,
-        content=jsonable_encoder(ItemResponse(**item)),
+        content=item_response(item),
+        headers={"ETag": item_etag(item)},
     )
 
 
-@router.get("/")
+@router.get("/", response_model=list[PartialItemResponse])
 async def read_all_items(
-    request: Request, limit: int = 5, skip: int = 0, response_model=list[ItemResponse]
+    request: Request,
+    limit: int = 5,
+    skip: int = 0,
+    after: str | None = None,
+    order_by: str | None = None,
+    stream: bool = False,
+    batch_size: int = Query(100, ge=0),
+    count: bool = False,
+    query: ItemQuery = Depends(item_query),
+    response_model=list[ItemResponse],
 ) -> JSONResponse:
-    # pylint: disable=unused-argument
-    """Called to return a list of items, this method is pagable and you can limit the results too"""
-    return_list = []
-    cursor = request.app.state.collection.find({}).skip(skip).limit(limit)
-    async for item in cursor:
-        return_list.append(item)
-    # return_list = await cursor.to_list(length=limit)
-
-    return jsonable_encoder(
-        return_list,
-        custom_encoder={ObjectId: lambda oid: str(oid)},
+    # pylint: disable=unused-argument, too-many-arguments, too-many-locals
+    """Called to return a list of items, this method is pagable and you can limit the results too
+
+    The items can be filtered on price, tax (equal to, or a _gte/_lte range) and
+    name_prefix, sorted by a comma separated list of fields (e.g. sort=price,-tax)
+    and projected to a comma separated list of fields (e.g. fields=name,price).
+
+    Passing order_by (or the after token from a previous page) switches to keyset
+    paging, the token for the next page is returned in the X-Next-Cursor header.
+
+    Asking for application/x-ndjson, or passing stream=true, streams the items as
+    they are read from the cursor, batch_size items at a time. Streamed responses
+    do not include the X-Next-Cursor or ETag headers.
+
+    Send the ETag from a previous response in If-None-Match to get 304 Not
+    Modified, without a body, if the listing has not changed since
+
+    Passing count=true adds the number of matching items (on every page) in the
+    X-Total-Count header, X-Total-Count-Exact is false when it was estimated
+    """
+    ndjson = NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+    streaming = stream or ndjson
+    keyset = after is not None or order_by is not None
+
+    filters = query.filter()
+
+    headers = {}
+    if count:
+        total, exact = await _count_items(request, filters)
+        headers["X-Total-Count"] = str(total)
+        headers["X-Total-Count-Exact"] = "true" if exact else "false"
+
+    if not keyset:
+        projection, sort = query.projection(), query.sort
+    else:
+        try:
+            if skip or limit < 1:
+                raise InvalidCursor("Keyset paging needs a positive limit and no skip")
+            if query.sort:
+                raise InvalidCursor("sort can not be combined with keyset paging")
+            page = decode_cursor(after) if after else parse_order_by(order_by)
+        except InvalidCursor as exc:
+            return JSONResponse(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content=str(exc)
+            )
+
+        if page.query():
+            filters = {"$and": [filters, page.query()]} if filters else page.query()
+
+        # Fetch one extra item to find out whether there is a next page, the
+        # ordering field is needed to build the cursor so is always projected
+        projection, sort = query.projection(page.field), page.sort()
+        if not streaming:
+            limit += 1
+
+    def find():
+        return request.app.state.item_repository.find(
+            filters,
+            projection,
+            sort,
+            skip=skip,
+            limit=limit,
+            batch_size=batch_size if streaming else 0,
+        )
+
+    if streaming:
+        if ndjson:
+            return StreamingResponse(
+                ndjson_lines(find()), media_type=NDJSON_MEDIA_TYPE, headers=headers
+            )
+        return StreamingResponse(
+            json_array_chunks(find()), media_type="application/json", headers=headers
+        )
+
+    async def load():
+        return [item async for item in find()]
+
+    # Identical listings requested at the same time share a single query
+    return_list = await request.app.state.item_cache.coalesce(
+        tuple(sorted(request.query_params.multi_items())), load
     )
 
+    if keyset and len(return_list) == limit:
+        return_list = return_list[:-1]
+        headers["X-Next-Cursor"] = page.advance(return_list[-1]).encode()
+
+    response = FastJSONResponse(
+        status_code=status.HTTP_200_OK, content=return_list, headers=headers
+    )
+    etag = body_etag(response.body)
+    if none_match(request.headers.get("if-none-match"), etag):
+        return _not_modified(etag, headers)
+    response.headers["ETag"] = etag
+    return response
+
 
 @router.post("/")
 async def create_item(
     request: Request, item: CreateItem = Body(...), return_item: bool = False
 ) -> JSONResponse:
-    """This method creates a new item"""
+    """This method creates a new item
+
+    With write batching on, the item is queued and inserted along with others
+    in a single insert_many, the response is sent once it has been written
+    """
 
-    result = await request.app.state.collection.insert_one(jsonable_encoder(item))
+    document = jsonable_encoder(item)
+    if request.app.state.write_batcher is not None:
+        inserted_id = await request.app.state.write_batcher.insert(document)
+    else:
+        inserted_id = await request.app.state.item_repository.insert(document)
+    await request.app.state.item_cache.put(inserted_id, document)
 
     if return_item is False:
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
-            content=jsonable_encoder({"_id": str(result.inserted_id)}),
+            content=jsonable_encoder({"_id": str(inserted_id)}),
         )
 
-    # Caller has requested that the inseted item be returned in the JSON response
-    created_item = await request.app.state.collection.find_one(
-        {"_id": result.inserted_id}
-    )
-    return JSONResponse(
+    # Caller has requested that the inseted item be returned in the JSON response,
+    # the insert has filled in the _id so there is no need to read it back
+    return FastJSONResponse(
         status_code=status.HTTP_201_CREATED,
-        content=jsonable_encoder(ItemResponse(**created_item)),
+        content=item_response(document),
+        headers={"ETag": item_etag(document)},
     )
 
 
 @router.delete("/{item_id}")
 async def delete_item(request: Request, item_id: ObjectIdField) -> JSONResponse:
-    """This method deletes an item"""
+    """This method deletes an item, only if it matches If-Match when that is sent"""
 
-    result = await request.app.state.collection.delete_one({"_id": item_id})
+    revisions = match_revisions(request.headers.get("if-match"))
+    deleted = await request.app.state.item_repository.delete(item_id, revisions)
+    await request.app.state.item_cache.invalidate(item_id)
 
-    if result.acknowledged & result.deleted_count == 1:
+    if deleted:
         return JSONResponse(
             status_code=status.HTTP_200_OK, content=f"Item with id: {item_id} deleted"
         )
+    if revisions is not None:
+        return await _failed_precondition(request, item_id)
 
     return JSONResponse(
         status_code=status.HTTP_404_NOT_FOUND,
@@ -94,24 +587,78 @@ async def delete_item(request: Request, item_id: ObjectIdField) -> JSONResponse:
 
 @router.put("/{item_id}")
 async def put_item(
-    request: Request, item_id: ObjectIdField, item: UpdateItem = Body(...)
+    request: Request,
+    item_id: ObjectIdField,
+    item: UpdateItem = Body(...),
+    return_item: bool = False,
 ) -> JSONResponse:
-    """This method updates an existing item"""
+    """This method updates an existing item, only if it matches If-Match when that is sent"""
+
+    if return_item:
+        # Caller has requested that the updated item be returned in the JSON response
+        return await patch_item(request, item_id, item)
 
     items_to_update = {k: v for k, v in item.model_dump().items() if v is not None}
 
     if len(items_to_update) >= 1:
-        update_result = await request.app.state.collection.update_one(
-            {"_id": item_id}, {"$set": items_to_update}
+        revisions = match_revisions(request.headers.get("if-match"))
+        revision = await request.app.state.item_repository.update(
+            item_id, items_to_update, revisions
         )
+        await request.app.state.item_cache.invalidate(item_id)
 
-        if update_result.matched_count == 1:
+        if revision is not None:
+            # The new ETag, so the next conditional write needs no GET first
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
                 content=f"Item with id: {item_id} updated",
+                headers={"ETag": revision_etag(revision)},
             )
+        if revisions is not None:
+            return await _failed_precondition(request, item_id)
 
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content=f"Item with id: {item_id} does not exist",
         )
+
+
+@router.patch("/{item_id}")
+async def patch_item(
+    request: Request, item_id: ObjectIdField, item: UpdateItem = Body(...)
+) -> JSONResponse:
+    """This method updates an existing item and returns it, in a single round trip
+
+    When If-Match is sent the item is only updated if it matches
+    """
+
+    items_to_update = {k: v for k, v in item.model_dump().items() if v is not None}
+    revisions = match_revisions(request.headers.get("if-match"))
+
+    if len(items_to_update) >= 1:
+        updated_item = await request.app.state.item_repository.update_and_get(
+            item_id, items_to_update, revisions
+        )
+        if updated_item is not None:
+            await request.app.state.item_cache.put(item_id, updated_item)
+    else:
+        # Nothing to change, so just return the item as it is
+        updated_item = await request.app.state.item_cache.get_or_load(
+            item_id, lambda: request.app.state.item_repository.get(item_id)
+        )
+        if updated_item is not None and revisions is not None:
+            if item_etag(updated_item) not in map(revision_etag, revisions):
+                updated_item = None
+
+    if updated_item is None:
+        if revisions is not None:
+            return await _failed_precondition(request, item_id)
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=f"Item with id: {item_id} does not exist",
+        )
+    return FastJSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=item_response(updated_item),
+        headers={"ETag": item_etag(updated_item)},
+    )
@@ -0,0 +1,17 @@
+"""Setup the router for the /metrics route, scraped by Prometheus"""
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter(
+    tags=["Metrics api"],
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics(request: Request) -> PlainTextResponse:
+    """Called to get the request and MongoDb command timings, in Prometheus format"""
+
+    return PlainTextResponse(
+        request.app.state.metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,62 @@
+"""Setup the router for the /stats route, reporting on the app internals"""
+from fastapi import APIRouter, status, Request
+from fastapi.responses import JSONResponse
+from app.internal.mongo import pool_options
+
+router = APIRouter(
+    prefix="/stats",
+    tags=["Stats api"],
+)
+
+
+@router.get("/pool")
+async def read_pool_stats(request: Request) -> JSONResponse:
+    """Called to get the MongoDb connection pool counters, along with its settings"""
+
+    if request.app.state.backend != "mongo":
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content="MongoDb is not in use, there is no connection pool",
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            **request.app.state.pool_monitor.stats(),
+            "options": pool_options(),
+        },
+    )
+
+
+@router.get("/writes")
+async def read_write_batch_stats(request: Request) -> JSONResponse:
+    """Called to get the write batching queue depth, batch sizes and flush times"""
+
+    if request.app.state.write_batcher is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content="Write batching is not turned on",
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=request.app.state.write_batcher.stats(),
+    )
+
+
+@router.get("/admission")
+async def read_admission_stats(request: Request) -> JSONResponse:
+    """Called to get the requests in flight and queued, and the rejection counters"""
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=request.app.state.admission.stats(),
+    )
+
+
+@router.get("/changes")
+async def read_change_stats(request: Request) -> JSONResponse:
+    """Called to get the change feed counters, and whether it is running"""
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=request.app.state.change_feed.stats(),
+    )
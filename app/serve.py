@@ -0,0 +1,66 @@
+"""Production entry point, serving the app from several uvicorn worker processes
+
+Usage: python -m app.serve [--host 0.0.0.0] [--port 8000] [--workers N]
+
+  WEB_CONCURRENCY            worker processes (default the number of CPUs)
+  HOST, PORT                 address to listen on (default 0.0.0.0:8000)
+  GRACEFUL_SHUTDOWN_SECONDS  how long in-flight requests get to finish (default 30)
+
+uvicorn starts the workers with multiprocessing's spawn, so each worker imports
+app.main itself and its startup event creates the Motor client; a client is
+never carried across a fork. Each worker has a pool of its own, so MongoDb sees
+up to workers * MONGO_MAX_POOL_SIZE connections. uvloop and httptools are used
+when they are installed.
+
+On SIGTERM (or Ctrl+C) each worker stops accepting connections, lets the
+requests in flight finish, for up to GRACEFUL_SHUTDOWN_SECONDS, then runs the
+shutdown event: app_shutdown writes any batched items and closes the client.
+"""
+import argparse
+import os
+import sys
+import uvicorn
+
+
+def cpu_count() -> int:
+    """Return the CPUs this process may run on, which a container can limit"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def main() -> None:
+    """Parse the command line and serve the app until stopped"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "0")) or cpu_count(),
+    )
+    parser.add_argument(
+        "--graceful-shutdown",
+        type=float,
+        default=float(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30")),
+    )
+    args = parser.parse_args()
+
+    # The in-memory store lives in the worker, so each would have its own items
+    if args.workers > 1 and os.getenv("ITEM_BACKEND", "mongo") == "memory":
+        sys.exit("The memory item backend can only be served by a single worker")
+
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers")
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=args.graceful_shutdown,
+    )
+
+
+if __name__ == "__main__":
+    main()
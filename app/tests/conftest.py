@@ -1,12 +1,53 @@
 """This module contains common Pytest Fixtures"""
+from collections import Counter
 import pytest_asyncio
 from app.main import app_factory, app_startup, app_shutdown
 
 
+@pytest_asyncio.fixture(params=["mongo", "memory"])
+async def app(request):
+    """Helper method to create the FastAPI app object, for each storage backend"""
+    my_app = app_factory(backend=request.param)
+    await app_startup(my_app)
+    yield my_app
+    await app_shutdown(my_app)
+
+
+@pytest_asyncio.fixture
+async def mongo_app():
+    """Helper method to create the FastAPI app object, storing items in MongoDb"""
+    my_app = app_factory(backend="mongo")
+    await app_startup(my_app)
+    yield my_app
+    await app_shutdown(my_app)
+
+
 @pytest_asyncio.fixture
-async def app():
-    """Helper method to create the FastAPI app object"""
-    my_app = app_factory()
+async def memory_app():
+    """Helper method to create the FastAPI app object, storing items in memory"""
+    my_app = app_factory(backend="memory")
     await app_startup(my_app)
     yield my_app
     await app_shutdown(my_app)
+
+
+class CountingRepository:
+    # pylint: disable=too-few-public-methods
+    """Wraps an item repository, counting how often each of its methods is used"""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        self.calls[name] += 1
+        return getattr(self.repository, name)
+
+
+@pytest_asyncio.fixture
+async def counting_repository(app):  # pylint: disable=redefined-outer-name
+    """Swap the app repository for one that counts the calls made to it"""
+    repository = CountingRepository(app.state.item_repository)
+    app.state.item_repository = repository
+    yield repository
+    app.state.item_repository = repository.repository
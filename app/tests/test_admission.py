@@ -0,0 +1,165 @@
+"""This module contains PyTests for the admission control"""
+import asyncio
+import pytest
+from httpx import AsyncClient
+from app.internal.admission import (
+    Admission,
+    AdmissionMiddleware,
+    Gate,
+    MemoryRateLimitStore,
+    Overloaded,
+    parse_route_limits,
+)
+from app.internal.metrics import Metrics
+
+
+def http_scope(method: str = "GET", path: str = "/items/") -> dict:
+    """Return the scope of an http request from a client at 10.0.0.1"""
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [],
+        "client": ("10.0.0.1", 1234),
+    }
+
+
+@pytest.mark.asyncio
+async def test_gate_queues_then_rejects():
+    """Requests over the limit wait in the queue, then are rejected once it is full"""
+
+    gate = Gate("test", limit=1, queue_size=1, timeout=1.0)
+    assert await gate.acquire() == 0.0
+
+    waiting = asyncio.ensure_future(gate.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded):
+        await gate.acquire()
+    assert gate.stats()["queued"] == 1
+
+    # Releasing hands the slot to the request waiting
+    gate.release()
+    assert await waiting > 0
+    assert gate.stats()["in_flight"] == 1
+    gate.release()
+    assert gate.stats() == {
+        "limit": 1,
+        "in_flight": 0,
+        "queued": 0,
+        "admitted": 2,
+        "queue_full": 1,
+        "queue_timeouts": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_gate_queue_timeout():
+    """A request that waits too long is rejected, and a cancelled one leaves"""
+
+    gate = Gate("test", limit=1, queue_size=2, timeout=0.01)
+    await gate.acquire()
+    with pytest.raises(Overloaded):
+        await gate.acquire()
+    assert gate.stats()["queue_timeouts"] == 1
+
+    gate.timeout = 10
+    waiting = asyncio.ensure_future(gate.acquire())
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert gate.stats()["queued"] == 0
+
+    gate.release()
+    assert gate.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    """A client gets burst requests at once, then one every 1 / rate seconds"""
+
+    store = MemoryRateLimitStore()
+    assert await store.take("a", rate=2, burst=2) == 0
+    assert await store.take("a", rate=2, burst=2) == 0
+    assert 0.4 < await store.take("a", rate=2, burst=2) <= 0.5
+    # Each client has a bucket of its own
+    assert await store.take("b", rate=2, burst=2) == 0
+
+
+def test_route_gates(app):
+    """Routes given a limit have a gate of their own, after the global one"""
+
+    assert parse_route_limits("post /items/bulk=4, GET /items/{item_id}=8") == {
+        "POST /items/bulk": 4,
+        "GET /items/{item_id}": 8,
+    }
+
+    admission = Admission(max_in_flight=100, route_limits={"GET /items/{item_id}": 2})
+    admission.routes = app.routes
+    gates = admission.gates(http_scope("GET", "/items/1111fa8fd3e0a099b5d3a813"))
+    assert [gate.name for gate in gates] == ["global", "GET /items/{item_id}"]
+    assert [gate.name for gate in admission.gates(http_scope())] == ["global"]
+    # Routes declared ahead of /{item_id}, that it would also match, are not capped
+    for path in ("/items/count", "/items/stats"):
+        assert [gate.name for gate in admission.gates(http_scope("GET", path))] == [
+            "global"
+        ]
+    # Off by default
+    assert not Admission().gates(http_scope())
+
+
+@pytest.mark.asyncio
+async def test_overloaded_requests_get_503():
+    """Once the slots and the queue are taken, requests are turned away at once"""
+
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        # pylint: disable=unused-argument
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    metrics = Metrics()
+    admission = Admission(max_in_flight=1, queue_size=0)
+    middleware = AdmissionMiddleware(slow_app, admission, metrics)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    first = asyncio.ensure_future(middleware(http_scope(), None, send))
+    await asyncio.sleep(0)
+    await middleware(http_scope(), None, send)
+    assert sent[0]["status"] == 503
+    assert (b"retry-after", b"1") in sent[0]["headers"]
+
+    release.set()
+    await first
+    assert sent[2]["status"] == 200
+    assert metrics.rejected.count(("overloaded",)) == 1
+    assert admission.gate.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_get_429(app):
+    """A client over its rate gets 429, the metrics are not rate limited"""
+
+    app.state.admission.rate = 1
+    app.state.admission.burst = 2
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        assert (await client.get("/items/count")).status_code == 200
+        assert (await client.get("/items/count")).status_code == 200
+        response = await client.get("/items/count")
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "1"
+
+        response = await client.get("/metrics")
+        assert response.status_code == 200
+        assert 'http_requests_rejected_total{reason="rate_limited"} 1' in response.text
+
+        response = await client.get("/stats/admission")
+        assert response.json()["rate_limit"]["rate_limited"] == 1
+        # The global gate is off by default
+        assert response.json()["global"] is None
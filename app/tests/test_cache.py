@@ -0,0 +1,71 @@
+"""This module contains PyTests for the item cache"""
+import asyncio
+import pytest
+from app.internal.cache import ItemCache, LRUCache
+
+
+@pytest.mark.asyncio
+async def test_lru_evicts_least_recently_used():
+    """Once full, the least recently used entry is evicted"""
+
+    cache = LRUCache(maxsize=2, ttl=60)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    assert await cache.get("a") == 1
+    await cache.set("c", 3)
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1
+    assert await cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_expires_entries():
+    """Entries are dropped once their ttl has passed"""
+
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    await cache.set("a", 1)
+    await asyncio.sleep(0.02)
+
+    assert await cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_read_racing_a_write_is_not_cached():
+    """A value loaded while the item was being changed is not cached"""
+
+    cache = ItemCache(LRUCache())
+
+    async def stale_loader():
+        await cache.invalidate("a")
+        return {"price": 1}
+
+    assert await cache.get_or_load("a", stale_loader) == {"price": 1}
+    assert await cache.backend.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_reads_after_a_write_do_not_join_an_earlier_load():
+    """A read starting after a write does not get the result of an older load"""
+
+    cache = ItemCache(LRUCache(maxsize=10, ttl=60))
+    stored = {"value": "old"}
+    loading = asyncio.Event()
+
+    async def loader():
+        value = stored["value"]
+        loading.set()
+        await asyncio.sleep(0.02)
+        return {"value": value}
+
+    before = asyncio.ensure_future(cache.get_or_load("a", loader))
+    await loading.wait()
+    stored["value"] = "new"
+    await cache.invalidate("a")
+    after = asyncio.ensure_future(cache.get_or_load("a", loader))
+
+    assert await before == {"value": "old"}
+    assert await after == {"value": "new"}
@@ -0,0 +1,308 @@
+"""This module contains PyTests for the item change feed and /items/events"""
+import asyncio
+import pytest
+from bson import ObjectId
+from httpx import AsyncClient
+from pymongo.errors import OperationFailure
+from app.internal.cache import ItemCache, LRUCache
+from app.internal.change_feed import ChangeFeed, SubscriptionOverflow
+from app.main import app_factory, app_startup, app_shutdown
+from app.repositories.memory_item_repository import MemoryItemRepository
+
+ITEM = {"name": "Fred", "description": "This is Fred item", "price": 5, "tax": 1.6}
+
+
+def change(number: int, operation: str = "update", item_id=None, **fields) -> dict:
+    """Build a change event, with a resume token made from its number"""
+    return {
+        "_id": {"_data": f"{number:016x}"},
+        "operationType": operation,
+        "documentKey": {"_id": item_id or ObjectId()},
+        **fields,
+    }
+
+
+async def wait_for(condition, timeout: float = 1.0) -> None:
+    """Wait for the background tasks to make condition true"""
+
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.001)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def read_events(app, path: str, count: int, headers=(), during=None) -> str:
+    """Call an SSE endpoint, returning the text of its first count events
+
+    during is awaited once the client has subscribed, to make some changes
+    """
+    path, _, query = path.partition("?")
+    body = b""
+    enough = asyncio.Event()
+    response = {}
+
+    async def receive():
+        await enough.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal body
+        if message["type"] == "http.response.start":
+            response.update(message)
+        body += message.get("body", b"")
+        if body.count(b"\n\n") >= count:
+            enough.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+        "server": ("test", 80),
+        "client": ("test", 1234),
+    }
+    task = asyncio.ensure_future(app(scope, receive, send))
+    if during is not None:
+        await wait_for(
+            lambda: app.state.change_feed.stats()["subscribers"] or task.done()
+        )
+        await during()
+
+    async def finish():
+        await enough.wait()
+        await task
+
+    await asyncio.wait_for(finish(), 2)
+
+    assert response["status"] == 200
+    assert (b"content-type", b"text/event-stream; charset=utf-8") in response["headers"]
+    return body.decode()
+
+
+@pytest.mark.asyncio
+async def test_feed_fans_out_to_listeners_and_subscribers():
+    """Each change reaches the listeners, then every subscriber"""
+
+    feed = ChangeFeed(history=10, buffer=10)
+    heard = []
+
+    async def listener(event):
+        heard.append(event)
+
+    feed.add_listener(listener)
+    first, second = feed.subscribe(), feed.subscribe()
+    changes = [change(number) for number in range(1, 4)]
+    for event in changes:
+        await feed.publish(event)
+
+    assert heard == changes
+    assert [await first.get() for _ in range(3)] == changes
+    assert [await second.get() for _ in range(3)] == changes
+    assert feed.stats()["subscribers"] == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_is_dropped():
+    """A subscriber whose buffer fills up is dropped, rather than buffering more"""
+
+    feed = ChangeFeed(history=10, buffer=2)
+    slow = feed.subscribe()
+    for number in range(1, 5):
+        await feed.publish(change(number))
+
+    assert feed.stats() == {
+        "running": False,
+        "changes": 4,
+        "subscribers": 0,
+        "overflows": 1,
+    }
+    # The changes that were queued are still read, then the overflow is raised
+    assert [(await slow.get())["_id"]["_data"][-1] for _ in range(2)] == ["1", "2"]
+    with pytest.raises(SubscriptionOverflow):
+        await slow.get()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_resumes_from_the_history():
+    """Subscribing with a resume token replays the changes made since"""
+
+    feed = ChangeFeed(history=3, buffer=1)
+    changes = [change(number) for number in range(1, 6)]
+    for event in changes:
+        await feed.publish(event)
+
+    subscription = feed.subscribe(resume_after=f"{3:016x}")
+    assert [await subscription.get() for _ in range(2)] == changes[3:]
+
+    # The token has dropped out of the history
+    assert feed.subscribe(resume_after=f"{1:016x}") is None
+
+
+@pytest.mark.asyncio
+async def test_memory_repository_watch():
+    """The in-memory repository records its changes as MongoDb change events"""
+
+    repository = MemoryItemRepository()
+    changes = repository.watch()
+
+    async def read_three():
+        return [await anext(changes) for _ in range(3)]
+
+    # The watch starts from the first read, as a MongoDb change stream does
+    reading = asyncio.ensure_future(read_three())
+    await asyncio.sleep(0)
+    item_id = await repository.insert(dict(ITEM))
+    await repository.update(item_id, {"price": 6})
+    await repository.delete(item_id)
+
+    events = await asyncio.wait_for(reading, 1)
+    assert [event["operationType"] for event in events] == [
+        "insert",
+        "update",
+        "delete",
+    ]
+    assert events[0]["fullDocument"]["name"] == "Fred"
+    assert events[1]["updateDescription"]["updatedFields"] == {"price": 6, "_rev": 2}
+    assert all(event["documentKey"] == {"_id": item_id} for event in events)
+
+    # Resuming replays from just after the token
+    resumed = repository.watch(resume_after=events[0]["_id"])
+    assert await anext(resumed) == events[1]
+
+
+@pytest.mark.asyncio
+async def test_memory_repository_watch_history_lost(monkeypatch):
+    """Resuming from a change no longer kept fails, as it does on MongoDb"""
+
+    monkeypatch.setattr("app.repositories.memory_item_repository.CHANGE_HISTORY", 2)
+    repository = MemoryItemRepository()
+    for _ in range(3):
+        await repository.insert(dict(ITEM))
+
+    with pytest.raises(OperationFailure):
+        await anext(repository.watch(resume_after={"_data": f"{0:016x}"}))
+
+
+@pytest.mark.asyncio
+async def test_memory_repository_watch_future_token():
+    """Resuming from a change that has not happened yet fails, rather than spinning"""
+
+    repository = MemoryItemRepository()
+    await repository.insert(dict(ITEM))
+
+    for token in (f"{255:016x}", "notatoken"):
+        with pytest.raises(OperationFailure):
+            await asyncio.wait_for(
+                anext(repository.watch(resume_after={"_data": token})), 1
+            )
+        with pytest.raises(OperationFailure):
+            await repository.check_resume_token({"_data": token})
+    await repository.check_resume_token({"_data": f"{1:016x}"})
+
+
+@pytest.mark.asyncio
+async def test_cache_applies_changes():
+    """Changes newer than the cached item drop it, its own writes do not"""
+
+    cache = ItemCache(LRUCache(maxsize=10, ttl=60))
+    item_id = ObjectId()
+    await cache.put(item_id, {**ITEM, "_id": item_id, "_rev": 2})
+
+    updated = {"updatedFields": {"price": 6, "_rev": 2}, "removedFields": []}
+    await cache.apply_change(change(1, "update", item_id, updateDescription=updated))
+    assert await cache.get(item_id) is not None
+
+    updated["updatedFields"]["_rev"] = 3
+    await cache.apply_change(change(2, "update", item_id, updateDescription=updated))
+    assert await cache.get(item_id) is None
+
+    await cache.put(item_id, {**ITEM, "_id": item_id, "_rev": 3})
+    await cache.apply_change(change(3, "delete", item_id))
+    assert await cache.get(item_id) is None
+
+
+@pytest.mark.asyncio
+async def test_changes_from_another_instance_invalidate_the_cache(memory_app):
+    """An item cached by one instance is dropped when another instance writes it"""
+
+    other_app = app_factory(backend="memory")
+    await app_startup(other_app)
+    other_app.state.item_repository = memory_app.state.item_repository
+
+    async with AsyncClient(app=memory_app, base_url="http://test") as client:
+        item_id = (await client.post("/items/", json=ITEM)).json()["_id"]
+        assert (await client.get(f"/items/{item_id}")).json()["price"] == 5
+
+        async with AsyncClient(app=other_app, base_url="http://test") as other:
+            await other.put(f"/items/{item_id}", json={"price": 7})
+
+        await wait_for(lambda: memory_app.state.change_feed.stats()["changes"] == 2)
+        assert (await client.get(f"/items/{item_id}")).json()["price"] == 7
+
+    await app_shutdown(other_app)
+
+
+@pytest.mark.asyncio
+async def test_item_events(memory_app):
+    """Tests the changes are sent as Server-Sent Events, and can be resumed"""
+
+    ids = []
+
+    async def make_changes():
+        async with AsyncClient(app=memory_app, base_url="http://test") as client:
+            ids.append((await client.post("/items/", json=ITEM)).json()["_id"])
+            await client.put(f"/items/{ids[0]}", json={"price": 6})
+            await client.delete(f"/items/{ids[0]}")
+
+    text = await read_events(memory_app, "/items/events", 3, during=make_changes)
+    events = [event.split("\n") for event in text.strip().split("\n\n")]
+
+    assert [event[1] for event in events] == [
+        "event: insert",
+        "event: update",
+        "event: delete",
+    ]
+    assert events[0][2] == (
+        f'data: {{"_id":"{ids[0]}","item":{{"name":"Fred",'
+        f'"description":"This is Fred item","price":5,"tax":1.6,"_id":"{ids[0]}"}}}}'
+    )
+    assert events[1][2] == (
+        f'data: {{"_id":"{ids[0]}","updated":{{"price":6}},"removed":[]}}'
+    )
+    assert events[2][2] == f'data: {{"_id":"{ids[0]}"}}'
+
+    # Reconnecting with the first event's id replays the two after it
+    first_id = events[0][0].removeprefix("id: ")
+    text = await read_events(
+        memory_app, "/items/events", 2, headers=[("last-event-id", first_id)]
+    )
+    assert text == "\n\n".join("\n".join(event) for event in events[1:]) + "\n\n"
+
+    # Too old for the feed's history, so read from the repository's own history
+    memory_app.state.change_feed._history.clear()  # pylint: disable=protected-access
+    text = await read_events(memory_app, f"/items/events?after={first_id}", 2)
+    assert text.startswith("\n".join(events[1]))
+
+    # A token from the future, or a malformed one, can not be resumed from
+    async with AsyncClient(app=memory_app, base_url="http://test") as client:
+        for token in ("00000000000000ff", "notatoken"):
+            response = await client.get(f"/items/events?after={token}")
+            assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_item_events_unavailable(mongo_app):
+    """Tests /items/events is unavailable without a change stream (no replica set)"""
+
+    await wait_for(lambda: not mongo_app.state.change_feed.running)
+    async with AsyncClient(app=mongo_app, base_url="http://test") as client:
+        response = await client.get("/items/events")
+        assert response.status_code == 503
+        assert response.json() == "Item changes are not being watched"
@@ -0,0 +1,127 @@
+"""This module contains PyTests for the response compression"""
+import asyncio
+import base64
+import gzip
+import json
+from httpx import AsyncClient
+import pytest
+from app.internal.compression import negotiate
+from app.main import LambdaHandler, LambdaStartup, app_factory, app_shutdown
+from app.tests.test_items import delete_all_items
+from app.tests.test_lambda import api_gateway_event
+
+
+def test_negotiate():
+    """The client's q values pick the encoding, the server's order breaks ties"""
+
+    encodings = ["br", "gzip"]
+    assert negotiate(None, encodings) is None
+    assert negotiate("gzip, deflate", encodings) == "gzip"
+    assert negotiate("gzip, br", encodings) == "br"
+    assert negotiate("gzip;q=1.0, br;q=0.5", encodings) == "gzip"
+    assert negotiate("br;q=0, gzip", encodings) == "gzip"
+    assert negotiate("*", encodings) == "br"
+    assert negotiate("identity", encodings) is None
+    assert negotiate("gzip;q=0", encodings) is None
+
+
+async def create_many_items(client: AsyncClient, count: int = 50) -> None:
+    """Helper method to replace all the items with enough to be compressed"""
+    await delete_all_items(client=client)
+    items_to_create = [
+        {"name": f"Fred {i}", "description": "Fred item", "price": i % 11, "tax": 1.6}
+        for i in range(count)
+    ]
+    await client.post("/items/bulk", json=items_to_create)
+
+
+@pytest.mark.asyncio
+async def test_large_lists_are_compressed(app):
+    """A list over the minimum size is gzipped, and decompresses to the same items"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_many_items(async_client)
+
+        plain = await async_client.get(
+            "/items/?limit=50", headers={"Accept-Encoding": "identity"}
+        )
+        assert "content-encoding" not in plain.headers
+        assert plain.headers["vary"] == "Accept-Encoding"
+
+        response = await async_client.get(
+            "/items/?limit=50", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"] == plain.headers["etag"]
+        assert int(response.headers["content-length"]) < len(plain.content)
+        assert response.json() == plain.json()
+
+
+@pytest.mark.asyncio
+async def test_small_bodies_are_not_compressed(app):
+    """A single item is under the minimum size, so it goes out as it is"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_many_items(async_client, 1)
+        item_id = (await async_client.get("/items/")).json()[0]["_id"]
+
+        response = await async_client.get(
+            f"/items/{item_id}", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert response.json()["name"] == "Fred 0"
+
+
+@pytest.mark.asyncio
+async def test_streamed_lists_are_compressed(app):
+    """A streamed list is compressed whatever its size, chunk by chunk"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_many_items(async_client, 3)
+
+        response = await async_client.get(
+            "/items/?stream=true", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert [item["name"] for item in response.json()] == [
+            "Fred 0",
+            "Fred 1",
+            "Fred 2",
+        ]
+
+
+def test_lambda_compressed_body_is_base64_encoded():
+    """Mangum returns the compressed bytes base64 encoded, for API Gateway"""
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    my_app = app_factory("memory")
+    handler = LambdaHandler(LambdaStartup(my_app), lifespan="off")
+
+    event = api_gateway_event("/items/")
+    event["httpMethod"] = "POST"
+    event["path"] = "/items/bulk"
+    event["body"] = json.dumps(
+        [
+            {"name": f"Fred {i}", "description": None, "price": i % 11, "tax": 1.6}
+            for i in range(50)
+        ]
+    )
+    event["headers"]["Content-Type"] = "application/json"
+    assert handler(event, {})["statusCode"] == 201
+
+    event = api_gateway_event("/items/")
+    event["queryStringParameters"] = {"limit": "50"}
+    event["headers"]["Accept-Encoding"] = "gzip"
+    response = handler(event, {})
+    assert response["statusCode"] == 200
+    assert response["isBase64Encoded"] is True
+    items = json.loads(gzip.decompress(base64.b64decode(response["body"])))
+    assert len(items) == 50
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(app_shutdown(my_app))
+    loop.close()
@@ -0,0 +1,78 @@
+"""This module contains PyTests for the item counts"""
+from httpx import AsyncClient
+import pytest
+from app.tests.test_items import create_priced_items
+
+
+@pytest.mark.asyncio
+async def test_count_items(app):
+    """Tests unfiltered counts are estimated, and filtered counts exact"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get("/items/count")
+        assert response.status_code == 200
+        # Only MongoDb estimates, the in-memory store always knows its size
+        assert response.json() == {"count": 10, "exact": app.state.backend != "mongo"}
+
+        response = await async_client.get("/items/count?price_gte=2&price_lte=5")
+        assert response.json() == {"count": 4, "exact": True}
+
+        response = await async_client.get("/items/count?name_prefix=Fred")
+        assert response.json() == {"count": 5, "exact": True}
+
+        response = await async_client.get("/items/count?price_gte=x")
+        assert response.status_code == 422
+
+        # Non finite floats are rejected, rather than failing the cache key
+        for query in ("tax=nan", "tax_gte=inf", "tax_lte=-inf"):
+            response = await async_client.get(f"/items/count?{query}")
+            assert response.status_code == 422
+        response = await async_client.get("/items/?tax=inf&count=true")
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_counts_are_cached(app, counting_repository):
+    """Tests a count is reused for a few seconds, rather than counted again"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        for _ in range(3):
+            response = await async_client.get("/items/count?price_gte=5")
+            assert response.json()["count"] == 5
+        assert counting_repository.calls["count"] == 1
+
+        # Counts with other filters are cached separately
+        response = await async_client.get("/items/count?price_gte=8")
+        assert response.json()["count"] == 2
+        assert counting_repository.calls["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_get_all_with_total_count(app):
+    """Tests count=true adds the number of matching items to every page"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get("/items/?limit=3")
+        assert "x-total-count" not in response.headers
+
+        response = await async_client.get(
+            "/items/?price_gte=3&order_by=price&limit=3&count=true"
+        )
+        assert response.headers["x-total-count"] == "7"
+        assert response.headers["x-total-count-exact"] == "true"
+
+        cursor = response.headers["x-next-cursor"]
+        response = await async_client.get(
+            f"/items/?price_gte=3&after={cursor}&limit=3&count=true"
+        )
+        assert len(response.json()) == 3
+        assert response.headers["x-total-count"] == "7"
+
+        response = await async_client.get("/items/?stream=true&count=true")
+        assert response.headers["x-total-count"] == "10"
@@ -0,0 +1,174 @@
+"""This module contains PyTests for the conditional requests (ETags) on the items"""
+from httpx import AsyncClient
+import pytest
+from app.tests.test_items import create_item, create_priced_items, delete_all_items
+from app.internal.etags import match_revisions, none_match
+
+
+def test_none_match():
+    """Tests If-None-Match uses the weak comparison, and * matches anything"""
+    assert none_match('"1"', '"1"')
+    assert none_match('"0", W/"1"', '"1"')
+    assert none_match("*", '"1"')
+    assert not none_match('"2"', '"1"')
+    assert not none_match(None, '"1"')
+
+
+def test_match_revisions():
+    """Tests If-Match is turned into the revisions it allows"""
+    assert match_revisions(None) is None
+    assert match_revisions("*") is None
+    assert match_revisions('"1", "3"') == [1, 3]
+    # Weak and malformed ETags never match
+    assert match_revisions('W/"1", "x", 2') == []
+
+
+@pytest.mark.asyncio
+async def test_get_not_modified(app, counting_repository):
+    """Tests a get sending the item's ETag in If-None-Match gets a 304"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await create_item(async_client, item_to_create, return_item=True)
+        item_id = response.json()["_id"]
+        etag = response.headers["etag"]
+
+        response = await async_client.get(f"/items/{item_id}")
+        assert response.headers["etag"] == etag
+
+        response = await async_client.get(
+            f"/items/{item_id}", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+        # Not cached, only the revision is read to answer
+        await app.state.item_cache.invalidate(item_id)
+        counting_repository.calls.clear()
+        response = await async_client.get(
+            f"/items/{item_id}", headers={"If-None-Match": f'"x", W/{etag}'}
+        )
+        assert response.status_code == 304
+        assert dict(counting_repository.calls) == {"get_revision": 1}
+
+        # Once the item changes, it is returned along with its new ETag
+        await async_client.put(f"/items/{item_id}", json={"price": 2})
+        response = await async_client.get(
+            f"/items/{item_id}", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.json()["price"] == 2
+        assert response.headers["etag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_get_all_not_modified(app):
+    """Tests a listing sending its ETag in If-None-Match gets a 304"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await delete_all_items(async_client)
+        await create_priced_items(async_client)
+
+        response = await async_client.get("/items/?order_by=price&limit=2")
+        etag = response.headers["etag"]
+        next_cursor = response.headers["x-next-cursor"]
+        assert all("_rev" not in item for item in response.json())
+
+        response = await async_client.get(
+            "/items/?order_by=price&limit=2", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.headers["x-next-cursor"] == next_cursor
+
+        item_id = (await async_client.get("/items/?order_by=price&limit=1")).json()[0][
+            "_id"
+        ]
+        await async_client.put(f"/items/{item_id}", json={"name": "Changed"})
+        response = await async_client.get(
+            "/items/?order_by=price&limit=2", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_put_if_match(app):
+    """Tests a put with If-Match only updates the revision it names"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await create_item(async_client, item_to_create, return_item=True)
+        item_id = response.json()["_id"]
+        etag = response.headers["etag"]
+
+        response = await async_client.put(
+            f"/items/{item_id}?return_item=True",
+            json={"price": 2},
+            headers={"If-Match": etag},
+        )
+        assert response.status_code == 200
+        new_etag = response.headers["etag"]
+        assert new_etag != etag
+
+        # The first writer won, a second using the same ETag is refused
+        for headers in ({"If-Match": etag}, {"If-Match": 'W/"2"'}):
+            response = await async_client.put(
+                f"/items/{item_id}", json={"price": 3}, headers=headers
+            )
+            assert response.status_code == 412
+            assert response.json() == f"Item with id: {item_id} has been changed"
+
+        response = await async_client.put(
+            f"/items/{item_id}", json={"price": 3}, headers={"If-Match": new_etag}
+        )
+        assert response.status_code == 200
+        # The new ETag comes back, so the next write does not need a GET first
+        response = await async_client.put(
+            f"/items/{item_id}",
+            json={"tax": 2.0},
+            headers={"If-Match": response.headers["etag"]},
+        )
+        assert response.status_code == 200
+        assert response.headers["etag"] == '"4"'
+        response = await async_client.get(f"/items/{item_id}")
+        assert response.json()["price"] == 3
+        assert response.headers["etag"] == '"4"'
+
+        response = await async_client.put(
+            "/items/1111fa8fd3e0a099b5d3a813",
+            json={"price": 3},
+            headers={"If-Match": "*"},
+        )
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_delete_if_match(app):
+    """Tests a delete with If-Match only deletes the revision it names"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await create_item(async_client, item_to_create, return_item=True)
+        item_id = response.json()["_id"]
+        etag = response.headers["etag"]
+        await async_client.patch(f"/items/{item_id}", json={"price": 2})
+
+        response = await async_client.delete(
+            f"/items/{item_id}", headers={"If-Match": etag}
+        )
+        assert response.status_code == 412
+
+        etag = (await async_client.get(f"/items/{item_id}")).headers["etag"]
+        response = await async_client.delete(
+            f"/items/{item_id}", headers={"If-Match": etag}
+        )
+        assert response.status_code == 200
+
+        response = await async_client.delete(
+            f"/items/{item_id}", headers={"If-Match": etag}
+        )
+        assert response.status_code == 404
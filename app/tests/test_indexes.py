@@ -0,0 +1,119 @@
+"""This module contains PyTests for the index management"""
+from pymongo import ASCENDING, IndexModel
+import pytest
+from app.internal.indexes import apply_diff, diff_indexes, ensure_indexes
+from app.internal.pagination import parse_order_by
+from app.models.item_indexes import ITEM_INDEXES
+from app.models.item_query import ItemQuery
+
+
+def index_names(plan) -> set[str]:
+    """Return the names of the indexes used anywhere in an explain() plan"""
+    if isinstance(plan, dict):
+        names = {plan["indexName"]} if "indexName" in plan else set()
+        for key, value in plan.items():
+            if key != "rejectedPlans":
+                names |= index_names(value)
+        return names
+    if isinstance(plan, list):
+        return set().union(*(index_names(value) for value in plan))
+    return set()
+
+
+@pytest.mark.asyncio
+async def test_indexes_created_at_startup(mongo_app):
+    """The declared indexes exist once the app has started"""
+
+    diff = await diff_indexes(mongo_app.state.collection, ITEM_INDEXES)
+    assert not diff.missing
+    assert not diff.changed
+
+
+@pytest.mark.asyncio
+async def test_diff_and_apply_indexes(mongo_app):
+    """Missing, changed and extra indexes are reported, and can be fixed"""
+
+    collection = mongo_app.state.database["test-index-diff"]
+    await collection.drop()
+    declared = [
+        IndexModel([("name", ASCENDING)], name="name_1", unique=True),
+        IndexModel([("price", ASCENDING)], name="price_1"),
+    ]
+    await collection.create_indexes(
+        [
+            IndexModel([("name", ASCENDING)], name="name_1"),
+            IndexModel([("tax", ASCENDING)], name="tax_1"),
+        ]
+    )
+
+    diff = await diff_indexes(collection, declared)
+    assert (diff.missing, diff.changed, diff.extra) == (
+        ["price_1"],
+        ["name_1"],
+        ["tax_1"],
+    )
+
+    await apply_diff(collection, declared, diff, drop_extra=True)
+    assert (await diff_indexes(collection, declared)).in_sync
+
+    # Creating indexes that already exist is a no-op
+    await ensure_indexes(collection, declared)
+    assert (await diff_indexes(collection, declared)).in_sync
+    await collection.drop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("order_by", ["name", "price", "-tax"])
+async def test_keyset_sort_uses_index(mongo_app, order_by):
+    """The queries read_all_items runs for keyset paging are index backed"""
+
+    page = parse_order_by(order_by)
+    cursor = mongo_app.state.collection.find(page.query()).sort(page.sort()).limit(6)
+    plan = await cursor.explain()
+
+    field = order_by.lstrip("-")
+    assert index_names(plan["queryPlanner"]["winningPlan"]) == {f"{field}_id"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        ({"name_prefix": "Fred"}, "name_id"),
+        ({"price_gte": 2, "price_lte": 6}, "price_id"),
+        ({"tax": 1.6}, "tax_id"),
+    ],
+)
+async def test_filters_use_index(mongo_app, query, index):
+    """The filters read_all_items runs are index backed"""
+
+    item_query = ItemQuery(**query)
+    plan = await mongo_app.state.collection.find(item_query.filter()).explain()
+    assert index in index_names(plan["queryPlanner"]["winningPlan"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        ({"name_prefix": "Fred"}, "name_id"),
+        ({"price_gte": 2, "price_lte": 6}, "price_id"),
+    ],
+)
+async def test_filtered_counts_use_index(mongo_app, query, index):
+    """The counts /items/count runs with filters are index backed"""
+
+    # count_documents runs this pipeline
+    pipeline = [
+        {"$match": ItemQuery(**query).filter()},
+        {"$group": {"_id": 1, "n": {"$sum": 1}}},
+    ]
+    plan = await mongo_app.state.database.command(
+        "explain",
+        {
+            "aggregate": mongo_app.state.collection.name,
+            "pipeline": pipeline,
+            "cursor": {},
+        },
+    )
+    assert index in index_names(plan)
@@ -0,0 +1,87 @@
+"""This module contains PyTests for the item stats"""
+from httpx import AsyncClient
+import pytest
+from app.internal.cache import LRUCache, VersionedCache
+from app.tests.test_items import create_priced_items
+
+
+@pytest.mark.asyncio
+async def test_item_stats(app):
+    """Tests the summary of the items, filtered and bucketed"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get("/items/stats")
+        assert response.status_code == 200
+        stats = response.json()
+        assert stats["count"] == 10
+        assert stats["price"] == {"min": 0, "max": 9, "avg": 4.5}
+        assert stats["tax"]["min"] == 0
+        assert stats["tax"]["max"] == 0.9
+        assert stats["tax"]["avg"] == pytest.approx(0.45)
+        assert stats["price_buckets"] == [
+            {"min": 0, "max": 2, "count": 2},
+            {"min": 2, "max": 4, "count": 2},
+            {"min": 4, "max": 6, "count": 2},
+            {"min": 6, "max": 8, "count": 2},
+            {"min": 8, "max": 10, "count": 2},
+            {"min": 10, "max": 11, "count": 0},
+        ]
+
+        response = await async_client.get("/items/stats?price_gte=5&bucket_size=5")
+        stats = response.json()
+        assert stats["count"] == 5
+        assert stats["price"] == {"min": 5, "max": 9, "avg": 7}
+        assert stats["price_buckets"] == [
+            {"min": 0, "max": 5, "count": 0},
+            {"min": 5, "max": 10, "count": 5},
+            {"min": 10, "max": 11, "count": 0},
+        ]
+
+        response = await async_client.get("/items/stats?name_prefix=Nobody")
+        assert response.json()["count"] == 0
+        assert response.json()["price"] == {"min": None, "max": None, "avg": None}
+
+        response = await async_client.get("/items/stats?bucket_size=0")
+        assert response.status_code == 422
+
+        # Non finite floats are rejected, rather than failing the cache key
+        for query in ("tax_gte=nan", "tax=inf", "tax_lte=-inf"):
+            response = await async_client.get(f"/items/stats?{query}")
+            assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_item_stats_are_cached(app, counting_repository):
+    """Tests the stats are reused until they expire, rather than aggregated again"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        for _ in range(3):
+            response = await async_client.get("/items/stats?price_gte=5")
+            assert response.json()["count"] == 5
+        assert counting_repository.calls["aggregate"] == 1
+
+        # Other filters, or buckets, are aggregated separately
+        await async_client.get("/items/stats?price_gte=5&bucket_size=1")
+        assert counting_repository.calls["aggregate"] == 2
+
+        # Following the changes, any change drops the cached stats
+        await app.state.stats_cache.apply_change({"operationType": "insert"})
+        response = await async_client.get("/items/stats?price_gte=5")
+        assert counting_repository.calls["aggregate"] == 3
+
+
+@pytest.mark.asyncio
+async def test_versioned_cache():
+    """Tests a value cached before a change is not read after it"""
+
+    cache = VersionedCache(LRUCache())
+    key = cache.key("stats")
+    await cache.set(key, 1)
+    assert await cache.get(cache.key("stats")) == 1
+
+    await cache.apply_change({"operationType": "delete"})
+    assert await cache.get(cache.key("stats")) is None
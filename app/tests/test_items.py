@@ -1,8 +1,13 @@
 """This module contains PyTests for the Items FastApi endpoint"""
+import base64
+import json
+from bson import ObjectId
 from fastapi import FastAPI, Response
 from httpx import AsyncClient
 from pydantic_mongo import ObjectIdField
 import pytest
+from pymongo.errors import BulkWriteError, WriteError
+from app.repositories.memory_item_repository import MemoryItemRepository
 
 
 async def create_item(
@@ -18,8 +23,9 @@ async def create_item(
 async def delete_all_items(client: AsyncClient) -> None:
     """Fixture used to delete all ietms in the MongoDb"""
     response = await client.get("/items/?limit=1000")
-    for item in response.json():
-        response = await client.delete(f"/items/{item['_id']}?")
+    item_ids = [item["_id"] for item in response.json()]
+    if item_ids:
+        await client.request("DELETE", "/items/bulk", json=item_ids)
 
 
 @pytest.mark.asyncio
@@ -384,3 +390,575 @@ async def test_put_with_valid_item_selected_fields(app):
         test_item["name"] = "updated name"
         test_item["_id"] = item_id
         assert response.json() == item_to_create
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_keyset_paging(app):
+    """Page through the items using the X-Next-Cursor token, ordered by price"""
+
+    item_to_create = {
+        "name": "Fred",
+        "description": "This is Fred item",
+        "price": 10,
+        "tax": 1.6,
+    }
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await delete_all_items(client=async_client)
+        # Create the items in reverse price order, so _id and price orders differ
+        for i in range(9, -1, -1):
+            item_to_create["price"] = i
+            await create_item(client=async_client, item_to_create=item_to_create)
+
+        response = await async_client.get("/items/?order_by=price&limit=3")
+        prices = []
+        while True:
+            assert response.status_code == 200
+            prices.extend(item["price"] for item in response.json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            response = await async_client.get(
+                f"/items/?after={response.headers['X-Next-Cursor']}&limit=3"
+            )
+
+        assert prices == list(range(0, 10))
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_keyset_paging_descending_id(app):
+    """Keyset paging by descending _id returns the newest items first"""
+
+    item_to_create = {
+        "name": "Fred",
+        "description": "This is Fred item",
+        "price": 10,
+        "tax": 1.6,
+    }
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await delete_all_items(client=async_client)
+        created = []
+        for _ in range(0, 4):
+            response = await create_item(async_client, item_to_create)
+            created.append(response.json()["_id"])
+
+        response = await async_client.get("/items/?order_by=-_id&limit=2")
+        assert [item["_id"] for item in response.json()] == created[:1:-1]
+
+        cursor = response.headers["X-Next-Cursor"]
+        response = await async_client.get(f"/items/?after={cursor}&limit=2")
+        assert [item["_id"] for item in response.json()] == created[1::-1]
+        assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_invalid_keyset_paging(app):
+    """Invalid cursors, sort fields or a cursor used with skip return 422"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await async_client.get("/items/?after=notacursor")
+        assert response.status_code == 422
+
+        response = await async_client.get("/items/?order_by=description")
+        assert response.status_code == 422
+
+        response = await async_client.get("/items/?order_by=price&skip=2")
+        assert response.status_code == 422
+
+        # A tampered cursor can not put query operators into the filter
+        for value in ({"$ne": None}, {"$foo": 1}, [1], True, "cheap"):
+            payload = {"f": "price", "d": 1, "v": value, "i": str(ObjectId())}
+            token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            response = await async_client.get(f"/items/?after={token}")
+            assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_bulk_create(app):
+    """Create many items with one request, each gets its own id"""
+
+    items_to_create = [
+        {"name": f"item {i}", "description": None, "price": i, "tax": 1.6}
+        for i in range(0, 5)
+    ]
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await delete_all_items(client=async_client)
+        response = await async_client.post("/items/bulk", json=items_to_create)
+        assert response.status_code == 201
+
+        results = response.json()
+        assert [result["status"] for result in results] == [201] * 5
+        for result, item_created in zip(results, items_to_create):
+            response = await async_client.get(f"/items/{result['_id']}")
+            assert response.json() == {**item_created, "_id": result["_id"]}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_bulk_create_with_invalid_item(app):
+    """A bulk create with an invalid item is rejected as a whole"""
+
+    items_to_create = [
+        {"name": "Fred", "description": None, "price": 1, "tax": 1.6},
+        {"name": "Fred", "description": None, "price": 100, "tax": 1.6},
+    ]
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await async_client.post("/items/bulk", json=items_to_create)
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", 1, "price"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_bulk_update(app):
+    """Update many items with one request, unknown ids are reported per item"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+    missing_id = "1111fa8fd3e0a099b5d3a813"
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        first = (await create_item(async_client, item_to_create)).json()["_id"]
+        second = (await create_item(async_client, item_to_create)).json()["_id"]
+
+        response = await async_client.put(
+            "/items/bulk",
+            json=[
+                {"_id": first, "price": 5},
+                {"_id": missing_id, "price": 6},
+                {"_id": second, "name": "Bert"},
+            ],
+        )
+        assert response.status_code == 207
+        assert [result["status"] for result in response.json()] == [200, 404, 200]
+
+        response = await async_client.get(f"/items/{first}")
+        assert response.json()["price"] == 5
+        response = await async_client.get(f"/items/{second}")
+        assert response.json()["name"] == "Bert"
+        response = await async_client.get(f"/items/{missing_id}")
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_bulk_upsert(app):
+    """Upsert creates missing items, but only when all their fields are given"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+    new_id = "2222fa8fd3e0a099b5d3a813"
+    partial_id = "3333fa8fd3e0a099b5d3a813"
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        existing = (await create_item(async_client, item_to_create)).json()["_id"]
+        await async_client.request("DELETE", "/items/bulk", json=[new_id, partial_id])
+
+        response = await async_client.put(
+            "/items/bulk?upsert=true",
+            json=[
+                {"_id": existing, **item_to_create, "price": 2},
+                {"_id": new_id, **item_to_create},
+                {"_id": partial_id, "price": 3},
+            ],
+        )
+        assert response.status_code == 207
+        assert [result["status"] for result in response.json()] == [200, 201, 422]
+
+        response = await async_client.get(f"/items/{new_id}")
+        assert response.json() == {**item_to_create, "_id": new_id}
+        response = await async_client.get(f"/items/{partial_id}")
+        assert response.status_code == 404
+
+
+class RejectingRepository(MemoryItemRepository):
+    """Repository refusing to update one of the items"""
+
+    def __init__(self, rejected_id: ObjectId):
+        super().__init__()
+        self.rejected_id = rejected_id
+
+    async def update(self, item_id, fields, revisions=None) -> int | None:
+        if item_id == self.rejected_id:
+            raise WriteError("Document failed validation", 121)
+        return await super().update(item_id, fields, revisions)
+
+
+@pytest.mark.asyncio
+async def test_memory_bulk_update_ordered():
+    """A failed update stops an ordered bulk update, an unordered one carries on"""
+
+    for ordered, updated in ((True, [6, 1]), (False, [6, 6])):
+        ids = [ObjectId() for _ in range(3)]
+        repository = RejectingRepository(ids[1])
+        await repository.insert_many([{"_id": item_id, "price": 1} for item_id in ids])
+
+        with pytest.raises(BulkWriteError) as exc_info:
+            await repository.bulk_update(
+                [(item_id, {"price": 6}) for item_id in ids], ordered=ordered
+            )
+        assert [error["index"] for error in exc_info.value.details["writeErrors"]] == [
+            1
+        ]
+        assert [(await repository.get(ids[i]))["price"] for i in (0, 2)] == updated
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_bulk_delete(app):
+    """Delete many items with one request, unknown ids are reported per item"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+    missing_id = "1111fa8fd3e0a099b5d3a813"
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        first = (await create_item(async_client, item_to_create)).json()["_id"]
+        second = (await create_item(async_client, item_to_create)).json()["_id"]
+
+        response = await async_client.request(
+            "DELETE", "/items/bulk", json=[first, missing_id, second]
+        )
+        assert response.status_code == 207
+        assert response.json() == [
+            {"_id": first, "status": 200},
+            {
+                "_id": missing_id,
+                "status": 404,
+                "detail": f"Item with id: {missing_id} does not exist",
+            },
+            {"_id": second, "status": 200},
+        ]
+
+        response = await async_client.get(f"/items/{first}")
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_lookup(app, counting_repository):
+    """Get many items in the order asked for, only the uncached ones are read"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+    missing_id = "1111fa8fd3e0a099b5d3a813"
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        first = (await create_item(async_client, item_to_create)).json()["_id"]
+        second = (await create_item(async_client, item_to_create)).json()["_id"]
+        # Drop the entry refreshed by the create, so it has to be read
+        await app.state.item_cache.invalidate(second)
+
+        response = await async_client.post(
+            "/items/lookup", json=[second, missing_id, first, second]
+        )
+        assert response.status_code == 207
+        found = {
+            "status": 200,
+            "etag": '"1"',
+            "item": {**item_to_create, "_id": second},
+        }
+        assert response.json() == [
+            {"_id": second, **found},
+            {
+                "_id": missing_id,
+                "status": 404,
+                "detail": f"Item with id: {missing_id} does not exist",
+            },
+            {"_id": first, **found, "item": {**item_to_create, "_id": first}},
+            {"_id": second, **found},
+        ]
+        assert counting_repository.calls["get_many"] == 1
+
+        # Both are cached now, so nothing is read
+        response = await async_client.post("/items/lookup", json=[first, second])
+        assert response.status_code == 200
+        assert [result["_id"] for result in response.json()] == [first, second]
+        assert counting_repository.calls["get_many"] == 1
+
+        response = await async_client.post("/items/lookup", json=[first, "bad"])
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_streamed(app):
+    """Streaming the list returns the same items as the buffered response"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await delete_all_items(client=async_client)
+        for _ in range(0, 7):
+            await create_item(async_client, item_to_create)
+
+        expected = (await async_client.get("/items/?limit=10")).json()
+        assert len(expected) == 7
+
+        response = await async_client.get("/items/?limit=10&stream=true&batch_size=2")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == expected
+
+        response = await async_client.get(
+            "/items/?limit=10&batch_size=2",
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = response.text.splitlines()
+        assert [json.loads(line) for line in lines] == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_streamed_empty(app):
+    """Streaming an empty list returns a valid empty JSON array"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await delete_all_items(client=async_client)
+        response = await async_client.get("/items/?stream=true")
+        assert response.status_code == 200
+        assert response.json() == []
+
+
+@pytest.mark.asyncio
+async def test_get_is_cached(app, counting_repository):
+    """Repeated gets of the same item are served from the cache"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        item_id = (await create_item(async_client, item_to_create)).json()["_id"]
+        # Drop the entry refreshed by the create, so the first get is a miss
+        await app.state.item_cache.invalidate(item_id)
+
+        for _ in range(0, 10):
+            response = await async_client.get(f"/items/{item_id}")
+            assert response.status_code == 200
+            assert response.json() == {**item_to_create, "_id": item_id}
+
+        assert counting_repository.calls["get"] == 1
+
+        response = await async_client.get("/items/cache/stats")
+        assert response.json()["hits"] == 9
+
+        # An update invalidates the cached item, so the next get reads it again
+        await async_client.put(f"/items/{item_id}", json={"price": 2})
+        response = await async_client.get(f"/items/{item_id}")
+        assert response.json()["price"] == 2
+        assert counting_repository.calls["get"] == 2
+
+        await async_client.delete(f"/items/{item_id}")
+        response = await async_client.get(f"/items/{item_id}")
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_create_return_item_single_round_trip(app, counting_repository):
+    """Returning the created item does not read it back from MongoDb"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await create_item(async_client, item_to_create, True)
+        assert response.status_code == 201
+        assert response.json() == {**item_to_create, "_id": response.json()["_id"]}
+        assert dict(counting_repository.calls) == {"insert": 1}
+
+
+@pytest.mark.asyncio
+async def test_put_return_item(app, counting_repository):
+    """Put with return_item returns the updated item in a single round trip"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        item_id = (await create_item(async_client, item_to_create)).json()["_id"]
+
+        response = await async_client.put(
+            f"/items/{item_id}?return_item=true", json={"name": "Bert"}
+        )
+        assert response.status_code == 200
+        assert response.json() == {**item_to_create, "name": "Bert", "_id": item_id}
+        assert counting_repository.calls["update_and_get"] == 1
+        assert counting_repository.calls["get"] == 0
+
+        # The updated item has been cached, so the get is not a round trip either
+        response = await async_client.get(f"/items/{item_id}")
+        assert response.json()["name"] == "Bert"
+        assert counting_repository.calls["get"] == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_patch(app):
+    """Patch updates the given fields and returns the updated item"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        item_id = (await create_item(async_client, item_to_create)).json()["_id"]
+
+        response = await async_client.patch(f"/items/{item_id}", json={"price": 3})
+        assert response.status_code == 200
+        assert response.json() == {**item_to_create, "price": 3, "_id": item_id}
+
+        response = await async_client.patch(f"/items/{item_id}", json={})
+        assert response.status_code == 200
+        assert response.json() == {**item_to_create, "price": 3, "_id": item_id}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_patch_nonexistent_item(app):
+    """When calling patch with a non existant id, return 404 - Item not Found"""
+
+    item_id = "1111fa8fd3e0a099b5d3a813"
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await async_client.patch(f"/items/{item_id}", json={"price": 3})
+        assert response.status_code == 404
+        assert response.json() == f"Item with id: {item_id} does not exist"
+
+
+async def create_priced_items(client: AsyncClient) -> None:
+    """Helper method to replace all the items with 10, priced 0 to 9"""
+    await delete_all_items(client=client)
+    items_to_create = [
+        {
+            "name": f"{'Fred' if i % 2 else 'Bert'} {i}",
+            "description": None,
+            "price": i,
+            "tax": i / 10,
+        }
+        for i in range(0, 10)
+    ]
+    await client.post("/items/bulk", json=items_to_create)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_filters(app):
+    """Items can be filtered on price and tax ranges, and a name prefix"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get("/items/?limit=0&price=3")
+        assert [item["price"] for item in response.json()] == [3]
+
+        response = await async_client.get(
+            "/items/?limit=0&price_gte=2&price_lte=6&sort=price"
+        )
+        assert [item["price"] for item in response.json()] == [2, 3, 4, 5, 6]
+
+        response = await async_client.get("/items/?limit=0&tax_lte=0.35&sort=tax")
+        assert [item["price"] for item in response.json()] == [0, 1, 2, 3]
+
+        response = await async_client.get(
+            "/items/?limit=0&name_prefix=Fred&price_gte=5&sort=price"
+        )
+        assert [item["name"] for item in response.json()] == [
+            "Fred 5",
+            "Fred 7",
+            "Fred 9",
+        ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_multi_key_sort(app):
+    """Items can be sorted on several fields, in either direction"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get("/items/?limit=4&sort=name,-price")
+        assert [item["name"] for item in response.json()] == [
+            "Bert 0",
+            "Bert 2",
+            "Bert 4",
+            "Bert 6",
+        ]
+
+        response = await async_client.get("/items/?limit=3&sort=-price")
+        assert [item["price"] for item in response.json()] == [9, 8, 7]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_projection(app):
+    """Only the requested fields (and the _id) are returned"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get(
+            "/items/?limit=2&fields=name,price&sort=price"
+        )
+        assert response.status_code == 200
+        items = response.json()
+        assert [set(item) for item in items] == [{"_id", "name", "price"}] * 2
+        assert [item["price"] for item in items] == [0, 1]
+
+        # Keyset paging still works when the ordering field is not projected
+        response = await async_client.get("/items/?limit=2&fields=name&order_by=tax")
+        assert [item["name"] for item in response.json()] == ["Bert 0", "Fred 1"]
+        cursor = response.headers["X-Next-Cursor"]
+        response = await async_client.get(f"/items/?limit=2&fields=name&after={cursor}")
+        assert [item["name"] for item in response.json()] == ["Bert 2", "Fred 3"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_filters_and_keyset_paging(app):
+    """The filters are applied to every page of a keyset paged listing"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        await create_priced_items(async_client)
+
+        response = await async_client.get(
+            "/items/?limit=2&name_prefix=Bert&order_by=-price"
+        )
+        prices = [item["price"] for item in response.json()]
+        cursor = response.headers["X-Next-Cursor"]
+        response = await async_client.get(
+            f"/items/?limit=2&name_prefix=Bert&after={cursor}"
+        )
+        prices += [item["price"] for item in response.json()]
+        assert prices == [8, 6, 4, 2]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("app")
+async def test_get_all_with_invalid_query(app):
+    """Unknown sort or projection fields, and out of range filters, return 422"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await async_client.get("/items/?sort=description")
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["query", "sort"]
+
+        response = await async_client.get("/items/?fields=name,colour")
+        assert response.status_code == 422
+
+        response = await async_client.get("/items/?price_gte=11")
+        assert response.status_code == 422
+
+        response = await async_client.get("/items/?sort=price&order_by=price")
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_openapi_schema(memory_app):
+    """The OpenAPI schema, behind /docs, can be generated"""
+
+    async with AsyncClient(
+        app=memory_app, base_url="http://localhost:8000"
+    ) as async_client:
+        response = await async_client.get("/openapi.json")
+        assert response.status_code == 200
+        schemas = response.json()["components"]["schemas"]
+        assert schemas["PartialItemResponse"]["properties"]["_id"]["type"] == "string"
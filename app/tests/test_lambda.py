@@ -0,0 +1,55 @@
+"""This module contains PyTests for running the app under AWS Lambda"""
+import asyncio
+import subprocess
+import sys
+from mangum import Mangum
+from app.main import LambdaStartup, app_factory, app_shutdown
+
+
+def api_gateway_event(path: str) -> dict:
+    """Return a minimal API Gateway (REST) proxy event for a GET request"""
+    return {
+        "resource": "/{proxy+}",
+        "path": path,
+        "httpMethod": "GET",
+        "headers": {"Host": "localhost"},
+        "multiValueHeaders": {},
+        "queryStringParameters": None,
+        "multiValueQueryStringParameters": None,
+        "requestContext": {"resourcePath": "/{proxy+}", "httpMethod": "GET"},
+        "pathParameters": {"proxy": path},
+        "body": None,
+        "isBase64Encoded": False,
+    }
+
+
+def test_import_does_not_load_motor():
+    """Motor is only imported once a client is created, not at cold start"""
+
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, app.main; print('motor' in sys.modules)"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_handler_reuses_client_across_invocations():
+    """The first invocation connects to MongoDb, warm invocations reuse it"""
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    my_app = app_factory()
+    handler = Mangum(LambdaStartup(my_app), lifespan="off")
+
+    response = handler(api_gateway_event("/items/1111fa8fd3e0a099b5d3a813"), {})
+    assert response["statusCode"] == 404
+    client = my_app.state.mongodb_client
+
+    response = handler(api_gateway_event("/items/cache/stats"), {})
+    assert response["statusCode"] == 200
+    assert my_app.state.mongodb_client is client
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(app_shutdown(my_app))
+    loop.close()
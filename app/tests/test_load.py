@@ -0,0 +1,44 @@
+"""This module contains PyTests for the load benchmark, run as a smoke test"""
+import json
+import subprocess
+import sys
+
+
+def run_load(*args: str) -> subprocess.CompletedProcess:
+    """Run a short python -m benchmarks.load against the in-memory backend"""
+    return subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.load",
+            "--backend",
+            "memory",
+            "--concurrency",
+            "2",
+            "--requests",
+            "20",
+            *args,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+        timeout=60,
+    )
+
+
+def test_load_report_is_json():
+    """The report on stdout can be piped into a JSON parser"""
+
+    report = json.loads(run_load().stdout)
+    assert report["meta"]["backend"] == "memory"
+    assert all(result["errors"] == 0 for result in report["results"])
+
+
+def test_load_uvicorn_with_write_batching():
+    """Batched creates are flushed when uvicorn serves from a thread of its own"""
+
+    report = json.loads(
+        run_load("--target", "uvicorn", "--write-batch-size", "50").stdout
+    )
+    created = [r for r in report["results"] if r["endpoint"] == "create_item"]
+    assert created[0]["errors"] == 0
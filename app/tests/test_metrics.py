@@ -0,0 +1,144 @@
+"""This module tests the request timing middleware and /metrics"""
+import asyncio
+import contextvars
+from types import SimpleNamespace
+import pytest
+from httpx import AsyncClient
+from app.internal.metrics import (
+    CommandMonitor,
+    Metrics,
+    TimingMiddleware,
+    current_timing,
+)
+
+ITEM = {"name": "Fred", "description": "This is Fred item", "price": 5, "tax": 1.6}
+
+
+async def plain_app(scope, receive, send):
+    """Minimal ASGI app, answering every request with an empty 200"""
+    # pylint: disable=unused-argument
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def call(asgi_app, scope=None):
+    """Call an ASGI app with a GET request, returning the messages it sent"""
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope or {"type": "http", "method": "GET"}, None, send)
+    return sent
+
+
+@pytest.mark.asyncio
+async def test_server_timing_header(app):
+    """Tests the db and ser timings are sent with each response"""
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/items/", json=ITEM)
+        item_id = response.json()["_id"]
+        response = await client.get(f"/items/{item_id}")
+        assert response.status_code == 200
+
+    timings = response.headers["server-timing"].split(", ")
+    assert [timing.split(";")[0] for timing in timings] == ["db", "ser", "total"]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(app):
+    """Tests the request latencies are reported per route, in Prometheus format"""
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/items/", json=ITEM)
+        item_id = response.json()["_id"]
+        for _ in range(3):
+            await client.get(f"/items/{item_id}")
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    labels = 'method="GET",route="/items/{item_id}",status="200"'
+    assert f"http_request_duration_seconds_count{{{labels}}} 3" in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in lines
+    assert f"http_request_db_seconds_count{{{labels}}} 3" in lines
+    assert f"http_request_serialization_seconds_count{{{labels}}} 3" in lines
+
+
+@pytest.mark.asyncio
+async def test_commands_are_charged_to_the_request():
+    """Tests the command listener adds each command to the request being timed"""
+    metrics = Metrics()
+    monitor = CommandMonitor(metrics)
+
+    async def querying_app(scope, receive, send):
+        # Motor sends the commands from its thread pool, copying the context
+        event = SimpleNamespace(command_name="find", duration_micros=1500)
+        context = contextvars.copy_context()
+        await asyncio.get_running_loop().run_in_executor(
+            None, context.run, monitor.succeeded, event
+        )
+        await plain_app(scope, receive, send)
+
+    sent = await call(TimingMiddleware(querying_app, metrics))
+
+    headers = dict(sent[0]["headers"])
+    assert headers[b"server-timing"].startswith(b'db;dur=1.500;desc="1 commands"')
+    assert metrics.commands.count(("find", "succeeded")) == 1
+    assert metrics.request_db.count(("GET", "unmatched", 200)) == 1
+
+    # Commands sent outside of a request are still counted
+    monitor.failed(SimpleNamespace(command_name="find", duration_micros=10))
+    assert metrics.commands.count(("find", "failed")) == 1
+
+
+@pytest.mark.asyncio
+async def test_sampling_off_passes_requests_through():
+    """Tests unsampled requests reach the app untouched, and are not recorded"""
+    metrics = Metrics()
+    seen = {}
+
+    async def recording_app(scope, receive, send):
+        seen["send"] = send
+        seen["timing"] = current_timing()
+        await plain_app(scope, receive, send)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = TimingMiddleware(recording_app, metrics, sample_rate=0)
+    await middleware({"type": "http", "method": "GET"}, None, send)
+
+    assert seen == {"send": send, "timing": None}
+    assert sent[0]["headers"] == []
+    assert metrics.requests.count(("GET", "unmatched", 200)) == 0
+
+
+@pytest.mark.asyncio
+async def test_sampling_off_does_no_timing(monkeypatch):
+    """Tests requests are passed straight through when sampling is off
+
+    No clock is read and no sampling decision made, so the overhead is a check
+    of the sample rate
+    """
+    calls = []
+
+    def counted(name):
+        return lambda: calls.append(name) or 0.0
+
+    monkeypatch.setattr(
+        "app.internal.metrics.time", SimpleNamespace(perf_counter=counted("clock"))
+    )
+    monkeypatch.setattr(
+        "app.internal.metrics.random", SimpleNamespace(random=counted("random"))
+    )
+    metrics = Metrics()
+    middleware = TimingMiddleware(plain_app, metrics, sample_rate=0)
+    for _ in range(3):
+        await call(middleware)
+
+    assert not calls
+    assert metrics.requests.count(("GET", "unmatched", 200)) == 0
@@ -0,0 +1,59 @@
+"""This module contains PyTests for the MongoDb client setup"""
+from httpx import AsyncClient
+from pymongo import monitoring
+import pytest
+from app.internal.mongo import PoolMonitor, pool_options
+
+ADDRESS = ("localhost", 27017)
+
+
+def test_pool_options_from_environment(monkeypatch):
+    """The pool settings are read from the environment, unset ones are left out"""
+
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "50")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "250")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zstd,snappy")
+    monkeypatch.delenv("MONGO_MIN_POOL_SIZE", raising=False)
+    monkeypatch.delenv("MONGO_MAX_IDLE_TIME_MS", raising=False)
+
+    assert pool_options() == {
+        "maxPoolSize": 50,
+        "waitQueueTimeoutMS": 250,
+        "compressors": "zstd,snappy",
+    }
+
+
+def test_pool_monitor_counts_checkouts():
+    """The monitor tracks open and in use connections, and checkout waits"""
+
+    monitor = PoolMonitor()
+    monitor.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 1))
+    monitor.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 2))
+    for connection_id in (1, 2):
+        monitor.connection_check_out_started(
+            monitoring.ConnectionCheckOutStartedEvent(ADDRESS)
+        )
+        monitor.connection_checked_out(
+            monitoring.ConnectionCheckedOutEvent(ADDRESS, connection_id)
+        )
+    monitor.connection_checked_in(monitoring.ConnectionCheckedInEvent(ADDRESS, 1))
+    monitor.connection_closed(monitoring.ConnectionClosedEvent(ADDRESS, 1, "idle"))
+
+    stats = monitor.stats()
+    assert stats["open_connections"] == 1
+    assert stats["in_use"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["checkout_failures"] == 0
+    assert stats["checkout_wait_ms_max"] >= stats["checkout_wait_ms_avg"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_get_pool_stats(mongo_app):
+    """The pool counters are served from /stats/pool"""
+
+    async with AsyncClient(
+        app=mongo_app, base_url="http://localhost:8000"
+    ) as async_client:
+        response = await async_client.get("/stats/pool")
+        assert response.status_code == 200
+        assert {"open_connections", "in_use", "options"} <= set(response.json())
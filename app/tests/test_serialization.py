@@ -0,0 +1,30 @@
+"""This module contains PyTests for the fast JSON serialization"""
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.internal.serialization import FastJSONResponse, item_response
+from app.models.item_response import ItemResponse
+
+DOCUMENTS = [
+    {"_id": ObjectId(), "name": "Fred", "description": None, "price": 1, "tax": 1.6},
+    {"_id": ObjectId(), "name": "Zoë ✓", "description": "<>&", "price": 0, "tax": 0.0},
+    {"_id": ObjectId(), "name": "big", "description": "", "price": 10, "tax": 1e16},
+    {"_id": ObjectId(), "name": "small", "description": "x", "price": 2, "tax": 1e-7},
+]
+
+
+def test_list_bytes_match_jsonable_encoder():
+    """A list of documents renders exactly as the jsonable_encoder path did"""
+
+    expected = JSONResponse(
+        content=jsonable_encoder(DOCUMENTS, custom_encoder={ObjectId: str})
+    ).body
+    assert FastJSONResponse(content=DOCUMENTS).body == expected
+
+
+def test_item_bytes_match_jsonable_encoder():
+    """A single item renders exactly as the jsonable_encoder path did"""
+
+    for document in DOCUMENTS:
+        expected = JSONResponse(content=jsonable_encoder(ItemResponse(**document)))
+        assert FastJSONResponse(content=item_response(document)).body == expected.body
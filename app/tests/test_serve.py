@@ -0,0 +1,59 @@
+"""This module contains PyTests for the multi-worker entry point"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import httpx
+
+
+def free_port() -> int:
+    """Return a port nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(*args: str) -> subprocess.Popen:
+    """Start python -m app.serve with the in-memory backend"""
+    env = {**os.environ, "ITEM_BACKEND": "memory"}
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", *args],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+
+def test_serve_shuts_down_gracefully():
+    """SIGTERM stops the server cleanly, running the shutdown event"""
+
+    port = free_port()
+    process = serve("--port", str(port), "--workers", "1")
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                response = httpx.get(f"http://127.0.0.1:{port}/items/")
+                break
+            except httpx.TransportError:
+                assert time.monotonic() < deadline, "the server did not start"
+                time.sleep(0.1)
+        assert response.status_code == 200
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=30)
+
+    assert process.returncode == 0
+    assert "Application shutdown complete" in output
+
+
+def test_serve_refuses_memory_backend_with_workers():
+    """Each worker would have its own in-memory items, so it is refused"""
+
+    process = serve("--port", str(free_port()), "--workers", "2")
+    output, _ = process.communicate(timeout=30)
+    assert process.returncode != 0
+    assert "single worker" in output
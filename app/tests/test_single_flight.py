@@ -0,0 +1,153 @@
+"""This module contains PyTests for the request coalescing"""
+import asyncio
+import pytest
+from httpx import AsyncClient
+from app.internal.single_flight import SingleFlight
+from app.tests.test_items import create_item
+
+
+class SlowLoader:
+    # pylint: disable=too-few-public-methods
+    """Loader that takes a while, counting how often it is called"""
+
+    def __init__(self, result=None, error: Exception | None = None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.02)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_are_shared():
+    """Concurrent callers for one key share a load, other keys get their own"""
+
+    flights = SingleFlight()
+    loader, other = SlowLoader("a"), SlowLoader("b")
+
+    results = await asyncio.gather(
+        *(flights.run("a", loader) for _ in range(10)), flights.run("b", other)
+    )
+
+    assert results == ["a"] * 10 + ["b"]
+    assert (loader.calls, other.calls) == (1, 1)
+    assert flights.in_flight() == 0
+
+    # Once landed, the next caller loads again
+    assert await flights.run("a", loader) == "a"
+    assert loader.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    """Every caller gets the exception, and the next call tries again"""
+
+    flights = SingleFlight()
+    loader = SlowLoader(error=ValueError("boom"))
+
+    results = await asyncio.gather(
+        *(flights.run("a", loader) for _ in range(5)), return_exceptions=True
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert loader.calls == 1
+
+    loader.error = None
+    assert await flights.run("a", loader) is None
+    assert loader.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_load():
+    """A caller being cancelled leaves the load running for the others"""
+
+    flights = SingleFlight()
+    loader = SlowLoader("a")
+
+    first = asyncio.ensure_future(flights.run("a", loader))
+    second = asyncio.ensure_future(flights.run("a", loader))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "a"
+    assert first.cancelled()
+    assert loader.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_forget_starts_a_new_load():
+    """Callers arriving after forget do not join the load already running"""
+
+    flights = SingleFlight()
+    loader = SlowLoader("a")
+
+    first = asyncio.ensure_future(flights.run("a", loader))
+    await asyncio.sleep(0)
+    flights.forget()
+    second = asyncio.ensure_future(flights.run("a", loader))
+
+    assert await asyncio.gather(first, second) == ["a", "a"]
+    assert loader.calls == 2
+    assert flights.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_gets_share_one_query(app, counting_repository, monkeypatch):
+    """Concurrent gets of an uncached item make a single repository call"""
+
+    item_to_create = {"name": "Fred", "description": None, "price": 1, "tax": 1.6}
+    repository = counting_repository.repository
+    get = repository.get
+
+    async def slow_get(item_id):
+        await asyncio.sleep(0.02)
+        return await get(item_id)
+
+    monkeypatch.setattr(repository, "get", slow_get)
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        item_id = (await create_item(async_client, item_to_create)).json()["_id"]
+        await app.state.item_cache.invalidate(item_id)
+        counting_repository.calls.clear()
+
+        responses = await asyncio.gather(
+            *(async_client.get(f"/items/{item_id}") for _ in range(20))
+        )
+
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["_id"] == item_id for response in responses)
+    assert counting_repository.calls["get"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_listings_share_one_query(
+    app, counting_repository, monkeypatch
+):
+    """Concurrent identical listings make a single repository call"""
+
+    repository = counting_repository.repository
+    find = repository.find
+
+    def slow_find(*args, **kwargs):
+        async def items():
+            await asyncio.sleep(0.02)
+            async for item in find(*args, **kwargs):
+                yield item
+
+        return items()
+
+    monkeypatch.setattr(repository, "find", slow_find)
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        responses = await asyncio.gather(
+            *(async_client.get("/items/?limit=3") for _ in range(10)),
+            async_client.get("/items/?limit=2"),
+        )
+
+    assert len({response.text for response in responses[:10]}) == 1
+    assert counting_repository.calls["find"] == 2
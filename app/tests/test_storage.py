@@ -0,0 +1,148 @@
+"""This module contains PyTests for the compact item storage format"""
+from bson import ObjectId
+from httpx import AsyncClient
+import pytest
+import pytest_asyncio
+from app.internal.migrate_items import migrate
+from app.repositories.item_codec import COMPACT, FULL, ItemCodec
+from app.repositories.mongo_item_repository import MongoItemRepository
+from app.models.item_indexes import ITEM_INDEXES
+
+ITEM = {"name": "Fred", "description": None, "price": 5, "tax": 1.6}
+
+
+@pytest_asyncio.fixture(name="compact_app")
+async def compact_app_fixture(mongo_app):
+    """The MongoDb app, storing its items in the compact format"""
+    collection = mongo_app.state.database["test-compact"]
+    await collection.delete_many({})
+    mongo_app.state.collection = collection
+    mongo_app.state.item_repository = MongoItemRepository(
+        collection, ItemCodec(COMPACT)
+    )
+    yield mongo_app
+
+
+def test_codec():
+    """Field names are shortened in documents, filters, sorts and updates"""
+
+    codec = ItemCodec(COMPACT)
+    item = {"_id": ObjectId(), **ITEM, "_rev": 2}
+    document = codec.encode(item)
+    assert document == {
+        "_id": item["_id"],
+        "n": "Fred",
+        "d": None,
+        "p": 5,
+        "t": 1.6,
+        "r": 2,
+        "v": 2,
+    }
+    assert codec.decode(document) == item
+    assert codec.decode(item) == item
+
+    assert codec.filter(
+        {"name": {"$regex": "^F"}, "$or": [{"price": 1}, {"price": 2, "_id": 1}]}
+    ) == {"n": {"$regex": "^F"}, "$or": [{"p": 1}, {"p": 2, "_id": 1}]}
+    assert codec.sort([("price", -1), ("_id", 1)]) == [("p", -1), ("_id", 1)]
+    assert codec.projection({"name": 1}) == {"name": 1, "n": 1}
+    assert codec.update({"$set": {"tax": 2.0}, "$inc": {"_rev": 1}}) == {
+        "$set": {"t": 2.0, "v": 2},
+        "$inc": {"r": 1},
+    }
+    assert [index.document["name"] for index in codec.indexes(ITEM_INDEXES)] == [
+        "name_id_v2",
+        "price_id_v2",
+        "tax_id_v2",
+    ]
+    assert ItemCodec(FULL).encode(item) == item
+    with pytest.raises(ValueError):
+        ItemCodec.from_format("tiny")
+
+
+@pytest.mark.asyncio
+async def test_compact_items(compact_app):
+    """Items stored in the compact format look the same through the api"""
+
+    async with AsyncClient(app=compact_app, base_url="http://test") as client:
+        item_id = (await client.post("/items/", json=ITEM)).json()["_id"]
+        stored = await compact_app.state.collection.find_one({"_id": ObjectId(item_id)})
+        assert stored == {
+            "_id": ObjectId(item_id),
+            "n": "Fred",
+            "d": None,
+            "p": 5,
+            "t": 1.6,
+            "r": 1,
+            "v": 2,
+        }
+
+        response = await client.get(f"/items/{item_id}")
+        assert response.json() == {"_id": item_id, **ITEM}
+        assert response.headers["etag"] == '"1"'
+
+        response = await client.put(
+            f"/items/{item_id}", json={"price": 7}, headers={"If-Match": '"1"'}
+        )
+        assert response.status_code == 200
+        response = await client.get("/items/?price_gte=6&sort=-price&fields=name")
+        assert response.json() == [{"_id": item_id, "name": "Fred"}]
+        response = await client.get("/items/stats?price=7")
+        assert response.json()["price"] == {"min": 7, "max": 7, "avg": 7}
+
+        response = await client.delete(f"/items/{item_id}", headers={"If-Match": '"1"'})
+        assert response.status_code == 412
+        response = await client.delete(f"/items/{item_id}", headers={"If-Match": '"2"'})
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_full_items_are_upgraded(compact_app):
+    """Items still in the full format are read, and rewritten once touched"""
+
+    collection = compact_app.state.collection
+    read_id, write_id = ObjectId(), ObjectId()
+    await collection.insert_many(
+        [{"_id": read_id, **ITEM, "_rev": 3}, {"_id": write_id, **ITEM, "_rev": 1}]
+    )
+
+    async with AsyncClient(app=compact_app, base_url="http://test") as client:
+        response = await client.get(f"/items/{read_id}")
+        assert response.json() == {"_id": str(read_id), **ITEM}
+        assert response.headers["etag"] == '"3"'
+        assert (await collection.find_one({"_id": read_id}))["v"] == 2
+
+        response = await client.patch(
+            f"/items/{write_id}", json={"tax": 2.5}, headers={"If-Match": '"1"'}
+        )
+        assert response.status_code == 200
+        assert await collection.find_one({"_id": write_id}) == {
+            "_id": write_id,
+            "n": "Fred",
+            "d": None,
+            "p": 5,
+            "t": 2.5,
+            "r": 2,
+            "v": 2,
+        }
+
+
+@pytest.mark.asyncio
+async def test_migrate(compact_app):
+    """The migration rewrites every item in batches, and can be run back"""
+
+    collection = compact_app.state.collection
+    items = [{"_id": ObjectId(), **ITEM, "price": i, "_rev": 1} for i in range(5)]
+    await collection.insert_many([dict(item) for item in items])
+
+    assert await migrate(collection, ItemCodec(COMPACT), batch_size=2) == 5
+    assert await collection.count_documents({"v": 2}) == 5
+    # Nothing is left to do the second time
+    assert await migrate(collection, ItemCodec(COMPACT), batch_size=2) == 0
+
+    async with AsyncClient(app=compact_app, base_url="http://test") as client:
+        response = await client.get("/items/?price_gte=3&sort=price")
+        assert [item["price"] for item in response.json()] == [3, 4]
+
+    assert await migrate(collection, ItemCodec(FULL)) == 5
+    assert await collection.find({}).sort("_id", 1).to_list(length=None) == items
@@ -0,0 +1,158 @@
+"""This module contains PyTests for the write-behind batching of item creates"""
+import asyncio
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+from httpx import AsyncClient
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+from app.internal.write_batcher import WriteBatcher
+from app.repositories.memory_item_repository import MemoryItemRepository
+
+ITEM = {"name": "Fred", "description": "This is Fred item", "price": 5, "tax": 1.6}
+
+
+class FailingRepository(MemoryItemRepository):
+    """Repository whose insert_many loses the connection"""
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> None:
+        raise AutoReconnect("connection lost")
+
+
+@pytest_asyncio.fixture
+async def batching_app(app):
+    # pylint: disable=redefined-outer-name
+    """The app, with item creates batched 20 at a time"""
+    app.state.write_batcher = WriteBatcher(app.state.item_repository, 20, 0.005)
+    app.state.write_batcher.start()
+    yield app
+    await app.state.write_batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_inserts_are_batched():
+    """Concurrent inserts are written together, each caller getting its own _id"""
+
+    repository = MemoryItemRepository()
+    batcher = WriteBatcher(repository, max_batch=10, max_delay=0.05)
+    batcher.start()
+
+    ids = await asyncio.gather(*(batcher.insert(dict(ITEM)) for _ in range(25)))
+    await batcher.close()
+
+    assert len(set(ids)) == 25
+    assert await repository.existing_ids(ids) == set(ids)
+    stats = batcher.stats()
+    assert (stats["batches"], stats["documents"], stats["batch_size_max"]) == (
+        3,
+        25,
+        10,
+    )
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_is_flushed_after_the_delay():
+    """A batch that never fills is written once max_delay has passed"""
+
+    batcher = WriteBatcher(MemoryItemRepository(), max_batch=100, max_delay=0.01)
+    batcher.start()
+
+    item_id = await asyncio.wait_for(batcher.insert(dict(ITEM)), 1)
+    await batcher.close()
+
+    assert isinstance(item_id, ObjectId)
+    assert batcher.stats()["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_each_caller_gets_its_own_error():
+    """Only the caller whose item failed gets an error, the rest are written"""
+
+    repository = MemoryItemRepository()
+    existing = await repository.insert(dict(ITEM))
+    batcher = WriteBatcher(repository, max_batch=10, max_delay=0.01)
+    batcher.start()
+
+    results = await asyncio.gather(
+        batcher.insert(dict(ITEM)),
+        batcher.insert({**ITEM, "_id": existing}),
+        batcher.insert(dict(ITEM)),
+        return_exceptions=True,
+    )
+    await batcher.close()
+
+    assert isinstance(results[0], ObjectId)
+    assert isinstance(results[1], DuplicateKeyError)
+    assert isinstance(results[2], ObjectId)
+    assert batcher.stats()["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_caller():
+    """When the whole insert_many fails, every caller in the batch gets the error"""
+
+    batcher = WriteBatcher(FailingRepository(), max_batch=10, max_delay=0.01)
+    batcher.start()
+
+    results = await asyncio.gather(
+        *(batcher.insert(dict(ITEM)) for _ in range(3)), return_exceptions=True
+    )
+    await batcher.close()
+
+    assert all(isinstance(result, AutoReconnect) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_close_drains_the_queue():
+    """Closing writes everything already queued, then refuses new inserts"""
+
+    repository = MemoryItemRepository()
+    batcher = WriteBatcher(repository, max_batch=5, max_delay=10)
+    batcher.start()
+
+    pending = [asyncio.ensure_future(batcher.insert(dict(ITEM))) for _ in range(12)]
+    await asyncio.sleep(0)
+    await batcher.close()
+
+    ids = [task.result() for task in pending]
+    assert await repository.existing_ids(ids) == set(ids)
+    with pytest.raises(RuntimeError):
+        await batcher.insert(dict(ITEM))
+
+
+@pytest.mark.asyncio
+async def test_create_item_batched(batching_app):
+    # pylint: disable=redefined-outer-name
+    """Concurrent creates are batched, and each gets its own item back"""
+
+    async with AsyncClient(
+        app=batching_app, base_url="http://localhost:8000"
+    ) as async_client:
+        responses = await asyncio.gather(
+            *(async_client.post("/items/", json=ITEM) for _ in range(50))
+        )
+        assert all(response.status_code == 201 for response in responses)
+        ids = {response.json()["_id"] for response in responses}
+        assert len(ids) == 50
+
+        response = await async_client.post("/items/?return_item=True", json=ITEM)
+        assert response.status_code == 201
+        item_id = response.json()["_id"]
+        response = await async_client.get(f"/items/{item_id}")
+        assert response.json() == {**ITEM, "_id": item_id}
+
+        response = await async_client.get("/stats/writes")
+        assert response.status_code == 200
+        stats = response.json()
+        assert stats["documents"] == 51
+        assert stats["batches"] < 51
+
+
+@pytest.mark.asyncio
+async def test_write_stats_when_batching_is_off(app):
+    """Tests the write batching stats are not found when batching is off"""
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as async_client:
+        response = await async_client.get("/stats/writes")
+        assert response.status_code == 404
+        assert response.json() == "Write batching is not turned on"
@@ -0,0 +1 @@
+"""Benchmarks for the items api, these need a MongoDb (see CONNECTION_STRING)"""
@@ -0,0 +1,73 @@
+"""Measure the cold import time of app.main, as paid by a Lambda cold start
+
+Usage: python -m benchmarks.cold_start [--runs 10] [--max-ms 2500]
+
+Each run imports app.main in a fresh interpreter. Exits non zero when the
+median import time is over --max-ms, or when a module that should only be
+imported lazily (see LAZY_MODULES) is imported up front.
+
+Only motor is deferred. FastAPI (about half the time) and pymongo (about a
+quarter, pulled in by pydantic_mongo and the pymongo.errors the routers
+catch) are imported up front, as every route needs them. The default budget
+is about twice the median measured on a developer machine (~1.3s), so a
+regression that adds a heavy import fails, while a slower runner does not.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules that app.main must not import at cold start
+LAZY_MODULES = ("motor",)
+
+# Median import time allowed, in milliseconds
+MAX_MS = 2500
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - started
+loaded = [m for m in {LAZY_MODULES!r} if m in sys.modules]
+print(json.dumps({{"ms": elapsed * 1000, "loaded": loaded}}))
+"""
+
+
+def measure() -> dict:
+    """Import app.main in a fresh interpreter, returning its time and modules"""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], capture_output=True, check=True, text=True
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    """Parse the command line, run the probes and check the budget"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=MAX_MS)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    timings = [result["ms"] for result in results]
+    median = statistics.median(timings)
+    print(
+        f"import app.main: median {median:.0f}ms, "
+        f"min {min(timings):.0f}ms, max {max(timings):.0f}ms ({args.runs} runs, "
+        f"budget {args.max_ms:.0f}ms)"
+    )
+
+    failed = False
+    loaded = sorted({module for result in results for module in result["loaded"]})
+    if loaded:
+        print(f"FAIL: imported at cold start: {', '.join(loaded)}")
+        failed = True
+    if median > args.max_ms:
+        print(f"FAIL: median import time is over the {args.max_ms:.0f}ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare the CPU cost of compressing item listings with the bytes it saves
+
+Usage: python -m benchmarks.compression [--sizes 1 10 100 1000 5000]
+                                        [--levels gzip:1 gzip:6 br:4 zstd:3]
+
+Each listing is serialized as read_all_items would, then compressed whole with
+each encoding and level, and streamed (one chunk per item, as stream=true
+sends it). br and zstd are skipped if brotli or zstandard is not installed.
+
+Needs no database, the documents are generated in memory.
+"""
+import argparse
+import timeit
+from functools import partial
+from app.internal.compression import COMPRESSORS
+from app.internal.serialization import dumps
+from benchmarks.serialization import make_documents
+
+
+def compress(encoding: str, level: int, chunks: list[bytes]) -> bytes:
+    """Compress the chunks as the middleware does, returning the whole body"""
+    compressor = COMPRESSORS[encoding](level)
+    body = b"".join(compressor.compress(chunk) for chunk in chunks)
+    return body + compressor.flush()
+
+
+def per_call_us(func, number: int) -> float:
+    """Return the best time of a call in microseconds"""
+    timings = timeit.repeat(func, number=number, repeat=5)
+    return min(timings) / number * 1e6
+
+
+def main() -> None:
+    """Parse the command line and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 5000]
+    )
+    parser.add_argument(
+        "--levels",
+        nargs="+",
+        default=["gzip:1", "gzip:6", "gzip:9", "br:4", "br:11", "zstd:3", "zstd:19"],
+        help="encoding:level pairs to compare",
+    )
+    args = parser.parse_args()
+
+    levels = []
+    for pair in args.levels:
+        encoding, _, level = pair.partition(":")
+        if encoding not in COMPRESSORS:
+            print(f"Skipping {pair}, {encoding} is not installed")
+            continue
+        levels.append((encoding, int(level)))
+
+    print(
+        f"{'items':>6} {'encoding':<9} {'bytes':>9} {'compressed':>11} {'saved':>7}"
+        f" {'whole (us)':>11} {'stream (us)':>12} {'us/KB saved':>12}"
+    )
+    for size in args.sizes:
+        report(size, levels)
+
+
+def report(size: int, levels: list[tuple[str, int]]) -> None:
+    """Print the cost and savings of each level for a listing of size items"""
+    documents = make_documents(size)
+    body = dumps(documents)
+    # One chunk per item, the same as json_array_chunks
+    chunks = [b"[" + dumps(documents[0])] if documents else [b"["]
+    chunks += [b"," + dumps(document) for document in documents[1:]]
+    chunks.append(b"]")
+
+    number = max(1, 2000 // size)
+    for encoding, level in levels:
+        compressed = len(compress(encoding, level, [body]))
+        whole_us = per_call_us(partial(compress, encoding, level, [body]), number)
+        stream_us = per_call_us(partial(compress, encoding, level, chunks), number)
+        saved = len(body) - compressed
+        cost = whole_us / (saved / 1024) if saved > 0 else float("inf")
+        print(
+            f"{size:>6} {f'{encoding}:{level}':<9} {len(body):>9} {compressed:>11}"
+            f" {saved / len(body):>6.0%} {whole_us:>11.1f} {stream_us:>12.1f}"
+            f" {cost:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
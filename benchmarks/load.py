@@ -0,0 +1,427 @@
+"""Load test the items api, reporting latency percentiles and throughput as JSON
+
+Usage: python -m benchmarks.load [--target inprocess|uvicorn|serve] [--workers 1]
+                                 [--backend mongo|memory]
+                                 [--concurrency 1 10 50] [--requests 500]
+                                 [--write-batch-size 0] [--db-latency-ms 0]
+                                 [--db-pool-size 0] [--max-in-flight N]
+                                 [--backoff-ms 0]
+                                 [--output results.json] [--baseline baseline.json]
+
+Each endpoint (read_item, read_all_items, create_item, put_item, delete_item)
+is driven by --concurrency concurrent clients until --requests have been made,
+for each concurrency level in turn.
+
+--target inprocess calls the app through httpx's ASGI transport, uvicorn serves
+it over HTTP on localhost (from a thread in this process, so it can share the
+in-memory backend). --target serve starts python -m app.serve with --workers
+processes, to compare against a single worker; it needs --backend mongo for
+more than one worker, and the items go to the benchmark collection through
+ITEM_COLLECTION. --backend memory stores the items in process (the same
+as ITEM_BACKEND=memory), so no database is needed. --db-latency-ms adds a
+delay to each of its calls (other than find), standing in for the round trip
+to a remote MongoDb, and --db-pool-size lets only that many calls run at once,
+as a connection pool would.
+
+Admission control is off unless ADMISSION_MAX_IN_FLIGHT is set, so the runs
+measure the store rather than the rejections. --max-in-flight replaces the
+global admission gate (0 takes it away), with
+--queue-size and --queue-timeout-ms. To see overload, push --concurrency well
+past the pool size, e.g. --backend memory --db-latency-ms 10 --db-pool-size 10
+--concurrency 400, with --max-in-flight 0 and then --max-in-flight 20. A
+client turned away waits --backoff-ms before trying again, as a client honouring
+Retry-After would, rather than spinning on the 503s.
+
+--write-batch-size turns on the write batching of create_item (the same as
+ITEM_WRITE_BATCH_SIZE), with --write-batch-delay-ms. --db-latency-ms is not
+applied by --target serve.
+
+With --baseline the results are compared against a previous --output, and the
+command exits non zero if p99 latency or requests/sec regressed by more than
+--tolerance.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import random
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager, nullcontext
+import httpx
+import uvicorn
+from app.main import app_factory, app_startup, app_shutdown
+from app.internal.admission import Gate
+from app.internal.mongo import DATABASE_NAME
+from app.internal.write_batcher import WriteBatcher
+from app.repositories.mongo_item_repository import MongoItemRepository
+
+BENCH_COLLECTION = "bench-load"
+SEED_ITEMS = 1000
+
+ITEM = {"name": "Fred", "description": "This is Fred item", "price": 5, "tax": 1.6}
+
+
+class DelayedRepository:
+    # pylint: disable=too-few-public-methods
+    """Wraps a repository, sleeping for latency seconds before each call
+
+    With a pool_size, at most that many calls are in progress at once and the
+    rest wait their turn, like requests waiting for a pooled connection
+    """
+
+    def __init__(self, repository, latency: float, pool_size: int = 0):
+        self.repository = repository
+        self.latency = latency
+        self.pool = asyncio.Semaphore(pool_size) if pool_size else nullcontext()
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+        if not inspect.iscoroutinefunction(method):
+            return method
+
+        async def delayed(*args, **kwargs):
+            async with self.pool:
+                await asyncio.sleep(self.latency)
+                return await method(*args, **kwargs)
+
+        return delayed
+
+
+async def setup_backend(app, args) -> None:
+    """Start the app, pointing MongoDb at the benchmark collection"""
+    await app_startup(app)
+    if app.state.backend == "mongo":
+        app.state.collection = app.state.database[BENCH_COLLECTION]
+        app.state.item_repository = MongoItemRepository(app.state.collection)
+        await app.state.collection.delete_many({})
+    elif args.db_latency_ms:
+        app.state.item_repository = DelayedRepository(
+            app.state.item_repository, args.db_latency_ms / 1000, args.db_pool_size
+        )
+
+    # Without --max-in-flight the admission control is left as the environment set it
+    if args.max_in_flight is not None:
+        app.state.admission.gate = (
+            Gate(
+                "global",
+                args.max_in_flight,
+                args.queue_size,
+                args.queue_timeout_ms / 1000,
+            )
+            if args.max_in_flight > 0
+            else None
+        )
+
+    # Replace the batcher started from the environment, it holds the repository.
+    # The client starts it, on the event loop that serves the requests
+    if app.state.write_batcher is not None:
+        await app.state.write_batcher.close()
+    app.state.write_batcher = None
+    if args.write_batch_size:
+        app.state.write_batcher = WriteBatcher(
+            app.state.item_repository,
+            args.write_batch_size,
+            args.write_batch_delay_ms / 1000,
+        )
+
+
+@asynccontextmanager
+async def inprocess_client(app):
+    """Yield a client calling the app in process"""
+    if app.state.write_batcher is not None:
+        app.state.write_batcher.start()
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        yield client
+
+
+@asynccontextmanager
+async def uvicorn_client(app):
+    """Serve the app with uvicorn on a free port, yielding a client for it"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    config = uvicorn.Config(app, port=port, lifespan="off", log_level="warning")
+    server = uvicorn.Server(config)
+
+    async def serve():
+        # The batcher's task has to run on the server's loop, not this one
+        batcher = app.state.write_batcher
+        if batcher is not None:
+            batcher.start()
+        try:
+            await server.serve()
+        finally:
+            if batcher is not None:
+                await batcher.close()
+
+    def run_server():
+        config.setup_event_loop()
+        asyncio.run(serve())
+
+    thread = threading.Thread(target=run_server, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits
+        ) as client:
+            yield client
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+@asynccontextmanager
+async def serve_client(args):
+    """Serve the app with python -m app.serve, yielding a client for it"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    env = {
+        **os.environ,
+        "ITEM_BACKEND": args.backend,
+        "ITEM_COLLECTION": BENCH_COLLECTION,
+        "ITEM_WRITE_BATCH_SIZE": str(args.write_batch_size),
+        "ITEM_WRITE_BATCH_DELAY_MS": str(args.write_batch_delay_ms),
+    }
+    command = [sys.executable, "-m", "app.serve", "--host", "127.0.0.1"]
+    command += ["--port", str(port), "--workers", str(args.workers)]
+    # pylint: disable-next=consider-using-with
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits
+        ) as client:
+            while True:
+                try:
+                    await client.get("/items/cache/stats")
+                    break
+                except httpx.TransportError:
+                    if process.poll() is not None:
+                        raise RuntimeError("python -m app.serve exited") from None
+                    await asyncio.sleep(0.1)
+            yield client
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def seed_ids(client: httpx.AsyncClient, count: int) -> list[str]:
+    """Create count items, returning their ids"""
+    ids = []
+    for start in range(0, count, 500):
+        batch = [ITEM] * min(500, count - start)
+        response = await client.post("/items/bulk", json=batch)
+        ids.extend(result["_id"] for result in response.json())
+    return ids
+
+
+def scenarios(ids: list[str]) -> dict:
+    """Return, for each endpoint, a function building its n'th request"""
+    return {
+        "read_item": lambda n: ("GET", f"/items/{random.choice(ids)}", None),
+        "read_all_items": lambda n: ("GET", "/items/?limit=20", None),
+        "create_item": lambda n: ("POST", "/items/", ITEM),
+        "put_item": lambda n: (
+            "PUT",
+            f"/items/{random.choice(ids)}",
+            {"price": n % 11},
+        ),
+    }
+
+
+async def run_level(
+    client: httpx.AsyncClient, build, concurrency: int, requests: int, backoff: float
+) -> dict:
+    """Make requests with concurrency clients, returning the latency summary
+
+    A client that is turned away waits around backoff seconds (jittered, so the
+    clients do not all come back at once) before its next request
+    """
+    latencies = []
+    # Latencies of the requests that were not rejected
+    admitted = []
+    errors = 0
+    # Turned away by the admission control, counted in the errors as well
+    rejected = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, rejected
+        for index in counter:
+            method, url, body = build(index)
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+            if response.status_code in (429, 503):
+                rejected += 1
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            else:
+                admitted.append(latencies[-1])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rejected": rejected,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "admitted_p99_ms": round(_percentile(admitted, 99), 3),
+    }
+
+
+def _percentile(latencies: list[float], percent: int) -> float:
+    """Return a percentile of the latencies, 0 if there are too few of them"""
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def run(args) -> dict:
+    """Run every scenario at every concurrency level"""
+    app = app_factory(backend=args.backend)
+    await setup_backend(app, args)
+    if args.target == "serve":
+        make_client = serve_client(args)
+    elif args.target == "uvicorn":
+        make_client = uvicorn_client(app)
+    else:
+        make_client = inprocess_client(app)
+
+    results = []
+    async with make_client as client:
+        ids = await seed_ids(client, SEED_ITEMS)
+        for endpoint, build in scenarios(ids).items():
+            for concurrency in args.concurrency:
+                result = await run_level(
+                    client, build, concurrency, args.requests, args.backoff_ms / 1000
+                )
+                results.append({"endpoint": endpoint, **result})
+                print(json.dumps(results[-1]), file=sys.stderr)
+
+        # Every delete needs an item of its own, so create them up front
+        for concurrency in args.concurrency:
+            delete_ids = await seed_ids(client, args.requests)
+            result = await run_level(
+                client,
+                lambda n, ids=delete_ids: ("DELETE", f"/items/{ids[n]}", None),
+                concurrency,
+                args.requests,
+                args.backoff_ms / 1000,
+            )
+            results.append({"endpoint": "delete_item", **result})
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    if args.backend == "mongo":
+        await app.state.collection.delete_many({})
+    await app_shutdown(app)
+
+    return {
+        "meta": {
+            "target": args.target,
+            "workers": args.workers,
+            "backend": args.backend,
+            "requests": args.requests,
+            "write_batch_size": args.write_batch_size,
+            "db_latency_ms": args.db_latency_ms,
+            "db_pool_size": args.db_pool_size,
+            "max_in_flight": args.max_in_flight,
+            "python": platform.python_version(),
+            "collection": f"{DATABASE_NAME}.{BENCH_COLLECTION}",
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return the regressions of report against baseline"""
+    for key in ("target", "workers", "backend", "write_batch_size", "db_latency_ms"):
+        if report["meta"].get(key) != baseline["meta"].get(key):
+            print(
+                f"WARNING: comparing {key} {report['meta'][key]} against "
+                f"a baseline run with {baseline['meta'].get(key)}",
+                file=sys.stderr,
+            )
+    previous = {
+        (result["endpoint"], result["concurrency"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["endpoint"], result["concurrency"]))
+        if before is None:
+            continue
+        label = f"{result['endpoint']} @ {result['concurrency']}"
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{label}: p99 {before['p99_ms']}ms -> {result['p99_ms']}ms"
+            )
+        if result["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{label}: rps {before['rps']} -> {result['rps']}")
+    return regressions
+
+
+def main() -> None:
+    """Parse the command line, run the load test and check the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--target", choices=["inprocess", "uvicorn", "serve"], default="inprocess"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--write-batch-size", type=int, default=0)
+    parser.add_argument("--write-batch-delay-ms", type=float, default=5)
+    parser.add_argument("--db-latency-ms", type=float, default=0)
+    parser.add_argument("--db-pool-size", type=int, default=0)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--queue-timeout-ms", type=float, default=1000)
+    parser.add_argument("--backoff-ms", type=float, default=0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare skip/limit paging with keyset paging at increasing page depths
+
+Usage: python -m benchmarks.pagination [--page-size 5] [--pages 1 10 100 1000 10000]
+
+Seeds a benchmark collection with enough items to reach the deepest page, then
+times fetching each page through the GET /items/ endpoint, both with skip and
+with the after cursor. Skip paging grows with the page depth, keyset paging
+should stay flat.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from httpx import AsyncClient
+from app.main import app_factory, app_startup, app_shutdown
+from app.internal.pagination import Cursor
+from app.repositories.mongo_item_repository import MongoItemRepository
+
+BENCH_COLLECTION = "bench-pagination"
+
+
+async def seed(collection, count: int) -> None:
+    """Make sure the benchmark collection holds exactly count items"""
+    if await collection.count_documents({}) == count:
+        return
+    await collection.delete_many({})
+    batch = []
+    for i in range(count):
+        batch.append(
+            {"name": f"item {i}", "description": None, "price": i % 11, "tax": 1.5}
+        )
+        if len(batch) == 10000:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def time_request(client: AsyncClient, url: str, repeat: int) -> float:
+    """Return the median latency (ms) of fetching url"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    return statistics.median(timings)
+
+
+async def run(page_size: int, pages: list[int], repeat: int) -> None:
+    """Run the benchmark and print a table of page depth against latency"""
+    app = app_factory(backend="mongo")
+    await app_startup(app)
+    app.state.collection = app.state.database[BENCH_COLLECTION]
+    app.state.item_repository = MongoItemRepository(app.state.collection)
+    await seed(app.state.collection, page_size * max(pages))
+
+    print(f"{'page':>8} {'skip (ms)':>12} {'keyset (ms)':>12}")
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        for page in pages:
+            skip = (page - 1) * page_size
+            skip_ms = await time_request(
+                client, f"/items/?skip={skip}&limit={page_size}", repeat
+            )
+
+            # Position a cursor on the last item of the previous page (untimed)
+            url = f"/items/?order_by=_id&limit={page_size}"
+            if skip:
+                previous = await app.state.collection.find_one(
+                    {}, sort=[("_id", 1)], skip=skip - 1
+                )
+                token = Cursor("_id", 1).advance(previous).encode()
+                url = f"/items/?after={token}&limit={page_size}"
+            keyset_ms = await time_request(client, url, repeat)
+
+            print(f"{page:>8} {skip_ms:>12.2f} {keyset_ms:>12.2f}")
+
+    await app_shutdown(app)
+
+
+def main() -> None:
+    """Parse the command line and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=5)
+    parser.add_argument(
+        "--pages", type=int, nargs="+", default=[1, 10, 100, 1000, 10000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.page_size, args.pages, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
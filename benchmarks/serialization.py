@@ -0,0 +1,89 @@
+"""Compare the jsonable_encoder response path with the fast serialization path
+
+Usage: python -m benchmarks.serialization [--sizes 1 100 1000]
+
+Needs no database, the documents are generated in memory.
+"""
+import argparse
+import timeit
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.internal.serialization import FastJSONResponse, item_response
+from app.models.item_response import ItemResponse
+
+
+def make_documents(count: int) -> list[dict]:
+    """Return count documents shaped like those in the items collection"""
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"item {i}",
+            "description": "A description of the item",
+            "price": i % 11,
+            "tax": 1.6,
+        }
+        for i in range(count)
+    ]
+
+
+def old_list(documents: list[dict]) -> bytes:
+    """The list endpoint before the fast path"""
+    return JSONResponse(
+        content=jsonable_encoder(documents, custom_encoder={ObjectId: str})
+    ).body
+
+
+def new_list(documents: list[dict]) -> bytes:
+    """The list endpoint with the fast path"""
+    return FastJSONResponse(content=documents).body
+
+
+def old_items(documents: list[dict]) -> list[bytes]:
+    """The single item endpoints before the fast path"""
+    return [
+        JSONResponse(content=jsonable_encoder(ItemResponse(**document))).body
+        for document in documents
+    ]
+
+
+def new_items(documents: list[dict]) -> list[bytes]:
+    """The single item endpoints with the fast path"""
+    return [
+        FastJSONResponse(content=item_response(document)).body for document in documents
+    ]
+
+
+def per_call_us(func, documents: list[dict], number: int) -> float:
+    """Return the best time of a call in microseconds"""
+    timings = timeit.repeat(lambda: func(documents), number=number, repeat=5)
+    return min(timings) / number * 1e6
+
+
+def main() -> None:
+    """Parse the command line and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1000])
+    args = parser.parse_args()
+
+    print(f"{'path':<6} {'items':>6} {'old (us)':>12} {'new (us)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        documents = make_documents(size)
+        assert old_list(documents) == new_list(documents)
+        assert old_items(documents) == new_items(documents)
+
+        number = max(1, 10000 // size)
+        for path, old, new in (
+            ("list", old_list, new_list),
+            ("item", old_items, new_items),
+        ):
+            old_us = per_call_us(old, documents, number)
+            new_us = per_call_us(new, documents, number)
+            print(
+                f"{path:<6} {size:>6} {old_us:>12.1f} {new_us:>12.1f}"
+                f" {old_us / new_us:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
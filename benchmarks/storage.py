@@ -0,0 +1,88 @@
+"""Compare the size and read cost of items stored in the full and compact formats
+
+Usage: python -m benchmarks.storage [--count 10000]
+
+Each item is stored as the codec encodes it, and the BSON size of the
+documents is compared. Reads are timed from BSON bytes to the decoded item, as
+the driver and MongoItemRepository do for each document read.
+
+Needs no database, unless CONNECTION_STRING is set: then the items are also
+inserted into a scratch collection in each format, and its average object and
+index sizes, and a full scan, are measured on the server.
+"""
+import argparse
+import asyncio
+import os
+import timeit
+from functools import partial
+import bson
+from app.internal.mongo import DATABASE_NAME, PoolMonitor, create_client
+from app.models.item_indexes import ITEM_INDEXES
+from app.repositories.item_codec import COMPACT, FULL, ItemCodec
+from benchmarks.serialization import make_documents
+
+FORMATS = {"full": ItemCodec(FULL), "compact": ItemCodec(COMPACT)}
+
+
+def read(codec: ItemCodec, stored: list[bytes]) -> list[dict]:
+    """Decode each stored document into an item"""
+    return [codec.decode(bson.decode(document)) for document in stored]
+
+
+def report(count: int) -> None:
+    """Print the size and read time of count items in each format"""
+    items = [{**item, "_rev": 1} for item in make_documents(count)]
+    print(f"{'format':<8} {'bytes/item':>11} {'total KB':>9} {'read (us/item)':>15}")
+    for name, codec in FORMATS.items():
+        stored = [bson.encode(codec.encode(item)) for item in items]
+        assert read(codec, stored) == items
+        size = sum(len(document) for document in stored)
+        seconds = min(timeit.repeat(partial(read, codec, stored), number=1, repeat=5))
+        print(
+            f"{name:<8} {size / count:>11.1f} {size / 1024:>9.0f}"
+            f" {seconds / count * 1e6:>15.2f}"
+        )
+
+
+async def report_server(count: int) -> None:
+    """Print the server side sizes, and full scan time, of each format"""
+    client = create_client(os.getenv("CONNECTION_STRING"), PoolMonitor())
+    database = client[DATABASE_NAME]
+    items = make_documents(count)
+    print(f"{'format':<8} {'avgObjSize':>11} {'indexes KB':>11} {'scan (ms)':>10}")
+    try:
+        for name, codec in FORMATS.items():
+            collection = database[f"benchmark-storage-{name}"]
+            await collection.drop()
+            await collection.insert_many(
+                [codec.encode({**item, "_rev": 1}) for item in items]
+            )
+            await collection.create_indexes(codec.indexes(ITEM_INDEXES))
+            stats = await database.command("collStats", collection.name)
+
+            started = asyncio.get_running_loop().time()
+            async for document in collection.find({}):
+                codec.decode(document)
+            scan = asyncio.get_running_loop().time() - started
+            print(
+                f"{name:<8} {stats['avgObjSize']:>11} "
+                f"{stats['totalIndexSize'] / 1024:>11.0f} {scan * 1000:>10.1f}"
+            )
+            await collection.drop()
+    finally:
+        client.close()
+
+
+def main() -> None:
+    """Parse the command line and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    report(args.count)
+    if os.getenv("CONNECTION_STRING"):
+        asyncio.run(report_server(args.count))
+
+
+if __name__ == "__main__":
+    main()